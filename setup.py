@@ -26,7 +26,7 @@ setup( name="spacetimegrid",
        version="0.2",
        zip_safe = True,
        entry_points = { 'console_scripts': [ 'stg = stg.space_time_gridding:main', 'stg_plot = stg.plot_tools:main' ] },
-       packages = ['stg'], #find_packages('.'),
+       packages = ['stg', 'stg.guidebooks'], #find_packages('.'),
        install_requires=[ 'numpy', 'scipy', 'keoni' ],
        #package_data = {'': ['*.txt', '*.gif']}
        )
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+This module handles the catalog of input files. The catalog is a small
+SQLite database that records what we know about each input file (it's
+satellite and instrument, start time, variables, and the longitude/latitude
+box it covers), so that runs over a region or a window of time can pick
+out the files they need without opening all of them.
+
+:author:       Eva Schiffer (evas)
+:contact:      eva.schiffer@ssec.wisc.edu
+:organization: Space Science and Engineering Center (SSEC)
+:copyright:    Copyright (c) 2014 University of Wisconsin SSEC. All rights reserved.
+:date:         Jan 2014
+:license:      GNU GPLv3
+
+Copyright (C) 2014 Space Science and Engineering Center (SSEC),
+ University of Wisconsin-Madison.
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import logging
+import sqlite3
+
+import numpy
+
+from stg.constants import *
+import stg.general_guidebook as general_guidebook
+import stg.io_manager        as io_manager
+
+LOG = logging.getLogger(__name__)
+
+# the format times are stored in; it sorts the same way the times do
+CATALOG_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# separates the variable names stored for each file
+VARIABLE_SEPARATOR  = ","
+
+CATALOG_SCHEMA      = """
+CREATE TABLE IF NOT EXISTS granules (
+    file_path  TEXT PRIMARY KEY,
+    directory  TEXT,
+    file_name  TEXT,
+    size       INTEGER,
+    mtime      REAL,
+    satellite  TEXT,
+    instrument TEXT,
+    start_time TEXT,
+    variables  TEXT,
+    min_lon    REAL,
+    max_lon    REAL,
+    min_lat    REAL,
+    max_lat    REAL
+);
+CREATE INDEX IF NOT EXISTS granules_by_time ON granules (directory, start_time);
+"""
+
+def open_catalog (catalog_path) :
+    """
+    open the catalog at the given path, creating it if it doesn't exist yet
+    """
+    
+    connection = sqlite3.connect(catalog_path)
+    connection.executescript(CATALOG_SCHEMA)
+    
+    return connection
+
+def catalog_file (connection, file_path, min_scan_angle=None) :
+    """
+    read the information about one input file and add it to the catalog, replacing anything
+    that was recorded about it before
+    
+    the file's longitude and latitude are read to find the box it covers; if the file
+    has no valid navigation the box is left empty
+    """
+    
+    file_path  = os.path.abspath(file_path)
+    file_name  = os.path.basename(file_path)
+    file_stats = os.stat(file_path)
+    
+    LOG.debug("Cataloging file: " + file_path)
+    
+    # some file names don't tell us which satellite they're from
+    try :
+        satellite, instrument = general_guidebook.get_satellite_from_filename(file_name)
+    except (KeyError, IndexError, ValueError) :
+        satellite, instrument = None, None
+    
+    start_time = general_guidebook.parse_datetime_from_filename(file_name)
+    start_time = start_time.strftime(CATALOG_TIME_FORMAT) if start_time is not None else None
+    variables  = VARIABLE_SEPARATOR.join(sorted(general_guidebook.get_variable_names(file_name)))
+    
+    # figure out the box the file covers
+    file_object, aux_data = io_manager.load_aux_data(file_path, min_scan_angle)
+    io_manager.close_file(file_path, file_object)
+    longitude  = aux_data[LON_KEY][numpy.isfinite(aux_data[LON_KEY])]
+    latitude   = aux_data[LAT_KEY][numpy.isfinite(aux_data[LAT_KEY])]
+    bounds     = [None, None, None, None]
+    if (longitude.size > 0) and (latitude.size > 0) :
+        bounds = [float(longitude.min()), float(longitude.max()), float(latitude.min()), float(latitude.max())]
+    
+    connection.execute("INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       [file_path, os.path.dirname(file_path), file_name, file_stats.st_size, file_stats.st_mtime,
+                        satellite, instrument, start_time, variables] + bounds)
+
+def update_catalog (connection, input_path, min_scan_angle=None) :
+    """
+    add the files in the input directory to the catalog
+    
+    files that are already in the catalog are only read again if their size or modification
+    time changed, files we don't know how to read are skipped, and files that no longer
+    exist are removed from the catalog; returns the number of files that were (re)cataloged
+    """
+    
+    input_path = os.path.abspath(input_path)
+    known      = dict([(row[0], (row[1], row[2])) for row in
+                       connection.execute("SELECT file_name, size, mtime FROM granules WHERE directory = ?", [input_path])])
+    
+    num_cataloged = 0
+    file_names    = sorted(os.listdir(input_path))
+    for file_name in file_names :
+        
+        file_path  = os.path.join(input_path, file_name)
+        file_stats = os.stat(file_path)
+        if known.get(file_name) == (file_stats.st_size, file_stats.st_mtime) :
+            continue
+        
+        try :
+            general_guidebook.get_variable_names(file_name)
+        except RuntimeError :
+            LOG.debug("Not cataloging unknown file: " + file_path)
+            continue
+        
+        catalog_file(connection, file_path, min_scan_angle=min_scan_angle)
+        num_cataloged += 1
+    
+    # forget about files that are gone
+    for file_name in set(known.keys()) - set(file_names) :
+        connection.execute("DELETE FROM granules WHERE file_path = ?", [os.path.join(input_path, file_name)])
+    
+    connection.commit()
+    
+    return num_cataloged
+
+def find_granules (connection, input_path, start_time=None, end_time=None, bbox=None) :
+    """
+    find the cataloged files in the input directory that start in the given time window and overlap the box
+    
+    the window includes it's start time but not it's end time; either end may be None to leave
+    it open. The box is (west longitude, south latitude, east longitude, north latitude), and
+    wraps across the date line if west is greater than east. Files
+    with no start time or no navigation are always included, since we can't rule them out.
+    returns a sorted list of file names
+    """
+    
+    query      = "SELECT file_name FROM granules WHERE directory = ?"
+    parameters = [os.path.abspath(input_path)]
+    
+    if start_time is not None :
+        query += " AND (start_time IS NULL OR start_time >= ?)"
+        parameters.append(start_time.strftime(CATALOG_TIME_FORMAT))
+    if end_time is not None :
+        query += " AND (start_time IS NULL OR start_time < ?)"
+        parameters.append(end_time.strftime(CATALOG_TIME_FORMAT))
+    if bbox is not None :
+        west, south, east, north = bbox
+        # a box that wraps across the date line overlaps anything east of it's west edge or west of it's east edge
+        lon_join = "OR" if west > east else "AND"
+        query += " AND (min_lon IS NULL OR ((max_lon >= ? " + lon_join + " min_lon <= ?) AND max_lat >= ? AND min_lat <= ?))"
+        parameters.extend([west, east, south, north])
+    
+    return sorted([row[0] for row in connection.execute(query, parameters)])
@@ -41,4 +41,12 @@ INST_MODIS      = "modis"
 LON_KEY         = "longitude"
 LAT_KEY         = "latitude"
 DAY_MASK_KEY    = "day_mask"
-NIGHT_MASK_KEY  = "night_mask"
\ No newline at end of file
+NIGHT_MASK_KEY  = "night_mask"
+
+DAY_KEY         = "day"
+NIGHT_KEY       = "night"
+
+DAY_LON_INDEX_KEY   = "day_lon_index"
+DAY_LAT_INDEX_KEY   = "day_lat_index"
+NIGHT_LON_INDEX_KEY = "night_lon_index"
+NIGHT_LAT_INDEX_KEY = "night_lat_index"
@@ -14,27 +14,72 @@ dry.py is a basic module to keep us from repeating ourselves.
 __docformat__ = "restructuredtext en"
 
 import importlib
-import os, sys
+import os
 import logging
 
+import pkg_resources
+
 LOG = logging.getLogger(__name__)
 
+# the modules found for each directory, keyed on the directory name
+_MODULE_REGISTRY = { }
+
+# the module that matched each test, keyed on (directory name, test function name, test data)
+_MATCH_CACHE = { }
+
+def get_modules(path):
+  """
+  Return the modules in the given directory of this package, along with
+  any modules registered under the "stg.<path>" setuptools entry point group.
+
+  The directory is only searched and the modules are only imported the first
+  time this is called for each path.
+  """
+  if path in _MODULE_REGISTRY:
+    return _MODULE_REGISTRY[path]
+
+  modules = [ ]
+
+  # import the modules that live in the directory as part of our package
+  package_name = __name__.rsplit('.', 1)[0] + "." + path.strip("/").replace("/", ".")
+  relpath = os.path.join(os.path.dirname(__file__), path)
+  for module in sorted(os.listdir(relpath)):
+    if module == '__init__.py' or module[-3:] != '.py':
+      continue
+    modules.append(importlib.import_module(package_name + "." + module[:-3]))
+
+  # add any modules other packages have registered
+  for entry_point in pkg_resources.iter_entry_points("stg." + path.strip("/").replace("/", ".")):
+    try:
+      mod = entry_point.load()
+    except Exception:
+      LOG.warn("Unable to load module from entry point: %s" % entry_point, exc_info=True)
+      continue
+    if mod not in modules:
+      modules.append(mod)
+
+  LOG.debug("Found modules for %s: %s" % (path, ", ".join(mod.__name__ for mod in modules)))
+  _MODULE_REGISTRY[path] = modules
+
+  return modules
+
 def dry(path, test_function, test_data):
   """
   Given a directory full of similar modules, find the one that matches
   our test case and return it.
 
-  FIXME: is there really not a better way to do test-and-load?
+  The match for each test is remembered, so asking about the same test
+  data again doesn't run the tests again.
   """
-  relpath = os.path.dirname(__file__) + "/" + path
-  sys.path.insert(0, relpath)
-  for module in os.listdir(relpath):
-    if module == '__init__.py' or module[-3:] != '.py':
-      continue
-    mod = importlib.import_module(module[:-3])
+  key = (path, test_function, test_data)
+  if key in _MATCH_CACHE:
+    return _MATCH_CACHE[key]
+
+  for mod in get_modules(path):
     f = getattr(mod, test_function)
     if f(test_data):
-      print "Returning ", mod
+      LOG.debug("Using %s for %s" % (mod.__name__, test_data))
+      _MATCH_CACHE[key] = mod
       return mod
-  LOG.error("No modules match: ", path, test_function, test_data)
-  raise RuntimeError
\ No newline at end of file
+  LOG.error("No modules match: %s %s %s" % (path, test_function, test_data))
+  raise RuntimeError("No modules in %s match %s" % (path, test_data))
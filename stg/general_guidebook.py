@@ -19,7 +19,7 @@ from constants import *
 import sys
 import logging
 
-from stg.dry import dry
+from stg.dry import dry, get_modules
 
 LOG = logging.getLogger(__name__)
 
@@ -61,6 +61,45 @@ def get_variable_names (file_path, user_requested_names=[ ]) :
 
     return var_names
 
+def get_variable_names_in_any_file (user_requested_names) :
+    """get the variable names the user requested names could mean in any kind of file we know about
+    (ie. for working with files we've already made, when there is no input file to ask about)
+    """
+    
+    var_names = set ( )
+    
+    for guidebook in get_modules('guidebooks') :
+        var_names.update(guidebook.get_variable_names(user_requested_names))
+    
+    return var_names
+
+def get_histogram_bin_edges (file_path, variable_name) :
+    """get the histogram bin edges to use for a variable from the file
+    if the variable should not be made into histograms None will be returned
+    """
+    
+    guidebook = dry('guidebooks', 'is_my_file', file_path)
+    
+    return guidebook.get_histogram_bin_edges(variable_name)
+
+def get_joint_histogram_bin_edges (file_path, variable_name) :
+    """get the bin edges to use for a variable in joint histograms from the file
+    if the variable should not be made into joint histograms None will be returned
+    """
+    
+    guidebook = dry('guidebooks', 'is_my_file', file_path)
+    
+    return guidebook.get_joint_histogram_bin_edges(variable_name)
+
+def get_category_values (file_path, variable_name) :
+    """get the category values to count for a flag variable from the file
+    if the variable is not a flag variable None will be returned
+    """
+    
+    guidebook = dry('guidebooks', 'is_my_file', file_path)
+    
+    return guidebook.get_category_values(variable_name)
+
 def main():
     import optparse
     from pprint import pprint
@@ -0,0 +1,914 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+This module handles fixed size per grid cell accumulators. Each accumulator
+summarizes the observations that fall in each cell of a space grid, so that
+it uses memory in proportion to the number of grid cells rather than the
+number of observations, and accumulators for different granules, days, or
+months can be merged together.
+
+Accumulators are dictionaries of named arrays. Arrays that describe the grid
+are shaped (layers, grid_lon_size, grid_lat_size), the same way the flat binary
+cubes are stored on disk.
+
+:author:       Eva Schiffer (evas)
+:contact:      eva.schiffer@ssec.wisc.edu
+:organization: Space Science and Engineering Center (SSEC)
+:copyright:    Copyright (c) 2014 University of Wisconsin SSEC. All rights reserved.
+:date:         Jan 2014
+:license:      GNU GPLv3
+
+Copyright (C) 2014 Space Science and Engineering Center (SSEC),
+ University of Wisconsin-Madison.
+"""
+__docformat__ = "restructuredtext en"
+
+import numpy
+import logging
+
+from stg.constants import *
+
+LOG = logging.getLogger(__name__)
+
+# the names of the fields in a moment accumulator
+NOBS_FIELD  = "nobs"
+COUNT_FIELD = "count"
+SUM_FIELD   = "sum"
+M2_FIELD    = "m2"
+MIN_FIELD   = "min"
+MAX_FIELD   = "max"
+MOMENT_FIELDS = [NOBS_FIELD, COUNT_FIELD, SUM_FIELD, M2_FIELD, MIN_FIELD, MAX_FIELD]
+
+def create_moment_accumulator (grid_lon_size, grid_lat_size) :
+    """
+    create an empty moment accumulator for a grid of the given size
+    
+    the accumulator holds the number of observations (nobs), the number of finite
+    observations (count), their sum, the sum of squared differences from their mean (m2),
+    and their min and max for each cell
+    """
+    
+    shape = (1, grid_lon_size, grid_lat_size)
+    
+    accumulator = {
+                    NOBS_FIELD:  numpy.zeros(shape, dtype=numpy.float64),
+                    COUNT_FIELD: numpy.zeros(shape, dtype=numpy.int64),
+                    SUM_FIELD:   numpy.zeros(shape, dtype=numpy.float64),
+                    M2_FIELD:    numpy.zeros(shape, dtype=numpy.float64),
+                    MIN_FIELD:   numpy.empty(shape, dtype=numpy.float32),
+                    MAX_FIELD:   numpy.empty(shape, dtype=numpy.float32),
+                  }
+    accumulator[MIN_FIELD].fill(numpy.nan)
+    accumulator[MAX_FIELD].fill(numpy.nan)
+    
+    return accumulator
+
+def calculate_moment_accumulator (grid_lon_size, grid_lat_size, sorted_values, sorted_cell_ids, nobs_cells=None, nobs_counts=None) :
+    """
+    given finite values sorted by cell and their flattened cell ids, create a sparse moment
+    accumulator for them, covering only the cells they fall in (see expand_accumulator)
+    
+    the sorted values and cell ids are the same ones space_gridding.ragged_grid_data returns;
+    if the sorted ids of the cells the granule touched and the number of observations in
+    each are given (see space_gridding.calculate_granule_layout), the accumulator covers
+    those cells and holds their nobs, otherwise the nobs are left as zero
+    """
+    
+    if nobs_cells is None :
+        touched_cells, local_ids = _find_touched_cells(sorted_cell_ids)
+        nobs = numpy.zeros(touched_cells.size, dtype=numpy.float64)
+    else :
+        # every cell with finite values has observations, so it's one of the nobs cells
+        touched_cells = numpy.asarray(nobs_cells, dtype=numpy.int64)
+        local_ids     = numpy.searchsorted(touched_cells, sorted_cell_ids)
+        nobs          = numpy.asarray(nobs_counts, dtype=numpy.float64)
+    num_cells = touched_cells.size
+    
+    # the fields of a sparse accumulator have one column for each touched cell
+    accumulator = dict([(field_name, field_data.reshape((1, num_cells)))
+                        for field_name, field_data in create_moment_accumulator(1, num_cells).items()])
+    accumulator[NOBS_FIELD][0]      = nobs
+    accumulator[SPARSE_CELLS_FIELD] = touched_cells
+    
+    if sorted_values.size <= 0 :
+        return accumulator
+    
+    # do the sums in double precision so they stay stable over many granules
+    values   = sorted_values.astype(numpy.float64)
+    counts   = numpy.bincount(local_ids, minlength=num_cells)
+    sums     = numpy.bincount(local_ids, weights=values, minlength=num_cells)
+    has_data = counts > 0
+    means    = numpy.zeros(num_cells, dtype=numpy.float64)
+    means[has_data] = sums[has_data] / counts[has_data]
+    m2       = numpy.bincount(local_ids, weights=(values - means[local_ids]) ** 2, minlength=num_cells)
+    
+    accumulator[COUNT_FIELD][0] = counts
+    accumulator[SUM_FIELD][0]   = sums
+    accumulator[M2_FIELD][0]    = m2
+    
+    # since the values are sorted by cell, each cell's values are one contiguous run
+    cell_starts = (numpy.cumsum(counts) - counts)[has_data]
+    accumulator[MIN_FIELD][0, has_data] = numpy.minimum.reduceat(sorted_values, cell_starts)
+    accumulator[MAX_FIELD][0, has_data] = numpy.maximum.reduceat(sorted_values, cell_starts)
+    
+    return accumulator
+
+def calculate_moment_accumulator_from_layers (data_layers) :
+    """
+    given a (layers, grid_lon_size, grid_lat_size) block of space gridded data, with NaNs
+    where there is no data, create a moment accumulator for it's finite values
+    
+    the nobs can't be known from the space gridded data, so they are left as zero
+    """
+    
+    _, grid_lon_size, grid_lat_size = data_layers.shape
+    accumulator = create_moment_accumulator(grid_lon_size, grid_lat_size)
+    
+    if data_layers.shape[0] <= 0 :
+        return accumulator
+    
+    # do the sums in double precision, using zeros in place of the missing data
+    finite_mask = numpy.isfinite(data_layers)
+    values      = numpy.where(finite_mask, data_layers, 0.0).astype(numpy.float64)
+    counts      = numpy.sum(finite_mask, axis=0)
+    sums        = numpy.sum(values, axis=0)
+    has_data    = counts > 0
+    means       = numpy.zeros(sums.shape, dtype=numpy.float64)
+    means[has_data] = sums[has_data] / counts[has_data]
+    values     -= means
+    values[~finite_mask] = 0.0
+    
+    accumulator[COUNT_FIELD][0] = counts
+    accumulator[SUM_FIELD][0]   = sums
+    accumulator[M2_FIELD][0]    = numpy.sum(values ** 2, axis=0)
+    accumulator[MIN_FIELD][0]   = numpy.fmin.reduce(data_layers, axis=0)
+    accumulator[MAX_FIELD][0]   = numpy.fmax.reduce(data_layers, axis=0)
+    
+    return accumulator
+
+def calculate_moment_accumulator_from_cube (data_cube, nobs_map=None, block_layers=16) :
+    """
+    given a (depth, grid_lon_size, grid_lat_size) cube of space gridded data, with NaNs where
+    there is no data, and optionally the matching nobs map, create a moment accumulator for it
+    
+    the cube is read block_layers layers at a time and the blocks are merged as they're read, so
+    a memory mapped cube is never all in memory at once; the memory used is a small multiple of
+    block_layers layers of the grid
+    """
+    
+    _, grid_lon_size, grid_lat_size = data_cube.shape
+    accumulator = create_moment_accumulator(grid_lon_size, grid_lat_size)
+    
+    for first_layer in range(0, data_cube.shape[0], block_layers) :
+        merge_moment_accumulators(accumulator,
+                                  calculate_moment_accumulator_from_layers(numpy.asarray(data_cube[first_layer:first_layer + block_layers])))
+    
+    if nobs_map is not None :
+        accumulator[NOBS_FIELD][0] = nobs_map
+    
+    return accumulator
+
+def calculate_moment_accumulator_from_ragged (offsets, values, nobs_map=None, block_size=1048576) :
+    """
+    given the (grid_lon_size, grid_lat_size) offsets and flat values of a ragged grid (see
+    space_gridding.pack_ragged_grid), and optionally the matching nobs map, create a moment
+    accumulator for it
+    
+    the values are read block_size values at a time and the blocks are merged as they're
+    read, so a memory mapped values array is never all in memory at once
+    """
+    
+    grid_lon_size, grid_lat_size = offsets.shape
+    accumulator = create_moment_accumulator(grid_lon_size, grid_lat_size)
+    ends        = numpy.ravel(offsets)
+    
+    for first_value in range(0, values.shape[0], block_size) :
+        block_values = numpy.asarray(values[first_value:first_value + block_size])
+        # the values are sorted by cell, so each value's cell is the first one that ends after it
+        block_cells  = numpy.searchsorted(ends, numpy.arange(first_value, first_value + block_values.size), side="right")
+        merge_moment_accumulators(accumulator,
+                                  calculate_moment_accumulator(grid_lon_size, grid_lat_size, block_values, block_cells))
+    
+    if nobs_map is not None :
+        accumulator[NOBS_FIELD][0] = nobs_map
+    
+    return accumulator
+
+def merge_moment_accumulators (accumulator, other_accumulator) :
+    """
+    merge the other moment accumulator into the first one
+    
+    the first accumulator is modified in place and returned; the m2 values are combined
+    with the pairwise update from Chan et al., so the result matches what a single pass
+    over all the observations would produce. If the other accumulator is sparse, only
+    the cells it covers are updated.
+    """
+    
+    cells = other_accumulator[SPARSE_CELLS_FIELD] if is_sparse_accumulator(other_accumulator) else slice(None)
+    flat  = dict([(field_name, accumulator[field_name].reshape((1, -1))) for field_name in MOMENT_FIELDS])
+    other = dict([(field_name, other_accumulator[field_name].reshape((1, -1))) for field_name in MOMENT_FIELDS])
+    
+    count_a = flat[COUNT_FIELD][:, cells]
+    count_b = other[COUNT_FIELD]
+    total   = count_a + count_b
+    
+    # the difference between the means in each cell, weighted by how much data each side has
+    has_both = (count_a > 0) & (count_b > 0)
+    delta    = numpy.zeros(total.shape, dtype=numpy.float64)
+    delta[has_both] = ( other[SUM_FIELD][has_both]          / count_b[has_both]
+                      - flat[SUM_FIELD][:, cells][has_both] / count_a[has_both] )
+    
+    correction = numpy.zeros(total.shape, dtype=numpy.float64)
+    correction[has_both] = delta[has_both] ** 2 * ( count_a[has_both].astype(numpy.float64)
+                                                  * count_b[has_both] / total[has_both] )
+    
+    flat[M2_FIELD][:, cells]    += other[M2_FIELD] + correction
+    flat[NOBS_FIELD][:, cells]  += other[NOBS_FIELD]
+    flat[SUM_FIELD][:, cells]   += other[SUM_FIELD]
+    flat[COUNT_FIELD][:, cells]  = total
+    flat[MIN_FIELD][:, cells]    = numpy.fmin(flat[MIN_FIELD][:, cells], other[MIN_FIELD])
+    flat[MAX_FIELD][:, cells]    = numpy.fmax(flat[MAX_FIELD][:, cells], other[MAX_FIELD])
+    
+    return accumulator
+
+def calculate_moment_stats (accumulator) :
+    """
+    given a moment accumulator, calculate the mean, standard deviation, min and max of each cell
+    
+    cells with no finite data will be NaN; the standard deviation is the population
+    standard deviation (the same thing numpy.std calculates by default)
+    """
+    
+    count    = accumulator[COUNT_FIELD]
+    has_data = count > 0
+    
+    mean = numpy.empty(count.shape, dtype=numpy.float64)
+    std  = numpy.empty(count.shape, dtype=numpy.float64)
+    mean.fill(numpy.nan)
+    std.fill(numpy.nan)
+    mean[has_data] = accumulator[SUM_FIELD][has_data] / count[has_data]
+    std[has_data]  = numpy.sqrt(accumulator[M2_FIELD][has_data] / count[has_data])
+    
+    return mean, std, accumulator[MIN_FIELD], accumulator[MAX_FIELD]
+
+def _to_blocks (grid_array, factor) :
+    """
+    split a (layers, grid_lon_size, grid_lat_size) array into factor by factor blocks of cells
+    
+    the grid is rolled by half a block first, so each block holds the cells whose centers are
+    closest to the center of one cell of a grid factor times coarser (see coarsen_moment_accumulator);
+    returns a (layers, coarse lon size, factor, coarse lat size, factor) array
+    """
+    
+    num_layers, grid_lon_size, grid_lat_size = grid_array.shape
+    if (grid_lon_size % factor != 0) or (grid_lat_size % factor != 0) :
+        raise ValueError("A " + str(grid_lon_size) + " by " + str(grid_lat_size) + " grid cannot be split into "
+                         + str(factor) + " by " + str(factor) + " blocks.")
+    
+    rolled = numpy.roll(numpy.roll(grid_array, factor // 2, axis=1), factor // 2, axis=2)
+    
+    return rolled.reshape((num_layers, grid_lon_size // factor, factor, grid_lat_size // factor, factor))
+
+def coarsen_moment_accumulator (accumulator, factor) :
+    """
+    make a moment accumulator for a grid factor times coarser by merging blocks of cells
+    
+    the grid indexes wrap around the same way the space gridding indexes do, so with an odd
+    factor each block holds exactly the observations that would fall in the coarser cell if
+    they were gridded at the coarser resolution; with an even factor the cells centered on
+    the edge of a coarser cell go to the coarser cell east or north of that edge
+    """
+    
+    count = _to_blocks(accumulator[COUNT_FIELD], factor)
+    sums  = _to_blocks(accumulator[SUM_FIELD],   factor)
+    
+    coarse_count = numpy.sum(count, axis=(2, 4))
+    coarse_sum   = numpy.sum(sums,  axis=(2, 4))
+    
+    # combine the m2 of the cells in each block around the block's mean
+    has_data     = count > 0
+    means        = numpy.zeros(count.shape, dtype=numpy.float64)
+    means[has_data] = sums[has_data] / count[has_data]
+    coarse_mean  = numpy.zeros(coarse_count.shape, dtype=numpy.float64)
+    coarse_has_data = coarse_count > 0
+    coarse_mean[coarse_has_data] = coarse_sum[coarse_has_data] / coarse_count[coarse_has_data]
+    deviation    = means - coarse_mean[:, :, numpy.newaxis, :, numpy.newaxis]
+    deviation[~has_data] = 0.0
+    
+    return {
+            NOBS_FIELD:  numpy.sum(_to_blocks(accumulator[NOBS_FIELD], factor), axis=(2, 4)),
+            COUNT_FIELD: coarse_count,
+            SUM_FIELD:   coarse_sum,
+            M2_FIELD:    numpy.sum(_to_blocks(accumulator[M2_FIELD], factor) + count * deviation ** 2, axis=(2, 4)),
+            MIN_FIELD:   numpy.fmin.reduce(numpy.fmin.reduce(_to_blocks(accumulator[MIN_FIELD], factor), axis=4), axis=2),
+            MAX_FIELD:   numpy.fmax.reduce(numpy.fmax.reduce(_to_blocks(accumulator[MAX_FIELD], factor), axis=4), axis=2),
+           }
+
+# the field that holds the flattened ids of the cells a sparse accumulator covers; the other
+# grid fields of a sparse accumulator are shaped (layers, number of cells) instead of
+# (layers, grid_lon_size, grid_lat_size), with one column for each of those cells
+SPARSE_CELLS_FIELD = "cells"
+
+def _find_touched_cells (cell_ids) :
+    """
+    find the cells a list of flattened cell ids touches
+    
+    returns the sorted ids of the touched cells and where each of the given cell ids is in that list
+    """
+    
+    touched_cells, local_ids = numpy.unique(numpy.asarray(cell_ids, dtype=numpy.int64), return_inverse=True)
+    
+    return touched_cells, local_ids
+
+def is_sparse_accumulator (accumulator) :
+    """
+    determine if an accumulator only covers the cells one granule touched (see SPARSE_CELLS_FIELD)
+    """
+    
+    return SPARSE_CELLS_FIELD in accumulator
+
+def expand_accumulator (accumulator, grid_lon_size, grid_lat_size) :
+    """
+    expand a sparse accumulator to cover the whole grid; accumulators that already cover
+    the whole grid are returned as they are
+    
+    the cells the sparse accumulator doesn't cover are left empty (zero, or NaN for the min and max)
+    """
+    
+    if not is_sparse_accumulator(accumulator) :
+        return accumulator
+    
+    touched_cells = accumulator[SPARSE_CELLS_FIELD]
+    expanded      = { }
+    for field_name, field_data in accumulator.items() :
+        if field_name == SPARSE_CELLS_FIELD :
+            continue
+        if (field_data.ndim != 2) or (field_data.shape[1] != touched_cells.size) :
+            expanded[field_name] = field_data
+            continue
+        grid_data = numpy.zeros((field_data.shape[0], grid_lon_size * grid_lat_size), dtype=field_data.dtype)
+        if field_name in [MIN_FIELD, MAX_FIELD] :
+            grid_data.fill(numpy.nan)
+        grid_data[:, touched_cells] = field_data
+        expanded[field_name] = grid_data.reshape((field_data.shape[0], grid_lon_size, grid_lat_size))
+    
+    return expanded
+
+def _add_counts (counts, other_accumulator, counts_field) :
+    """
+    add the counts of the other accumulator, which may be sparse, into a full grid array of counts
+    """
+    
+    if is_sparse_accumulator(other_accumulator) :
+        counts.reshape((counts.shape[0], -1))[:, other_accumulator[SPARSE_CELLS_FIELD]] += other_accumulator[counts_field]
+    else :
+        counts += other_accumulator[counts_field]
+
+# the names of the fields in a histogram accumulator
+COUNTS_FIELD    = "counts"
+BIN_EDGES_FIELD = "binedges"
+HISTOGRAM_FIELDS = [COUNTS_FIELD, BIN_EDGES_FIELD]
+
+# the data type used to count observations in histogram bins
+HISTOGRAM_COUNT_DATA_TYPE = numpy.dtype(numpy.uint32)
+
+def _calculate_bin_indexes (bin_edges, values) :
+    """
+    figure out which bin each value falls in, putting values on the last edge in the last bin
+    
+    returns the bin indexes and a mask of which values fell inside the bins (NaNs never do)
+    """
+    
+    num_bins    = bin_edges.size - 1
+    bin_indexes = numpy.searchsorted(bin_edges, values, side='right') - 1
+    bin_indexes[values == bin_edges[-1]] = num_bins - 1
+    in_range    = (bin_indexes >= 0) & (bin_indexes < num_bins)
+    
+    return bin_indexes, in_range
+
+def create_histogram_accumulator (grid_lon_size, grid_lat_size, bin_edges) :
+    """
+    create an empty histogram accumulator for a grid of the given size
+    
+    the accumulator holds the bin edges and a (number of bins, grid_lon_size, grid_lat_size)
+    array of how many observations fell in each bin in each cell; like numpy.histogram,
+    every bin but the last is half open and the last bin includes it's upper edge
+    """
+    
+    bin_edges = numpy.asarray(bin_edges, dtype=numpy.float64)
+    
+    return {
+             COUNTS_FIELD:    numpy.zeros((bin_edges.size - 1, grid_lon_size, grid_lat_size), dtype=HISTOGRAM_COUNT_DATA_TYPE),
+             BIN_EDGES_FIELD: bin_edges,
+           }
+
+def calculate_histogram_accumulator (grid_lon_size, grid_lat_size, values, cell_ids, bin_edges) :
+    """
+    given finite values, their flattened cell ids and the bin edges, create a sparse histogram
+    accumulator for them, covering only the cells the values fall in (see expand_accumulator)
+    
+    values outside the range of the bin edges are not counted
+    """
+    
+    bin_edges   = numpy.asarray(bin_edges, dtype=numpy.float64)
+    num_bins    = bin_edges.size - 1
+    
+    bin_indexes, in_range = _calculate_bin_indexes(bin_edges, values)
+    touched_cells, local_ids = _find_touched_cells(numpy.asarray(cell_ids)[in_range])
+    
+    # count the bins and cells together in one pass
+    combined_indexes = bin_indexes[in_range] * touched_cells.size + local_ids
+    counts = numpy.bincount(combined_indexes, minlength=num_bins * touched_cells.size)
+    
+    return {
+             COUNTS_FIELD:       counts.reshape((num_bins, touched_cells.size)).astype(HISTOGRAM_COUNT_DATA_TYPE),
+             BIN_EDGES_FIELD:    bin_edges,
+             SPARSE_CELLS_FIELD: touched_cells,
+           }
+
+def merge_histogram_accumulators (accumulator, other_accumulator) :
+    """
+    merge the other histogram accumulator into the first one
+    
+    the first accumulator is modified in place and returned; both accumulators must use the same
+    bin edges, and the other accumulator may be sparse
+    """
+    
+    if not numpy.array_equal(accumulator[BIN_EDGES_FIELD], other_accumulator[BIN_EDGES_FIELD]) :
+        raise ValueError("Histogram accumulators with different bin edges cannot be merged.")
+    
+    _add_counts(accumulator[COUNTS_FIELD], other_accumulator, COUNTS_FIELD)
+    
+    return accumulator
+
+def coarsen_histogram_accumulator (accumulator, factor) :
+    """
+    make a histogram accumulator for a grid factor times coarser by adding up blocks of cells
+    
+    the blocks are the same ones coarsen_moment_accumulator uses
+    """
+    
+    return {
+            COUNTS_FIELD:    numpy.sum(_to_blocks(accumulator[COUNTS_FIELD], factor), axis=(2, 4)).astype(HISTOGRAM_COUNT_DATA_TYPE),
+            BIN_EDGES_FIELD: accumulator[BIN_EDGES_FIELD].copy(),
+           }
+
+def calculate_histogram_percentiles (accumulator, percentiles) :
+    """
+    given a histogram accumulator and a list of percentiles (from 0 to 100), estimate those
+    percentiles in each cell by interpolating linearly inside the bin each one falls in
+    
+    only the bins from each cell's first to last non-empty bin are used, so the 0th and
+    100th percentiles are the outer edges of the non-empty bins
+    
+    returns a (number of percentiles, grid_lon_size, grid_lat_size) array; cells with no
+    observations will be NaN
+    """
+    
+    counts     = accumulator[COUNTS_FIELD]
+    bin_edges  = accumulator[BIN_EDGES_FIELD]
+    num_bins   = counts.shape[0]
+    flat_counts     = counts.reshape((num_bins, -1)).astype(numpy.float64)
+    cumulative      = numpy.cumsum(flat_counts, axis=0)
+    total           = cumulative[-1]
+    cell_indexes    = numpy.arange(total.size)
+    nonempty_bins   = flat_counts > 0
+    first_bins      = numpy.argmax(nonempty_bins, axis=0)
+    last_bins       = num_bins - 1 - numpy.argmax(nonempty_bins[::-1], axis=0)
+    
+    results = numpy.empty((len(percentiles), total.size), dtype=numpy.float64)
+    for index, percentile in enumerate(percentiles) :
+        
+        # find the first bin where the cumulative count reaches the target, skipping the empty bins at either end
+        target      = total * (percentile / 100.0)
+        bin_indexes = numpy.clip(numpy.sum(cumulative < target, axis=0), first_bins, last_bins)
+        
+        # interpolate inside that bin
+        bin_counts  = flat_counts[bin_indexes, cell_indexes]
+        below       = cumulative[bin_indexes, cell_indexes] - bin_counts
+        fraction    = numpy.zeros(total.size, dtype=numpy.float64)
+        has_counts  = bin_counts > 0
+        fraction[has_counts] = (target[has_counts] - below[has_counts]) / bin_counts[has_counts]
+        
+        results[index] = bin_edges[bin_indexes] + fraction * (bin_edges[bin_indexes + 1] - bin_edges[bin_indexes])
+    
+    results[:, total <= 0] = numpy.nan
+    
+    return results.reshape((len(percentiles),) + counts.shape[1:])
+
+# the fields in a joint histogram accumulator
+JOINT_COUNTS_FIELD  = "counts"
+X_BIN_EDGES_FIELD   = "xbinedges"
+Y_BIN_EDGES_FIELD   = "ybinedges"
+JOINT_HISTOGRAM_FIELDS = [JOINT_COUNTS_FIELD, X_BIN_EDGES_FIELD, Y_BIN_EDGES_FIELD]
+
+def create_joint_histogram_accumulator (grid_lon_size, grid_lat_size, x_bin_edges, y_bin_edges) :
+    """
+    create an empty joint histogram accumulator for a grid of the given size
+    
+    the accumulator holds the bin edges for both variables and a (number of x bins * number of
+    y bins, grid_lon_size, grid_lat_size) array of how many observations fell in each pair of
+    bins in each cell; the pairs are in x major order, so the counts can be reshaped to
+    (number of x bins, number of y bins, grid_lon_size, grid_lat_size)
+    """
+    
+    x_bin_edges = numpy.asarray(x_bin_edges, dtype=numpy.float64)
+    y_bin_edges = numpy.asarray(y_bin_edges, dtype=numpy.float64)
+    num_bins    = (x_bin_edges.size - 1) * (y_bin_edges.size - 1)
+    
+    return {
+             JOINT_COUNTS_FIELD: numpy.zeros((num_bins, grid_lon_size, grid_lat_size), dtype=HISTOGRAM_COUNT_DATA_TYPE),
+             X_BIN_EDGES_FIELD:  x_bin_edges,
+             Y_BIN_EDGES_FIELD:  y_bin_edges,
+           }
+
+def calculate_joint_histogram_accumulator (grid_lon_size, grid_lat_size, x_values, y_values, cell_ids,
+                                           x_bin_edges, y_bin_edges) :
+    """
+    given the values of two variables for the same observations, their flattened cell ids
+    and the bin edges for each variable, create a sparse joint histogram accumulator for
+    them, covering only the cells the observations fall in (see expand_accumulator)
+    
+    only observations where both values fall inside their bins are counted
+    """
+    
+    x_bin_edges = numpy.asarray(x_bin_edges, dtype=numpy.float64)
+    y_bin_edges = numpy.asarray(y_bin_edges, dtype=numpy.float64)
+    num_y_bins  = y_bin_edges.size - 1
+    num_bins    = (x_bin_edges.size - 1) * num_y_bins
+    
+    x_indexes, x_in_range = _calculate_bin_indexes(x_bin_edges, x_values)
+    y_indexes, y_in_range = _calculate_bin_indexes(y_bin_edges, y_values)
+    in_range = x_in_range & y_in_range
+    touched_cells, local_ids = _find_touched_cells(numpy.asarray(cell_ids)[in_range])
+    
+    # count the pairs of bins and cells together in one pass
+    combined_indexes = (x_indexes[in_range] * num_y_bins + y_indexes[in_range]) * touched_cells.size + local_ids
+    counts = numpy.bincount(combined_indexes, minlength=num_bins * touched_cells.size)
+    
+    return {
+             JOINT_COUNTS_FIELD: counts.reshape((num_bins, touched_cells.size)).astype(HISTOGRAM_COUNT_DATA_TYPE),
+             X_BIN_EDGES_FIELD:  x_bin_edges,
+             Y_BIN_EDGES_FIELD:  y_bin_edges,
+             SPARSE_CELLS_FIELD: touched_cells,
+           }
+
+def merge_joint_histogram_accumulators (accumulator, other_accumulator) :
+    """
+    merge the other joint histogram accumulator into the first one
+    
+    the first accumulator is modified in place and returned; both accumulators must use the same
+    bin edges, and the other accumulator may be sparse
+    """
+    
+    if not (numpy.array_equal(accumulator[X_BIN_EDGES_FIELD], other_accumulator[X_BIN_EDGES_FIELD]) and
+            numpy.array_equal(accumulator[Y_BIN_EDGES_FIELD], other_accumulator[Y_BIN_EDGES_FIELD])) :
+        raise ValueError("Joint histogram accumulators with different bin edges cannot be merged.")
+    
+    _add_counts(accumulator[JOINT_COUNTS_FIELD], other_accumulator, JOINT_COUNTS_FIELD)
+    
+    return accumulator
+
+def coarsen_joint_histogram_accumulator (accumulator, factor) :
+    """
+    make a joint histogram accumulator for a grid factor times coarser by adding up blocks of cells
+    
+    the blocks are the same ones coarsen_moment_accumulator uses
+    """
+    
+    return {
+            JOINT_COUNTS_FIELD: numpy.sum(_to_blocks(accumulator[JOINT_COUNTS_FIELD], factor), axis=(2, 4)).astype(HISTOGRAM_COUNT_DATA_TYPE),
+            X_BIN_EDGES_FIELD:  accumulator[X_BIN_EDGES_FIELD].copy(),
+            Y_BIN_EDGES_FIELD:  accumulator[Y_BIN_EDGES_FIELD].copy(),
+           }
+
+# the fields in a category accumulator
+CATEGORY_COUNTS_FIELD = "counts"
+CATEGORIES_FIELD      = "categories"
+CATEGORY_FIELDS = [CATEGORY_COUNTS_FIELD, CATEGORIES_FIELD]
+
+# the data type category counts are stored in
+CATEGORY_COUNT_DATA_TYPE = numpy.dtype(numpy.uint32)
+
+def create_category_accumulator (grid_lon_size, grid_lat_size, categories) :
+    """
+    create an empty category accumulator for a grid of the given size
+    
+    the accumulator holds the sorted category values and a (number of categories, grid_lon_size,
+    grid_lat_size) array of how many observations had each category value in each cell
+    """
+    
+    categories = numpy.unique(numpy.asarray(categories))
+    
+    return {
+             CATEGORY_COUNTS_FIELD: numpy.zeros((categories.size, grid_lon_size, grid_lat_size), dtype=CATEGORY_COUNT_DATA_TYPE),
+             CATEGORIES_FIELD:      categories,
+           }
+
+def calculate_category_accumulator (grid_lon_size, grid_lat_size, values, cell_ids, categories) :
+    """
+    given finite values, their flattened cell ids and the category values, create a sparse category
+    accumulator for them, covering only the cells the values fall in (see expand_accumulator)
+    
+    values that aren't exactly one of the categories are not counted
+    """
+    
+    categories     = numpy.unique(numpy.asarray(categories))
+    num_categories = categories.size
+    
+    # figure out which category each value is, if any
+    category_indexes = numpy.minimum(numpy.searchsorted(categories, values), num_categories - 1)
+    is_category      = categories[category_indexes] == values
+    touched_cells, local_ids = _find_touched_cells(numpy.asarray(cell_ids)[is_category])
+    
+    # count the categories and cells together in one pass
+    combined_indexes = category_indexes[is_category] * touched_cells.size + local_ids
+    counts = numpy.bincount(combined_indexes, minlength=num_categories * touched_cells.size)
+    
+    return {
+             CATEGORY_COUNTS_FIELD: counts.reshape((num_categories, touched_cells.size)).astype(CATEGORY_COUNT_DATA_TYPE),
+             CATEGORIES_FIELD:      categories,
+             SPARSE_CELLS_FIELD:    touched_cells,
+           }
+
+def merge_category_accumulators (accumulator, other_accumulator) :
+    """
+    merge the other category accumulator into the first one
+    
+    the first accumulator is modified in place and returned; both accumulators must count the
+    same categories, and the other accumulator may be sparse
+    """
+    
+    if not numpy.array_equal(accumulator[CATEGORIES_FIELD], other_accumulator[CATEGORIES_FIELD]) :
+        raise ValueError("Category accumulators with different categories cannot be merged.")
+    
+    _add_counts(accumulator[CATEGORY_COUNTS_FIELD], other_accumulator, CATEGORY_COUNTS_FIELD)
+    
+    return accumulator
+
+def coarsen_category_accumulator (accumulator, factor) :
+    """
+    make a category accumulator for a grid factor times coarser by adding up blocks of cells
+    
+    the blocks are the same ones coarsen_moment_accumulator uses
+    """
+    
+    return {
+            CATEGORY_COUNTS_FIELD: numpy.sum(_to_blocks(accumulator[CATEGORY_COUNTS_FIELD], factor), axis=(2, 4)).astype(CATEGORY_COUNT_DATA_TYPE),
+            CATEGORIES_FIELD:      accumulator[CATEGORIES_FIELD].copy(),
+           }
+
+def calculate_category_fractions (accumulator) :
+    """
+    given a category accumulator, calculate the fraction of the observations in each cell
+    that had each category value (ie. cloud fraction or cloud type frequency)
+    
+    returns a (number of categories, grid_lon_size, grid_lat_size) array; cells with no
+    observations will be NaN
+    """
+    
+    counts = accumulator[CATEGORY_COUNTS_FIELD].astype(numpy.float64)
+    total  = numpy.sum(counts, axis=0)
+    
+    fractions = numpy.empty(counts.shape, dtype=numpy.float64)
+    fractions[:] = numpy.nan
+    has_counts = total > 0
+    fractions[:, has_counts] = counts[:, has_counts] / total[has_counts]
+    
+    return fractions
+
+# the fields in a quantile sketch accumulator
+SKETCH_MEANS_FIELD   = "means"
+SKETCH_WEIGHTS_FIELD = "weights"
+SKETCH_FIELDS = [SKETCH_MEANS_FIELD, SKETCH_WEIGHTS_FIELD, MIN_FIELD, MAX_FIELD]
+
+# the data types the sketch centroids are kept in
+SKETCH_MEAN_DATA_TYPE   = numpy.dtype(numpy.float32)
+SKETCH_WEIGHT_DATA_TYPE = numpy.dtype(numpy.float64)
+
+# how many centroids a quantile sketch keeps in each cell
+SKETCH_SIZE = 32
+
+def _sketch_scale (quantiles) :
+    """
+    the t-digest k1 scale function, stretched to run from 0 to 1
+    
+    it's steepest at the ends, so the centroids near the tails of each cell's
+    distribution hold fewer observations than the ones near the middle
+    """
+    
+    return numpy.arcsin(2.0 * numpy.clip(quantiles, 0.0, 1.0) - 1.0) / numpy.pi + 0.5
+
+def _bin_sketch_centroids (centroid_indexes, cell_ids, means, weights, num_cells, sketch_size) :
+    """
+    combine weighted points into sketch centroids, given the centroid each one goes in and it's cell id
+    
+    returns (sketch_size, num_cells) arrays of the centroid means and weights; the centroids
+    with weight in each cell are moved to the front, so each cell's means are sorted and
+    it's empty centroids come last
+    """
+    
+    combined_indexes = centroid_indexes * num_cells + cell_ids
+    centroid_weights = numpy.bincount(combined_indexes, weights=weights,         minlength=sketch_size * num_cells)
+    centroid_sums    = numpy.bincount(combined_indexes, weights=means * weights, minlength=sketch_size * num_cells)
+    
+    centroid_means   = numpy.zeros(centroid_weights.shape, dtype=numpy.float64)
+    has_weight       = centroid_weights > 0
+    centroid_means[has_weight] = centroid_sums[has_weight] / centroid_weights[has_weight]
+    centroid_means   = centroid_means.reshape((sketch_size, num_cells))
+    centroid_weights = centroid_weights.reshape((sketch_size, num_cells))
+    
+    # the centroids are in order of their means already, so a stable sort on being empty packs them to the front
+    order        = numpy.argsort(centroid_weights <= 0, axis=0, kind="mergesort")
+    cell_indexes = numpy.arange(num_cells)
+    
+    return centroid_means[order, cell_indexes], centroid_weights[order, cell_indexes]
+
+def _compress_sketch_centroids (means, weights, sketch_size) :
+    """
+    compress (number of centroids, number of cells) arrays of centroid means and weights into sketch_size
+    centroids per cell, by merging neighboring centroids that fall in the same step of the scale function
+    """
+    
+    num_centroids, num_cells = weights.shape
+    
+    # sort each cell's centroids by their means, with the empty ones last
+    order        = numpy.argsort(numpy.where(weights > 0, means, numpy.inf), axis=0, kind="mergesort")
+    cell_indexes = numpy.arange(num_cells)
+    means        = means[order, cell_indexes].astype(numpy.float64)
+    weights      = weights[order, cell_indexes].astype(numpy.float64)
+    
+    # find the quantile in the middle of each centroid and the step of the scale function it's in
+    cumulative   = numpy.cumsum(weights, axis=0)
+    total        = cumulative[-1]
+    quantiles    = numpy.zeros(weights.shape, dtype=numpy.float64)
+    has_total    = total > 0
+    quantiles[:, has_total] = (cumulative[:, has_total] - weights[:, has_total] / 2.0) / total[has_total]
+    centroid_indexes = numpy.minimum((_sketch_scale(quantiles) * sketch_size).astype(numpy.int64), sketch_size - 1)
+    
+    has_weight   = weights > 0
+    return _bin_sketch_centroids(centroid_indexes[has_weight], numpy.broadcast_to(cell_indexes, weights.shape)[has_weight],
+                                 means[has_weight], weights[has_weight], num_cells, sketch_size)
+
+def create_sketch_accumulator (grid_lon_size, grid_lat_size, sketch_size=SKETCH_SIZE) :
+    """
+    create an empty quantile sketch accumulator for a grid of the given size
+    
+    the sketch is a small t-digest in each cell: (sketch_size, grid_lon_size, grid_lat_size)
+    arrays of centroid means and weights (the number of observations each centroid stands
+    for), along with the min and max of each cell, which anchor the ends of the distribution
+    """
+    
+    shape = (1, grid_lon_size, grid_lat_size)
+    accumulator = {
+                    SKETCH_MEANS_FIELD:   numpy.zeros((sketch_size, grid_lon_size, grid_lat_size), dtype=SKETCH_MEAN_DATA_TYPE),
+                    SKETCH_WEIGHTS_FIELD: numpy.zeros((sketch_size, grid_lon_size, grid_lat_size), dtype=SKETCH_WEIGHT_DATA_TYPE),
+                    MIN_FIELD:            numpy.empty(shape, dtype=numpy.float32),
+                    MAX_FIELD:            numpy.empty(shape, dtype=numpy.float32),
+                  }
+    accumulator[MIN_FIELD].fill(numpy.nan)
+    accumulator[MAX_FIELD].fill(numpy.nan)
+    
+    return accumulator
+
+def calculate_sketch_accumulator (grid_lon_size, grid_lat_size, values, cell_ids, sketch_size=SKETCH_SIZE) :
+    """
+    given finite values and their flattened cell ids, create a sparse quantile sketch accumulator
+    for them, covering only the cells the values fall in (see expand_accumulator)
+    
+    the values in each cell are ranked and each one goes in the centroid for the step of the
+    scale function it's rank falls in
+    """
+    
+    values      = numpy.asarray(values)
+    touched_cells, cell_ids = _find_touched_cells(cell_ids)
+    num_cells   = touched_cells.size
+    accumulator = {
+                    SKETCH_MEANS_FIELD:   numpy.zeros((sketch_size, num_cells), dtype=SKETCH_MEAN_DATA_TYPE),
+                    SKETCH_WEIGHTS_FIELD: numpy.zeros((sketch_size, num_cells), dtype=SKETCH_WEIGHT_DATA_TYPE),
+                    MIN_FIELD:            numpy.zeros((1, num_cells), dtype=numpy.float32),
+                    MAX_FIELD:            numpy.zeros((1, num_cells), dtype=numpy.float32),
+                    SPARSE_CELLS_FIELD:   touched_cells,
+                  }
+    if values.size <= 0 :
+        return accumulator
+    
+    # sort the values by cell and then by value, and rank them within each cell
+    order       = numpy.lexsort((values, cell_ids))
+    values      = values[order]
+    cell_ids    = cell_ids[order]
+    cell_counts = numpy.bincount(cell_ids, minlength=num_cells)
+    cell_starts = numpy.cumsum(cell_counts) - cell_counts
+    ranks       = numpy.arange(values.size) - cell_starts[cell_ids]
+    quantiles   = (ranks + 0.5) / cell_counts[cell_ids]
+    centroid_indexes = numpy.minimum((_sketch_scale(quantiles) * sketch_size).astype(numpy.int64), sketch_size - 1)
+    
+    means, weights = _bin_sketch_centroids(centroid_indexes, cell_ids, values.astype(numpy.float64),
+                                           numpy.ones(values.size, dtype=numpy.float64), num_cells, sketch_size)
+    accumulator[SKETCH_MEANS_FIELD][:]   = means
+    accumulator[SKETCH_WEIGHTS_FIELD][:] = weights
+    
+    # the first and last value in each cell are it's min and max; every touched cell has values
+    accumulator[MIN_FIELD][0] = values[cell_starts]
+    accumulator[MAX_FIELD][0] = values[cell_starts + cell_counts - 1]
+    
+    return accumulator
+
+def merge_sketch_accumulators (accumulator, other_accumulator) :
+    """
+    merge the other quantile sketch accumulator into the first one
+    
+    the first accumulator is modified in place and returned; the centroids of both are pooled
+    and compressed back down to the first one's sketch size. If the other accumulator is sparse,
+    only the cells it covers are compressed.
+    """
+    
+    sketch_size    = accumulator[SKETCH_WEIGHTS_FIELD].shape[0]
+    flat_means     = accumulator[SKETCH_MEANS_FIELD].reshape((sketch_size, -1))
+    flat_weights   = accumulator[SKETCH_WEIGHTS_FIELD].reshape((sketch_size, -1))
+    flat_minimum   = accumulator[MIN_FIELD].reshape((1, -1))
+    flat_maximum   = accumulator[MAX_FIELD].reshape((1, -1))
+    cells          = other_accumulator[SPARSE_CELLS_FIELD] if is_sparse_accumulator(other_accumulator) else slice(None)
+    other_means    = other_accumulator[SKETCH_MEANS_FIELD].reshape((other_accumulator[SKETCH_MEANS_FIELD].shape[0], -1))
+    other_weights  = other_accumulator[SKETCH_WEIGHTS_FIELD].reshape((other_accumulator[SKETCH_WEIGHTS_FIELD].shape[0], -1))
+    
+    means, weights = _compress_sketch_centroids(numpy.concatenate([flat_means[:, cells],   other_means]),
+                                                numpy.concatenate([flat_weights[:, cells], other_weights]), sketch_size)
+    flat_means[:, cells]   = means
+    flat_weights[:, cells] = weights
+    flat_minimum[:, cells] = numpy.fmin(flat_minimum[:, cells], other_accumulator[MIN_FIELD].reshape((1, -1)))
+    flat_maximum[:, cells] = numpy.fmax(flat_maximum[:, cells], other_accumulator[MAX_FIELD].reshape((1, -1)))
+    
+    return accumulator
+
+def coarsen_sketch_accumulator (accumulator, factor) :
+    """
+    make a quantile sketch accumulator for a grid factor times coarser by merging blocks of cells
+    
+    the blocks are the same ones coarsen_moment_accumulator uses
+    """
+    
+    sketch_size  = accumulator[SKETCH_WEIGHTS_FIELD].shape[0]
+    means        = _to_blocks(accumulator[SKETCH_MEANS_FIELD],   factor)
+    weights      = _to_blocks(accumulator[SKETCH_WEIGHTS_FIELD], factor)
+    coarse_shape = (means.shape[1], means.shape[3])
+    
+    # pool the centroids of each block of cells
+    means   = means.transpose((0, 2, 4, 1, 3)).reshape((-1, coarse_shape[0] * coarse_shape[1]))
+    weights = weights.transpose((0, 2, 4, 1, 3)).reshape((-1, coarse_shape[0] * coarse_shape[1]))
+    means, weights = _compress_sketch_centroids(means, weights, sketch_size)
+    
+    return {
+            SKETCH_MEANS_FIELD:   means.reshape((sketch_size,) + coarse_shape).astype(SKETCH_MEAN_DATA_TYPE),
+            SKETCH_WEIGHTS_FIELD: weights.reshape((sketch_size,) + coarse_shape).astype(SKETCH_WEIGHT_DATA_TYPE),
+            MIN_FIELD:            numpy.fmin.reduce(numpy.fmin.reduce(_to_blocks(accumulator[MIN_FIELD], factor), axis=4), axis=2),
+            MAX_FIELD:            numpy.fmax.reduce(numpy.fmax.reduce(_to_blocks(accumulator[MAX_FIELD], factor), axis=4), axis=2),
+           }
+
+def calculate_sketch_percentiles (accumulator, percentiles) :
+    """
+    given a quantile sketch accumulator and a list of percentiles (from 0 to 100), estimate those
+    percentiles in each cell by interpolating linearly between the centroids around each one
+    
+    each centroid is placed at the middle of the observations it stands for, and the cell's min and max
+    are placed at the ends; returns a (number of percentiles, grid_lon_size, grid_lat_size) array,
+    cells with no observations will be NaN
+    """
+    
+    weights      = accumulator[SKETCH_WEIGHTS_FIELD]
+    sketch_size  = weights.shape[0]
+    flat_weights = weights.reshape((sketch_size, -1)).astype(numpy.float64)
+    flat_means   = accumulator[SKETCH_MEANS_FIELD].reshape((sketch_size, -1)).astype(numpy.float64)
+    cumulative   = numpy.cumsum(flat_weights, axis=0)
+    total        = cumulative[-1]
+    minimum      = accumulator[MIN_FIELD].reshape(-1).astype(numpy.float64)
+    maximum      = accumulator[MAX_FIELD].reshape(-1).astype(numpy.float64)
+    cell_indexes = numpy.arange(total.size)
+    
+    # line up where each point sits in the cell's distribution with it's value; the empty
+    # centroids at the end of each cell sit on top of the max
+    positions    = numpy.concatenate([numpy.zeros((1, total.size)), cumulative - flat_weights / 2.0, total[numpy.newaxis]])
+    points       = numpy.concatenate([minimum[numpy.newaxis], flat_means, maximum[numpy.newaxis]])
+    is_empty     = numpy.concatenate([numpy.zeros((1, total.size), dtype=numpy.bool), flat_weights <= 0,
+                                      numpy.zeros((1, total.size), dtype=numpy.bool)])
+    positions[is_empty] = numpy.broadcast_to(total, positions.shape)[is_empty]
+    points[is_empty]    = numpy.broadcast_to(maximum, points.shape)[is_empty]
+    
+    results = numpy.empty((len(percentiles), total.size), dtype=numpy.float64)
+    for index, percentile in enumerate(percentiles) :
+        
+        # find the points on either side of the target
+        target      = total * (percentile / 100.0)
+        lower       = numpy.clip(numpy.sum(positions <= target, axis=0) - 1, 0, sketch_size)
+        lower_position = positions[lower,     cell_indexes]
+        upper_position = positions[lower + 1, cell_indexes]
+        
+        # interpolate between them
+        fraction    = numpy.zeros(total.size, dtype=numpy.float64)
+        has_width   = upper_position > lower_position
+        fraction[has_width] = (target[has_width] - lower_position[has_width]) / (upper_position[has_width] - lower_position[has_width])
+        results[index] = points[lower, cell_indexes] + fraction * (points[lower + 1, cell_indexes] - points[lower, cell_indexes])
+    
+    results[:, total <= 0] = numpy.nan
+    
+    return results.reshape((len(percentiles),) + weights.shape[1:])
@@ -38,8 +38,8 @@ SENSOR_ZENITH_NAME          = 'sensor_zenith_angle'
 
 #PRODUCTS:
 CLOUD_MASK_NAME             = 'cloud_mask'
-CLOUD_HEIGHT_NAME           = 'cloud_type'
-CLOUD_TYPE_NAME             = 'cld_height_acha'
+CLOUD_HEIGHT_NAME           = 'cld_height_acha'
+CLOUD_TYPE_NAME             = 'cloud_type'
 
 
 # important attribute names
@@ -83,6 +83,18 @@ EXPECTED_VARIABLES_IN_FILE = set([CLOUD_MASK_NAME]) # TODO, this is currently se
 # the line between day and night for our day/night masks (in solar zenith angle degrees)
 DAY_NIGHT_LINE_DEGREES = 84.0
 
+# the histogram bin edges to use for each variable when building per cell histograms
+HISTOGRAM_BIN_EDGES = { }
+
+# the coarser bin edges to use for each variable in joint histograms
+JOINT_HISTOGRAM_BIN_EDGES = { }
+
+# the category values to count in each cell for flag variables
+CATEGORY_VALUES = {
+                    CLOUD_MASK_NAME   : numpy.arange(0,  4),
+                    CLOUD_TYPE_NAME   : numpy.arange(0, 14),
+                  }
+
 def open_file (file_path) :
     """
     given a file path that is a modis file, open it
@@ -313,6 +325,28 @@ def get_variable_names (user_requested_names) :
     
     return var_names
 
+def get_histogram_bin_edges (variable_name) :
+    """get the histogram bin edges to use for a variable
+    if the variable has no bins configured None will be returned
+    """
+    
+    return HISTOGRAM_BIN_EDGES[variable_name] if variable_name in HISTOGRAM_BIN_EDGES else None
+
+def get_joint_histogram_bin_edges (variable_name) :
+    """get the bin edges to use for a variable in joint histograms
+    if the variable has no joint histogram bins configured, it's histogram bins
+    will be used; if it has neither, None will be returned
+    """
+    
+    return JOINT_HISTOGRAM_BIN_EDGES[variable_name] if variable_name in JOINT_HISTOGRAM_BIN_EDGES else get_histogram_bin_edges(variable_name)
+
+def get_category_values (variable_name) :
+    """get the category values to count for a flag variable
+    if the variable is not a flag variable None will be returned
+    """
+    
+    return CATEGORY_VALUES[variable_name] if variable_name in CATEGORY_VALUES else None
+
 def main():
     import optparse
     from pprint import pprint
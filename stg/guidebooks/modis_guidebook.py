@@ -161,6 +161,29 @@ EXPECTED_VARIABLES_IN_FILE = set([CLOUD_TOP_PRESS_NAME]) # TODO, this is current
 # the line between day and night for our day/night masks (in solar zenith angle degrees)
 DAY_NIGHT_LINE_DEGREES = 84.0
 
+# the histogram bin edges to use for each variable when building per cell histograms
+HISTOGRAM_BIN_EDGES = {
+                    CLOUD_TOP_PRESS_NAME:           numpy.arange(0.0,   1110.0, 10.0),
+                    CLOUD_TOP_PRESS_1KM_NAME:       numpy.arange(0.0,   1110.0, 10.0),
+                    CLOUD_TOP_TEMP_NAME:            numpy.arange(150.0,  352.0,  2.0),
+                    CLOUD_TOP_TEMP_1KM_NAME:        numpy.arange(150.0,  352.0,  2.0),
+                    CLOUD_EFF_EMISS_NAME:           numpy.linspace(0.0,    1.0, 101),
+                      }
+
+# the coarser bin edges to use for each variable in joint histograms, which
+# have a bin for every pair of bins (these follow the ISCCP cloud types)
+JOINT_HISTOGRAM_BIN_EDGES = {
+                    CLOUD_TOP_PRESS_NAME:           numpy.array([0.0, 180.0, 310.0, 440.0, 560.0, 680.0, 800.0, 1100.0]),
+                    CLOUD_TOP_PRESS_1KM_NAME:       numpy.array([0.0, 180.0, 310.0, 440.0, 560.0, 680.0, 800.0, 1100.0]),
+                    CLOUD_OPTICAL_THICK_NAME:       numpy.array([0.0,   1.3,   3.6,   9.4,  23.0,  60.0, 379.0]),
+                      }
+
+# the category values to count in each cell for flag variables
+CATEGORY_VALUES = {
+                    CLOUD_PHASE_NAME:               numpy.array([0, 1, 2, 3, 6]),
+                    CLOUD_MULTI_LAYER_FLAG_NAME:    numpy.arange(0, 10),
+                  }
+
 def open_file (file_path) :
     """
     given a file path that is a modis file, open it
@@ -393,6 +416,28 @@ def get_variable_names (user_requested_names) :
     
     return var_names
 
+def get_histogram_bin_edges (variable_name) :
+    """get the histogram bin edges to use for a variable
+    if the variable has no bins configured None will be returned
+    """
+    
+    return HISTOGRAM_BIN_EDGES[variable_name] if variable_name in HISTOGRAM_BIN_EDGES else None
+
+def get_joint_histogram_bin_edges (variable_name) :
+    """get the bin edges to use for a variable in joint histograms
+    if the variable has no joint histogram bins configured, it's histogram bins
+    will be used; if it has neither, None will be returned
+    """
+    
+    return JOINT_HISTOGRAM_BIN_EDGES[variable_name] if variable_name in JOINT_HISTOGRAM_BIN_EDGES else get_histogram_bin_edges(variable_name)
+
+def get_category_values (variable_name) :
+    """get the category values to count for a flag variable
+    if the variable is not a flag variable None will be returned
+    """
+    
+    return CATEGORY_VALUES[variable_name] if variable_name in CATEGORY_VALUES else None
+
 def main():
     import optparse
     from pprint import pprint
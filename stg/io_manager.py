@@ -18,6 +18,11 @@ from stg.constants import *
 import sys
 import logging
 import os
+import shutil
+import hashlib
+import tempfile
+import json
+from datetime import datetime
 
 import numpy
 
@@ -26,6 +31,7 @@ import stg.general_guidebook as general_guidebook
 from stg.dry import dry
 
 import keoni.fbf as fbf
+import keoni.fbf.workspace as Workspace
 
 LOG = logging.getLogger(__name__)
 
@@ -45,19 +51,189 @@ DAY_SUFFIX                = "_dayfinal"
 NIGHT_SUFFIX              = "_nightfinal"
 DAY_NOBS_SUFFIX           = "_daynobsfinal"
 NIGHT_NOBS_SUFFIX         = "_nightnobsfinal"
-EXPECTED_FINAL_SUFFIXES   = [DAY_SUFFIX,      NIGHT_SUFFIX,
-                             DAY_NOBS_SUFFIX, NIGHT_NOBS_SUFFIX]
+DAY_DENSITY_SUFFIX        = "_daydensityfinal"
+NIGHT_DENSITY_SUFFIX      = "_nightdensityfinal"
+EXPECTED_FINAL_SUFFIXES   = [DAY_SUFFIX,         NIGHT_SUFFIX,
+                             DAY_NOBS_SUFFIX,    NIGHT_NOBS_SUFFIX,
+                             DAY_DENSITY_SUFFIX, NIGHT_DENSITY_SUFFIX]
+
+# these are suffixes used for the temporary and final files of ragged (compressed sparse row) grids
+DAY_VALUES_TEMP_SUFFIX    = "_dayvaluestemp"
+NIGHT_VALUES_TEMP_SUFFIX  = "_nightvaluestemp"
+DAY_CELLS_TEMP_SUFFIX     = "_daycellstemp"
+NIGHT_CELLS_TEMP_SUFFIX   = "_nightcellstemp"
+DAY_VALUES_SUFFIX         = "_dayvaluesfinal"
+NIGHT_VALUES_SUFFIX       = "_nightvaluesfinal"
+DAY_OFFSETS_SUFFIX        = "_dayoffsetsfinal"
+NIGHT_OFFSETS_SUFFIX      = "_nightoffsetsfinal"
+EXPECTED_RAGGED_TEMP_SUFFIXES  = [DAY_VALUES_TEMP_SUFFIX, NIGHT_VALUES_TEMP_SUFFIX,
+                                  DAY_CELLS_TEMP_SUFFIX,  NIGHT_CELLS_TEMP_SUFFIX]
+EXPECTED_RAGGED_FINAL_SUFFIXES = [DAY_VALUES_SUFFIX,      NIGHT_VALUES_SUFFIX,
+                                  DAY_OFFSETS_SUFFIX,     NIGHT_OFFSETS_SUFFIX]
+
+# these are suffixes used for the daily data folded together by stats_month (which is kept so more days
+# can be added to the month later), and the monthly stats, moments and quantile sketches made from it
+DAY_MONTH_STATE_SUFFIX    = "_daymonthstate"
+NIGHT_MONTH_STATE_SUFFIX  = "_nightmonthstate"
+DAY_MONTH_STATS_SUFFIX    = "_daymonthstats"
+NIGHT_MONTH_STATS_SUFFIX  = "_nightmonthstats"
+DAY_MONTH_MOMENTS_SUFFIX  = "_daymonthmoments"
+NIGHT_MONTH_MOMENTS_SUFFIX = "_nightmonthmoments"
+DAY_MONTH_SKETCH_SUFFIX   = "_daymonthsketch"
+NIGHT_MONTH_SKETCH_SUFFIX = "_nightmonthsketch"
+EXPECTED_MONTH_STATE_SUFFIXES  = [DAY_MONTH_STATE_SUFFIX, NIGHT_MONTH_STATE_SUFFIX]
+EXPECTED_MONTH_FINAL_SUFFIXES  = [DAY_MONTH_STATS_SUFFIX, NIGHT_MONTH_STATS_SUFFIX,
+                                  DAY_MONTH_MOMENTS_SUFFIX, NIGHT_MONTH_MOMENTS_SUFFIX,
+                                  DAY_MONTH_SKETCH_SUFFIX, NIGHT_MONTH_SKETCH_SUFFIX]
+
+# these are suffixes used for the climatologies stats_climatology makes from the monthly moments
+DAY_CLIMATOLOGY_SUFFIX    = "_dayclimatology"
+NIGHT_CLIMATOLOGY_SUFFIX  = "_nightclimatology"
+EXPECTED_CLIMATOLOGY_SUFFIXES  = [DAY_CLIMATOLOGY_SUFFIX, NIGHT_CLIMATOLOGY_SUFFIX]
+
+# which offsets file goes with each ragged values file
+RAGGED_OFFSETS_SUFFIXES   = {
+                             DAY_VALUES_SUFFIX:   DAY_OFFSETS_SUFFIX,
+                             NIGHT_VALUES_SUFFIX: NIGHT_OFFSETS_SUFFIX,
+                            }
+
+# the data type used for cell ids and offsets in ragged grids
+RAGGED_INDEX_DATA_TYPE    = numpy.dtype(numpy.int64)
+
+# these are suffixes used for the final accumulator files; each field of the
+# accumulator is saved in it's own file with the field name at the end
+DAY_MOMENTS_SUFFIX        = "_daymoments"
+NIGHT_MOMENTS_SUFFIX      = "_nightmoments"
+DAY_HISTOGRAM_SUFFIX      = "_dayhistogram"
+NIGHT_HISTOGRAM_SUFFIX    = "_nighthistogram"
+DAY_CATEGORIES_SUFFIX     = "_daycategories"
+NIGHT_CATEGORIES_SUFFIX   = "_nightcategories"
+DAY_JOINT_SUFFIX          = "_dayjoint"
+NIGHT_JOINT_SUFFIX        = "_nightjoint"
+DAY_SKETCH_SUFFIX         = "_daysketch"
+NIGHT_SKETCH_SUFFIX       = "_nightsketch"
+DAY_STATS_SUFFIX          = "_daystats"
+NIGHT_STATS_SUFFIX        = "_nightstats"
+EXPECTED_ACCUMULATOR_SUFFIXES  = [DAY_MOMENTS_SUFFIX,     NIGHT_MOMENTS_SUFFIX,
+                                  DAY_HISTOGRAM_SUFFIX,   NIGHT_HISTOGRAM_SUFFIX,
+                                  DAY_CATEGORIES_SUFFIX,  NIGHT_CATEGORIES_SUFFIX,
+                                  DAY_JOINT_SUFFIX,       NIGHT_JOINT_SUFFIX,
+                                  DAY_SKETCH_SUFFIX,      NIGHT_SKETCH_SUFFIX,
+                                  DAY_STATS_SUFFIX,       NIGHT_STATS_SUFFIX]
+
+# the kinds of files we produce for each time of day
+TEMP_FILE                 = "temp"
+DENSITY_TEMP_FILE         = "density temp"
+NOBS_TEMP_FILE            = "nobs temp"
+VALUES_TEMP_FILE          = "values temp"
+CELLS_TEMP_FILE           = "cells temp"
+FINAL_FILE                = "final"
+NOBS_FINAL_FILE           = "nobs final"
+DENSITY_FINAL_FILE        = "density final"
+VALUES_FINAL_FILE         = "values final"
+MOMENTS_FILE              = "moments"
+HISTOGRAM_FILE            = "histogram"
+CATEGORIES_FILE           = "categories"
+JOINT_HISTOGRAM_FILE      = "joint histogram"
+SKETCH_FILE               = "sketch"
+STATS_FILE                = "stats"
+MONTH_STATE_FILE          = "month state"
+MONTH_STATS_FILE          = "month stats"
+MONTH_MOMENTS_FILE        = "month moments"
+MONTH_SKETCH_FILE         = "month sketch"
+CLIMATOLOGY_FILE          = "climatology"
+
+# the suffix for each kind of file, by time of day
+SUFFIXES_BY_TIME_OF_DAY   = {
+                             DAY_KEY:   {
+                                         TEMP_FILE:          DAY_TEMP_SUFFIX,
+                                         DENSITY_TEMP_FILE:  DAY_DENSITY_TEMP_SUFFIX,
+                                         NOBS_TEMP_FILE:     DAY_NOBS_TEMP_SUFFIX,
+                                         VALUES_TEMP_FILE:   DAY_VALUES_TEMP_SUFFIX,
+                                         CELLS_TEMP_FILE:    DAY_CELLS_TEMP_SUFFIX,
+                                         FINAL_FILE:         DAY_SUFFIX,
+                                         NOBS_FINAL_FILE:    DAY_NOBS_SUFFIX,
+                                         DENSITY_FINAL_FILE: DAY_DENSITY_SUFFIX,
+                                         VALUES_FINAL_FILE:  DAY_VALUES_SUFFIX,
+                                         MOMENTS_FILE:       DAY_MOMENTS_SUFFIX,
+                                         HISTOGRAM_FILE:     DAY_HISTOGRAM_SUFFIX,
+                                         CATEGORIES_FILE:    DAY_CATEGORIES_SUFFIX,
+                                         JOINT_HISTOGRAM_FILE: DAY_JOINT_SUFFIX,
+                                         SKETCH_FILE:        DAY_SKETCH_SUFFIX,
+                                         STATS_FILE:         DAY_STATS_SUFFIX,
+                                         MONTH_STATE_FILE:   DAY_MONTH_STATE_SUFFIX,
+                                         MONTH_STATS_FILE:   DAY_MONTH_STATS_SUFFIX,
+                                         MONTH_MOMENTS_FILE: DAY_MONTH_MOMENTS_SUFFIX,
+                                         MONTH_SKETCH_FILE:  DAY_MONTH_SKETCH_SUFFIX,
+                                         CLIMATOLOGY_FILE:   DAY_CLIMATOLOGY_SUFFIX,
+                                        },
+                             NIGHT_KEY: {
+                                         TEMP_FILE:          NIGHT_TEMP_SUFFIX,
+                                         DENSITY_TEMP_FILE:  NIGHT_DENSITY_TEMP_SUFFIX,
+                                         NOBS_TEMP_FILE:     NIGHT_NOBS_TEMP_SUFFIX,
+                                         VALUES_TEMP_FILE:   NIGHT_VALUES_TEMP_SUFFIX,
+                                         CELLS_TEMP_FILE:    NIGHT_CELLS_TEMP_SUFFIX,
+                                         FINAL_FILE:         NIGHT_SUFFIX,
+                                         NOBS_FINAL_FILE:    NIGHT_NOBS_SUFFIX,
+                                         DENSITY_FINAL_FILE: NIGHT_DENSITY_SUFFIX,
+                                         VALUES_FINAL_FILE:  NIGHT_VALUES_SUFFIX,
+                                         MOMENTS_FILE:       NIGHT_MOMENTS_SUFFIX,
+                                         HISTOGRAM_FILE:     NIGHT_HISTOGRAM_SUFFIX,
+                                         CATEGORIES_FILE:    NIGHT_CATEGORIES_SUFFIX,
+                                         JOINT_HISTOGRAM_FILE: NIGHT_JOINT_SUFFIX,
+                                         SKETCH_FILE:        NIGHT_SKETCH_SUFFIX,
+                                         STATS_FILE:         NIGHT_STATS_SUFFIX,
+                                         MONTH_STATE_FILE:   NIGHT_MONTH_STATE_SUFFIX,
+                                         MONTH_STATS_FILE:   NIGHT_MONTH_STATS_SUFFIX,
+                                         MONTH_MOMENTS_FILE: NIGHT_MONTH_MOMENTS_SUFFIX,
+                                         MONTH_SKETCH_FILE:  NIGHT_MONTH_SKETCH_SUFFIX,
+                                         CLIMATOLOGY_FILE:   NIGHT_CLIMATOLOGY_SUFFIX,
+                                        },
+                            }
 
 # all the suffixes we can produce
 ALL_EXPECTED_SUFFIXES     = [DAY_TEMP_SUFFIX,         NIGHT_TEMP_SUFFIX,
                              DAY_DENSITY_TEMP_SUFFIX, NIGHT_DENSITY_TEMP_SUFFIX,
                              DAY_NOBS_TEMP_SUFFIX,    NIGHT_NOBS_TEMP_SUFFIX,
                              DAY_SUFFIX,              NIGHT_SUFFIX,
-                             DAY_NOBS_SUFFIX,         NIGHT_NOBS_SUFFIX]
+                             DAY_NOBS_SUFFIX,         NIGHT_NOBS_SUFFIX,
+                             DAY_DENSITY_SUFFIX,      NIGHT_DENSITY_SUFFIX] \
+                            + EXPECTED_RAGGED_TEMP_SUFFIXES + EXPECTED_RAGGED_FINAL_SUFFIXES \
+                            + EXPECTED_ACCUMULATOR_SUFFIXES \
+                            + EXPECTED_MONTH_STATE_SUFFIXES + EXPECTED_MONTH_FINAL_SUFFIXES \
+                            + EXPECTED_CLIMATOLOGY_SUFFIXES
 
 # the strftime format for date stamping our files
 DATE_STAMP_FORMAT         = "%Y%m%d"
 
+# the strftime format for stamping climatology files with the month of the year they're for
+CLIMATOLOGY_STAMP_FORMAT  = "month%m"
+
+# the name and suffix of the manifest space_day keeps to track which files it's finished with
+MANIFEST_NAME             = "space_day"
+MANIFEST_SUFFIX           = "_manifest.json"
+
+# the suffixes of the index of days and the running nobs statistics kept with each month state
+MONTH_STATE_INDEX_SUFFIX  = "_index.json"
+MONTH_STATE_NOBS_SUFFIX   = "_nobs"
+
+# the navigation data kept in the navigation cache for each file
+NAV_CACHE_KEYS            = [DAY_MASK_KEY,      NIGHT_MASK_KEY,
+                             DAY_LON_INDEX_KEY, DAY_LAT_INDEX_KEY,
+                             NIGHT_LON_INDEX_KEY, NIGHT_LAT_INDEX_KEY]
+
+# the pieces of information kept about each grid store
+STORE_PATH_KEY            = "path"
+STORE_LAYER_SHAPE_KEY     = "layer shape"
+STORE_DATA_TYPE_KEY       = "data type"
+STORE_LAYERS_KEY          = "layers"
+STORE_MAPPING_KEY         = "mapping"
+STORE_INITIAL_LAYERS_KEY  = "initial layers"
+STORE_IN_MEMORY_KEY       = "in memory"
+
+# how many layers a grid store allocates space for the first time data is added to it
+GRID_STORE_INITIAL_LAYERS = 16
+
 def open_file (file_path) :
     """
     given a file path that is a modis file, open it
@@ -104,6 +280,159 @@ def load_variable_from_file (variable_name, file_path=None, file_object=None,
 
     return file_object, temp_data
 
+def get_nav_cache_path (cache_path, file_path, grid_degrees, minimum_scan_angle) :
+    """
+    get the directory where the cached navigation data for a file is kept
+    
+    the directory name is keyed on the identity of the file (it's path, size and modification time)
+    and on the gridding settings that the navigation data depends on, so a changed file or changed
+    settings will never see stale navigation data
+    """
+    
+    file_path  = os.path.abspath(file_path)
+    file_stat  = os.stat(file_path)
+    identity   = repr((file_path, file_stat.st_size, file_stat.st_mtime, float(grid_degrees), float(minimum_scan_angle)))
+    
+    return os.path.join(cache_path, os.path.basename(file_path) + "." + hashlib.sha1(identity).hexdigest())
+
+def load_nav_cache (cache_path, file_path, grid_degrees, minimum_scan_angle) :
+    """
+    load the cached navigation data for a file, if there is any
+    
+    the arrays are memory mapped rather than read; if there is no cached data None is returned
+    """
+    
+    nav_cache_path = get_nav_cache_path(cache_path, file_path, grid_degrees, minimum_scan_angle)
+    if not os.path.isdir(nav_cache_path) :
+        return None
+    
+    nav_data = { }
+    for key in NAV_CACHE_KEYS :
+        nav_data[key] = numpy.load(os.path.join(nav_cache_path, key + ".npy"), mmap_mode='r')
+    
+    return nav_data
+
+def _get_umask () :
+    """
+    get the file mode creation mask of this process
+    
+    Linux reports it in /proc/self/status; anywhere else the only way to read it is to set it
+    and put it back, which could briefly give files other threads create the wrong permissions
+    """
+    
+    try :
+        with open("/proc/self/status") as status_file :
+            for line in status_file :
+                if line.startswith("Umask:") :
+                    return int(line.split()[1], 8)
+    except IOError :
+        pass
+    
+    umask = os.umask(0)
+    os.umask(umask)
+    
+    return umask
+
+def _set_default_permissions (path, is_directory=False) :
+    """
+    give a file or directory made by tempfile (which only the owner can use) the
+    permissions it would have had if it had been created normally
+    """
+    
+    os.chmod(path, (0777 if is_directory else 0666) & ~_get_umask())
+
+def save_nav_cache (cache_path, file_path, grid_degrees, minimum_scan_angle, nav_data) :
+    """
+    save the navigation data for a file in the navigation cache
+    
+    the data is written to a temporary directory that is then renamed into place,
+    so a partly written cache entry will never be loaded
+    """
+    
+    nav_cache_path = get_nav_cache_path(cache_path, file_path, grid_degrees, minimum_scan_angle)
+    if os.path.isdir(nav_cache_path) :
+        return
+    if not os.path.isdir(cache_path) :
+        os.makedirs(cache_path)
+    
+    temp_path = tempfile.mkdtemp(dir=cache_path)
+    for key in NAV_CACHE_KEYS :
+        numpy.save(os.path.join(temp_path, key + ".npy"), nav_data[key])
+    _set_default_permissions(temp_path, is_directory=True)
+    
+    try :
+        os.rename(temp_path, nav_cache_path)
+    except OSError :
+        # someone else cached this file first
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+def get_manifest_path (output_path, date_time) :
+    """
+    get the path of the space_day run manifest for the given day in the output directory
+    """
+    
+    return os.path.join(output_path, build_name_stem(MANIFEST_NAME, date_time=date_time, suffix=MANIFEST_SUFFIX))
+
+def load_manifest (manifest_path) :
+    """
+    load a run manifest, returns None if there isn't one
+    """
+    
+    if not os.path.exists(manifest_path) :
+        return None
+    
+    manifest_file = open(manifest_path, 'r')
+    manifest      = json.load(manifest_file)
+    manifest_file.close()
+    
+    return manifest
+
+def save_manifest (manifest_path, manifest) :
+    """
+    save a run manifest
+    
+    the manifest is written to a temporary file that is then renamed over the
+    old one, so a partly written manifest will never be loaded
+    """
+    
+    temp_handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path))
+    temp_file = os.fdopen(temp_handle, 'w')
+    json.dump(manifest, temp_file, indent=1, sort_keys=True)
+    temp_file.flush()
+    os.fsync(temp_file.fileno())
+    temp_file.close()
+    _set_default_permissions(temp_path)
+    
+    os.rename(temp_path, manifest_path)
+
+def save_checkpoint_arrays (file_path, named_arrays) :
+    """
+    save a dictionary of named arrays to a checkpoint file
+    
+    like save_manifest, the file is written under a temporary name and then renamed into place
+    """
+    
+    temp_handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".npz")
+    temp_file = os.fdopen(temp_handle, 'wb')
+    numpy.savez(temp_file, **named_arrays)
+    temp_file.flush()
+    os.fsync(temp_file.fileno())
+    temp_file.close()
+    _set_default_permissions(temp_path)
+    
+    os.rename(temp_path, file_path)
+
+def load_checkpoint_arrays (file_path) :
+    """
+    load the dictionary of named arrays saved in a checkpoint file
+    """
+    
+    checkpoint    = numpy.load(file_path)
+    named_arrays  = dict([(name, checkpoint[name]) for name in checkpoint.files])
+    checkpoint.close()
+    
+    return named_arrays
+
 def save_data_to_file (stem_name, grid_shape, output_path, data_array, data_type, file_permissions="a") :
     """
     save numpy data to the appropriate file name given the information about the stem and path
@@ -114,15 +443,345 @@ def save_data_to_file (stem_name, grid_shape, output_path, data_array, data_type
     
     temp_file = fbf.filename(stem_name, data_type, shape=grid_shape)
     temp_path = os.path.join(output_path, temp_file)
-    temp_file_obj = open(temp_path, 'a')
+    temp_file_obj = open(temp_path, file_permissions)
     data_array.astype(data_type).tofile(temp_file_obj)
     temp_file_obj.close()
 
-def build_name_stem (variable_name, date_time=None, satellite=None, algorithm=None, suffix=None) :
+def get_grid_file_path (stem_name, grid_shape, path, data_type) :
+    """
+    get the path of the flat binary file of grid shaped layers with the given stem in the directory
+    """
+    
+    return os.path.join(path, fbf.filename(stem_name, numpy.dtype(data_type), shape=grid_shape))
+
+def open_grid_file (stem_name, grid_shape, input_path, data_type) :
+    """
+    open a flat binary file of grid shaped layers, like the ones save_data_to_file makes,
+    read only and without reading it into memory
+    
+    returns a (layers, grid_lon_size, grid_lat_size) memory map of the file
+    """
+    
+    data_type   = numpy.dtype(data_type)
+    file_path   = get_grid_file_path(stem_name, grid_shape, input_path, data_type)
+    layer_shape = tuple(grid_shape)
+    num_layers  = os.path.getsize(file_path) // (data_type.itemsize * int(numpy.prod(layer_shape)))
+    
+    # numpy can't map an empty file
+    if num_layers <= 0 :
+        return numpy.zeros((0,) + layer_shape, dtype=data_type)
+    
+    return numpy.memmap(file_path, dtype=data_type, mode='r', shape=(num_layers,) + layer_shape)
+
+def open_grid_store (stem_name, grid_shape, output_path, data_type,
+                     initial_layers=GRID_STORE_INITIAL_LAYERS, in_memory=False) :
+    """
+    open a grid store, a flat binary file that's kept memory mapped while
+    layers of data are added to it
+    
+    each layer has the grid shape (or is a single value if the grid shape is
+    None); the file is named the same way save_data_to_file would name it,
+    and if it already exists the layers in it are kept. Space for the layers
+    is allocated in advance and doubled whenever it runs out, so call
+    close_grid_store when you're done to trim the file to the data
+    
+    if in_memory is True the layers are kept in memory instead, and no file
+    is made unless the store is spilled to disk with spill_grid_store
+    """
+    
+    layer_shape = tuple(grid_shape) if grid_shape is not None else ( )
+    data_type   = numpy.dtype(data_type)
+    file_path   = os.path.join(output_path, fbf.filename(stem_name, data_type, shape=grid_shape))
+    layer_bytes = data_type.itemsize * int(numpy.prod(layer_shape))
+    
+    # make the file if needed and figure out how many layers are already in it
+    num_layers  = 0
+    if not in_memory :
+        open(file_path, 'ab').close()
+        num_layers = os.path.getsize(file_path) // layer_bytes
+    
+    grid_store  = {
+                   STORE_PATH_KEY:           file_path,
+                   STORE_LAYER_SHAPE_KEY:    layer_shape,
+                   STORE_DATA_TYPE_KEY:      data_type,
+                   STORE_LAYERS_KEY:         num_layers,
+                   STORE_MAPPING_KEY:        None,
+                   STORE_INITIAL_LAYERS_KEY: initial_layers,
+                   STORE_IN_MEMORY_KEY:      in_memory,
+                  }
+    
+    if num_layers > 0 :
+        _resize_grid_store(grid_store, num_layers)
+    
+    return grid_store
+
+def _resize_grid_store (grid_store, num_layers) :
+    """
+    change the space allocated for a grid store to the given number of layers
+    
+    for stores on disk the file is resized and remapped; for stores in memory
+    a new array is allocated and the existing layers are copied into it
+    """
+    
+    layer_shape = grid_store[STORE_LAYER_SHAPE_KEY]
+    data_type   = grid_store[STORE_DATA_TYPE_KEY]
+    
+    if grid_store[STORE_IN_MEMORY_KEY] :
+        new_array = numpy.empty((num_layers,) + layer_shape, dtype=data_type)
+        kept      = min(num_layers, grid_store[STORE_LAYERS_KEY])
+        if kept > 0 :
+            new_array[:kept] = grid_store[STORE_MAPPING_KEY][:kept]
+        grid_store[STORE_MAPPING_KEY] = new_array
+        return
+    
+    # let go of the old mapping before we change the file under it
+    if grid_store[STORE_MAPPING_KEY] is not None :
+        grid_store[STORE_MAPPING_KEY].flush()
+        grid_store[STORE_MAPPING_KEY] = None
+    
+    file_obj = open(grid_store[STORE_PATH_KEY], 'r+b')
+    file_obj.truncate(num_layers * data_type.itemsize * int(numpy.prod(layer_shape)))
+    file_obj.close()
+    
+    # numpy can't map an empty file
+    if num_layers > 0 :
+        grid_store[STORE_MAPPING_KEY] = numpy.memmap(grid_store[STORE_PATH_KEY], dtype=data_type, mode='r+',
+                                                     shape=(num_layers,) + layer_shape)
+
+def append_to_grid_store (grid_store, data_array) :
+    """
+    add the data to the end of a grid store
+    
+    the data array must hold a whole number of layers; a single layer
+    may be passed without the leading layer dimension
+    """
+    
+    layer_shape = grid_store[STORE_LAYER_SHAPE_KEY]
+    data_array  = numpy.asarray(data_array).reshape((-1,) + layer_shape)
+    start       = grid_store[STORE_LAYERS_KEY]
+    end         = start + data_array.shape[0]
+    
+    if data_array.shape[0] <= 0 :
+        return
+    
+    # make more space if we need it
+    mapping     = grid_store[STORE_MAPPING_KEY]
+    capacity    = mapping.shape[0] if mapping is not None else 0
+    if end > capacity :
+        _resize_grid_store(grid_store, max(end, capacity * 2, grid_store[STORE_INITIAL_LAYERS_KEY]))
+    
+    grid_store[STORE_MAPPING_KEY][start:end] = data_array
+    grid_store[STORE_LAYERS_KEY] = end
+
+def write_grid_store_layer (grid_store, layer_index, data_array) :
+    """
+    replace one of the layers already in a grid store with the data
+    """
+    
+    if (layer_index < 0) or (layer_index >= grid_store[STORE_LAYERS_KEY]) :
+        raise IndexError("Layer " + str(layer_index) + " is not in grid store " + grid_store[STORE_PATH_KEY])
+    
+    grid_store[STORE_MAPPING_KEY][layer_index] = numpy.asarray(data_array).reshape(grid_store[STORE_LAYER_SHAPE_KEY])
+
+def set_grid_store_layers (grid_store, num_layers, fill_value=None) :
+    """
+    make a grid store hold exactly the given number of layers
+    
+    layers past the new end are dropped; new layers are filled with the fill value,
+    or left as whatever the file held if no fill value is given
+    """
+    
+    start = grid_store[STORE_LAYERS_KEY]
+    _resize_grid_store(grid_store, num_layers)
+    grid_store[STORE_LAYERS_KEY] = num_layers
+    
+    if (fill_value is not None) and (num_layers > start) :
+        grid_store[STORE_MAPPING_KEY][start:num_layers] = fill_value
+
+def read_grid_store (grid_store) :
+    """
+    get the layers in a grid store
+    
+    the array returned is a view of the store's memory mapping (or memory),
+    so it should not be used after the store is closed or spilled
+    """
+    
+    if grid_store[STORE_MAPPING_KEY] is None :
+        return numpy.zeros((0,) + grid_store[STORE_LAYER_SHAPE_KEY], dtype=grid_store[STORE_DATA_TYPE_KEY])
+    
+    return grid_store[STORE_MAPPING_KEY][:grid_store[STORE_LAYERS_KEY]]
+
+def get_grid_store_memory_size (grid_store) :
+    """
+    get the number of bytes of memory a grid store is holding its layers in;
+    stores on disk are counted as 0 since the system can page them out
+    """
+    
+    if (not grid_store[STORE_IN_MEMORY_KEY]) or (grid_store[STORE_MAPPING_KEY] is None) :
+        return 0
+    
+    return grid_store[STORE_MAPPING_KEY].nbytes
+
+def spill_grid_store (grid_store) :
+    """
+    move a grid store that's in memory to it's file on disk; stores
+    that are already on disk are left alone
+    """
+    
+    if not grid_store[STORE_IN_MEMORY_KEY] :
+        return
+    
+    LOG.debug("Moving grid store to disk: " + grid_store[STORE_PATH_KEY])
+    
+    num_layers   = grid_store[STORE_LAYERS_KEY]
+    memory_array = grid_store[STORE_MAPPING_KEY]
+    
+    temp_file_obj = open(grid_store[STORE_PATH_KEY], 'wb')
+    if num_layers > 0 :
+        memory_array[:num_layers].tofile(temp_file_obj)
+    temp_file_obj.close()
+    
+    grid_store[STORE_IN_MEMORY_KEY] = False
+    grid_store[STORE_MAPPING_KEY]   = None
+    if num_layers > 0 :
+        _resize_grid_store(grid_store, num_layers)
+
+def flush_grid_store (grid_store) :
+    """
+    make sure everything added to a grid store on disk has been written to it's file
+    """
+    
+    if (not grid_store[STORE_IN_MEMORY_KEY]) and (grid_store[STORE_MAPPING_KEY] is not None) :
+        grid_store[STORE_MAPPING_KEY].flush()
+
+def close_grid_store (grid_store) :
+    """
+    flush a grid store and trim it's file to the layers that were added;
+    stores that are in memory are just dropped
+    """
+    
+    if not grid_store[STORE_IN_MEMORY_KEY] :
+        _resize_grid_store(grid_store, grid_store[STORE_LAYERS_KEY])
+    grid_store[STORE_MAPPING_KEY] = None
+
+def save_ragged_grid_to_files (values_stem_name, grid_shape, output_path, offsets_array, values_array, data_type) :
+    """
+    save a ragged (compressed sparse row) grid to a flat values file and a grid shaped offsets file
+    
+    the values are saved under the given values stem and the offsets under the matching
+    offsets stem (see get_ragged_offsets_stem)
+    """
+    
+    save_data_to_file(values_stem_name, None, output_path, values_array, data_type, file_permissions="w")
+    save_data_to_file(get_ragged_offsets_stem(values_stem_name), grid_shape, output_path,
+                      offsets_array, RAGGED_INDEX_DATA_TYPE, file_permissions="w")
+
+def load_ragged_grid (values_stem_name, input_path) :
+    """
+    load a ragged (compressed sparse row) grid that was saved with save_ragged_grid_to_files
+    
+    returns the offsets array (in the grid shape) and the flat values array
+    """
+    
+    workspace     = Workspace.Workspace(dir=input_path)
+    values_array  = workspace[values_stem_name][:]
+    offsets_array = workspace[get_ragged_offsets_stem(values_stem_name)][:]
+    offsets_array = offsets_array.reshape(offsets_array.shape[-2:])
+    
+    return offsets_array, values_array
+
+def open_ragged_grid (values_stem_name, grid_shape, input_path, data_type) :
+    """
+    open a ragged (compressed sparse row) grid that was saved with save_ragged_grid_to_files,
+    read only and without reading the values into memory
+    
+    returns the offsets array (in the grid shape) and a memory map of the flat values array;
+    an OSError is raised if the grid has no offsets file for the given grid shape
+    """
+    
+    data_type     = numpy.dtype(data_type)
+    offsets_array = open_grid_file(get_ragged_offsets_stem(values_stem_name), grid_shape,
+                                   input_path, RAGGED_INDEX_DATA_TYPE)[0]
+    values_path   = os.path.join(input_path, fbf.filename(values_stem_name, data_type, shape=None))
+    num_values    = os.path.getsize(values_path) // data_type.itemsize
+    
+    # numpy can't map an empty file
+    if num_values <= 0 :
+        return offsets_array, numpy.zeros((0,), dtype=data_type)
+    
+    return offsets_array, numpy.memmap(values_path, dtype=data_type, mode='r', shape=(num_values,))
+
+def is_ragged_values_stem (stem_name) :
+    """
+    determine if a file stem names the values of a ragged grid
+    """
+    
+    return any(stem_name.endswith(suffix) for suffix in RAGGED_OFFSETS_SUFFIXES.keys())
+
+def get_ragged_offsets_stem (values_stem_name) :
+    """
+    given the stem of a ragged values file, get the stem of its offsets file
+    """
+    
+    for values_suffix, offsets_suffix in RAGGED_OFFSETS_SUFFIXES.items() :
+        if values_stem_name.endswith(values_suffix) :
+            return values_stem_name[:-len(values_suffix)] + offsets_suffix
+    
+    raise ValueError("File stem " + str(values_stem_name) + " does not name a ragged values file.")
+
+def save_accumulator_to_files (stem_name, grid_shape, output_path, accumulator) :
+    """
+    save each field of an accumulator to it's own file, named with the stem followed by the field name
+    
+    grid shaped fields are saved as layers of the grid and flat fields are saved as flat files,
+    each using the data type of the field
+    """
+    
+    for field_name, field_data in accumulator.items() :
+        field_shape = grid_shape if field_data.ndim > 1 else None
+        save_data_to_file(stem_name + "_" + field_name, field_shape, output_path,
+                          field_data, field_data.dtype, file_permissions="w")
+
+def load_accumulator_from_files (stem_name, input_path, field_names) :
+    """
+    load the given fields of an accumulator that was saved with save_accumulator_to_files
+    
+    grid shaped fields are returned as (layers, grid_lon_size, grid_lat_size) arrays
+    """
+    
+    workspace   = Workspace.Workspace(dir=input_path)
+    accumulator = { }
+    for field_name in field_names :
+        accumulator[field_name] = workspace[stem_name + "_" + field_name][:]
+    
+    return accumulator
+
+def split_name_stem (stem_name, suffix) :
+    """given a file stem made by build_name_stem with a date time and the given suffix (but no
+    satellite or algorithm), get the date time and variable name back out of it
+    
+    if the stem doesn't end with the suffix or start with a date stamp None, None is returned
+    """
+    
+    if not stem_name.endswith(suffix) :
+        return None, None
+    
+    date_stamp, _, variable_name = stem_name[:len(stem_name) - len(suffix)].partition("_")
+    try :
+        date_time = datetime.strptime(date_stamp, DATE_STAMP_FORMAT)
+    except ValueError :
+        return None, None
+    
+    return date_time, variable_name
+
+def build_name_stem (variable_name, date_time=None, satellite=None, algorithm=None, suffix=None,
+                     date_format=DATE_STAMP_FORMAT) :
     """given information on what's in the file, build a file stem
     if there's extra info like the date time, satellite, algorithm name, or a suffix
     include that in the file stem as well
     
+    the date time is stamped with the date format, which is DATE_STAMP_FORMAT unless another is given
+    
     the name format is:
             satellite_algorithm_datestamp_variablename_suffix
     """
@@ -131,7 +790,7 @@ def build_name_stem (variable_name, date_time=None, satellite=None, algorithm=No
     stem_name = variable_name
     
     # if we have a date time, add a time stamp at the beginning
-    stem_name = date_time.strftime(DATE_STAMP_FORMAT) + "_" + stem_name if date_time is not None else stem_name
+    stem_name = date_time.strftime(date_format) + "_" + stem_name if date_time is not None else stem_name
     
     # if we have an algorithm prefix add that
     stem_name = algorithm + "_" + stem_name if algorithm is not None else stem_name
@@ -28,6 +28,9 @@ import matplotlib.cm          as cm
 import keoni.fbf.workspace as Workspace
 from mpl_toolkits.basemap import Basemap
 
+import stg.io_manager     as io_manager
+import stg.space_gridding as space_gridding
+
 DEFAULT_FILE_PATTERN = "*.real4.*.*"
 DEFAULT_FILL_VALUE   = numpy.nan
 DEFAULT_DPI          = 150
@@ -169,9 +172,15 @@ def load_fbf (file_name, in_dir='.') :
     """
     
     # get the data from the file
-    var_workspace = Workspace.Workspace(dir=in_dir)
     fbf_attr_name = file_name.split(".")[0]
-    raw_data      = var_workspace[fbf_attr_name][:]
+    
+    # ragged grids need to be unpacked using their offsets
+    if io_manager.is_ragged_values_stem(fbf_attr_name) :
+        offsets, values = io_manager.load_ragged_grid(fbf_attr_name, in_dir)
+        raw_data        = space_gridding.unpack_ragged_grid(offsets, values)
+    else :
+        var_workspace = Workspace.Workspace(dir=in_dir)
+        raw_data      = var_workspace[fbf_attr_name][:]
     
     return raw_data, fbf_attr_name
 
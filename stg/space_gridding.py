@@ -15,6 +15,7 @@ Copyright (C) 2014 Space Science and Engineering Center (SSEC),
 """
 __docformat__ = "restructuredtext en"
 
+import math
 import numpy
 import logging
 
@@ -22,29 +23,175 @@ from stg.constants import *
 
 LOG = logging.getLogger(__name__)
 
+# the integer type used for grid indexes and flattened cell ids
+INDEX_DATA_TYPE = numpy.int64
+
+def calculate_grid_shape (grid_degrees, bbox=None) :
+    """
+    given the size of a grid cell in degrees, calculate the (lon, lat) shape of the global grid
+    
+    if a bounding box is given, the shape of the regional grid for that box is calculated instead
+    (see calculate_region)
+    """
+    
+    if bbox is not None :
+        _, _, region_lon_size, region_lat_size = calculate_region(grid_degrees, bbox)
+        return region_lon_size, region_lat_size
+    
+    grid_lon_size = int(math.ceil(360.0 / grid_degrees))
+    grid_lat_size = int(math.ceil(180.0 / grid_degrees))
+    
+    return grid_lon_size, grid_lat_size
+
+def calculate_region (grid_degrees, bbox) :
+    """
+    given the size of a grid cell in degrees and a (west, south, east, north) bounding box
+    in degrees, figure out which cells of the global grid have their centers in the box
+    
+    returns the lon and lat index of the region's first cell in the global grid and the
+    lon and lat size of the region; if west is greater than east the region wraps across
+    the date line
+    """
+    
+    grid_lon_size, grid_lat_size = calculate_grid_shape(grid_degrees)
+    west, south, east, north     = bbox
+    
+    lon_start = int(math.ceil ((west  + 180.0) / grid_degrees))
+    lon_end   = int(math.floor((east  + 180.0) / grid_degrees))
+    lon_end   = lon_end + grid_lon_size if west > east else lon_end
+    lat_start = max(int(math.ceil ((south + 90.0) / grid_degrees)), 0)
+    lat_end   = min(int(math.floor((north + 90.0) / grid_degrees)), grid_lat_size - 1)
+    
+    region_lon_size = min(lon_end - lon_start + 1, grid_lon_size)
+    region_lat_size = lat_end - lat_start + 1
+    
+    if (region_lon_size <= 0) or (region_lat_size <= 0) :
+        raise ValueError("The bounding box " + str(bbox) + " does not hold any grid cells.")
+    
+    return lon_start % grid_lon_size, lat_start, region_lon_size, region_lat_size
+
+def restrict_nav_data_to_region (nav_data, grid_degrees, bbox) :
+    """
+    given navigation data with masks of the data to grid and global grid indexes for the
+    masked data, drop the data outside the region of the bounding box and shift the
+    indexes so they index the regional grid
+    
+    returns a new navigation data dictionary; the one passed in is not changed
+    """
+    
+    grid_lon_size, _ = calculate_grid_shape(grid_degrees)
+    lon_start, lat_start, region_lon_size, region_lat_size = calculate_region(grid_degrees, bbox)
+    
+    region_nav_data = { }
+    for mask_key, lon_key, lat_key in [(DAY_MASK_KEY,   DAY_LON_INDEX_KEY,   DAY_LAT_INDEX_KEY),
+                                       (NIGHT_MASK_KEY, NIGHT_LON_INDEX_KEY, NIGHT_LAT_INDEX_KEY)] :
+        
+        lon_index = (nav_data[lon_key] - lon_start) % grid_lon_size
+        lat_index =  nav_data[lat_key] - lat_start
+        in_region = (lon_index < region_lon_size) & (lat_index >= 0) & (lat_index < region_lat_size)
+        
+        # take the data outside the region out of the mask
+        mask = numpy.array(nav_data[mask_key], dtype=bool)
+        mask.flat[numpy.flatnonzero(mask)[~in_region]] = False
+        
+        region_nav_data[mask_key] = mask
+        region_nav_data[lon_key]  = lon_index[in_region]
+        region_nav_data[lat_key]  = lat_index[in_region]
+    
+    return region_nav_data
+
 def calculate_index_from_nav_data (aux_data, grid_degrees) :
     """
     given the aux data, use the navigation and masks to calculate
-    where the elements will be space gridded 
+    where the elements will be space gridded
+    
+    the returned indexes are integer arrays that can be used directly to index the space grid
     """
     
-    night_lon_temp = aux_data[LON_KEY][aux_data[NIGHT_MASK_KEY]]
-    night_lat_temp = aux_data[LAT_KEY][aux_data[NIGHT_MASK_KEY]]
+    grid_lon_size, grid_lat_size = calculate_grid_shape(grid_degrees)
     
     # figure out where the day/night indexes will fall
-    day_lon_index   = numpy.round((aux_data[LON_KEY][aux_data[DAY_MASK_KEY]]   + 180.0) / grid_degrees)
-    day_lat_index   = numpy.round((aux_data[LAT_KEY][aux_data[DAY_MASK_KEY]]   +  90.0) / grid_degrees)
-    night_lon_index = numpy.round((aux_data[LON_KEY][aux_data[NIGHT_MASK_KEY]] + 180.0) / grid_degrees)
-    night_lat_index = numpy.round((aux_data[LAT_KEY][aux_data[NIGHT_MASK_KEY]] +  90.0) / grid_degrees)
-
+    day_lon_index   = numpy.round((aux_data[LON_KEY][aux_data[DAY_MASK_KEY]]   + 180.0) / grid_degrees).astype(INDEX_DATA_TYPE)
+    day_lat_index   = numpy.round((aux_data[LAT_KEY][aux_data[DAY_MASK_KEY]]   +  90.0) / grid_degrees).astype(INDEX_DATA_TYPE)
+    night_lon_index = numpy.round((aux_data[LON_KEY][aux_data[NIGHT_MASK_KEY]] + 180.0) / grid_degrees).astype(INDEX_DATA_TYPE)
+    night_lat_index = numpy.round((aux_data[LAT_KEY][aux_data[NIGHT_MASK_KEY]] +  90.0) / grid_degrees).astype(INDEX_DATA_TYPE)
+    
     # wrap geo indices to valid range; -180 == 180 syndrome gives us one too many indices
-    day_lon_index = day_lon_index % (360.0 / grid_degrees)
-    day_lat_index = day_lat_index % (180.0 / grid_degrees)
-    night_lon_index = night_lon_index % (360.0 / grid_degrees)
-    night_lat_index = night_lat_index % (180.0 / grid_degrees)
-
+    day_lon_index   %= grid_lon_size
+    day_lat_index   %= grid_lat_size
+    night_lon_index %= grid_lon_size
+    night_lat_index %= grid_lat_size
+    
     return day_lon_index, day_lat_index, night_lon_index, night_lat_index
 
+def calculate_cell_ids (lon_indexes, lat_indexes, grid_lat_size) :
+    """
+    given integer lon/lat indexes, calculate the flattened id of each grid cell
+
+    the ids match the C ordering of a (grid_lon_size, grid_lat_size) grid
+    """
+    
+    return (numpy.asarray(lon_indexes, dtype=INDEX_DATA_TYPE) * grid_lat_size
+            + numpy.asarray(lat_indexes, dtype=INDEX_DATA_TYPE))
+
+def calculate_cell_order (cell_ids) :
+    """
+    given flattened cell ids, calculate the order that will sort the observations by cell
+
+    the sort is stable, so observations in the same cell keep their original order
+    """
+    
+    return numpy.argsort(cell_ids, kind='mergesort')
+
+# the keys used in a granule layout
+GATHER_INDEX_KEY = "gather_index"
+CELL_IDS_KEY     = "cell_ids"
+NOBS_CELLS_KEY   = "nobs_cells"
+NOBS_COUNTS_KEY  = "nobs_counts"
+
+def calculate_granule_layout (grid_lon_size, grid_lat_size, mask, lon_indexes, lat_indexes) :
+    """
+    given a mask of the data in a granule that should be gridded and the lon/lat indexes
+    of the masked data, calculate how the data will be laid out in the space grid
+    
+    the layout only depends on the navigation, so it can be calculated once per granule and
+    shared by all the variables in it; it holds the flat indexes of the masked data sorted by
+    cell (the gather index), the sorted flattened cell ids, and the ids of the cells the masked
+    data touches with the number of observations in each (see expand_nobs_map)
+    """
+    
+    cell_ids        = calculate_cell_ids(lon_indexes, lat_indexes, grid_lat_size)
+    cell_order      = calculate_cell_order(cell_ids)
+    sorted_cell_ids = cell_ids[cell_order]
+    
+    # keep the nobs to the cells the granule touches; most of the grid is empty
+    nobs_cells, nobs_counts = numpy.unique(sorted_cell_ids, return_counts=True)
+    
+    return {
+            GATHER_INDEX_KEY: numpy.flatnonzero(mask)[cell_order],
+            CELL_IDS_KEY:     sorted_cell_ids,
+            NOBS_CELLS_KEY:   nobs_cells,
+            NOBS_COUNTS_KEY:  nobs_counts,
+           }
+
+def expand_nobs_map (layout, grid_lon_size, grid_lat_size) :
+    """
+    given a granule layout, make a (grid_lon_size, grid_lat_size) nobs map of the masked data
+    """
+    
+    nobs_map = numpy.zeros(grid_lon_size * grid_lat_size, dtype=numpy.float64)
+    nobs_map[layout[NOBS_CELLS_KEY]] = layout[NOBS_COUNTS_KEY]
+    
+    return nobs_map.reshape((grid_lon_size, grid_lat_size))
+
+def gather_sorted_data (layout, data) :
+    """
+    given a granule layout and a variable's data for the whole granule, pull out the masked
+    data sorted by cell with a single gather
+    """
+    
+    return numpy.ravel(data)[layout[GATHER_INDEX_KEY]]
+
 def space_grid_data (grid_lon_size, grid_lat_size, data, lon_indexes, lat_indexes ) :
     """
     given lon/lat indexes, data, and the grid size, sort the data into a space grid
@@ -52,37 +199,46 @@ def space_grid_data (grid_lon_size, grid_lat_size, data, lon_indexes, lat_indexe
     returns the filled space grid (empty space is NaN values), a density map of where the data is, and the size of the deepest bucket
     """
     
-    if data.size > 0 :
-        print ("data range: " + str(data.min()) + " " + str(data.max()))
+    cell_ids   = calculate_cell_ids(lon_indexes, lat_indexes, grid_lat_size)
+    cell_order = calculate_cell_order(cell_ids)
+    
+    return space_grid_sorted_data(grid_lon_size, grid_lat_size,
+                                  numpy.ravel(data)[cell_order], cell_ids[cell_order])
+
+def space_grid_sorted_data (grid_lon_size, grid_lat_size, sorted_data, sorted_cell_ids) :
+    """
+    given data and flattened cell ids that have already been stably sorted by cell,
+    sort the data into a space grid
+    
+    returns the same values as space_grid_data
+    """
     
     space_grid_shape = (grid_lon_size, grid_lat_size) # TODO, is this the correct order?
+    num_cells        = grid_lon_size * grid_lat_size
+    
+    # count all the observations and the finite ones in each cell
+    finite_mask    = numpy.isfinite(sorted_data)
+    finite_cells   = sorted_cell_ids[finite_mask]
+    nobs_counts    = numpy.bincount(sorted_cell_ids, minlength=num_cells)
+    density_counts = numpy.bincount(finite_cells,    minlength=num_cells)
     
     # create the density map and figure out how dense the data will be
-    # FUTURE, I do not like this looping solution, figure out how to do this in native numpy ops
-    density_map = numpy.zeros(space_grid_shape)
-    nobs_map    = numpy.zeros(space_grid_shape)
-    for index in range(data.size) :
-        nobs_map[lon_indexes[index], lat_indexes[index]] += 1
-        if numpy.isfinite(data[index]) :
-            density_map[lon_indexes[index], lat_indexes[index]] += 1
-    max_depth = numpy.max(density_map)
-    
-    print ("max depth: " + str(max_depth))
-    
-    # create the space grids for this variable
-    space_grid = numpy.ones((max_depth, grid_lon_size, grid_lat_size), dtype=numpy.float32) * numpy.nan #TODO, dtype
-    temp_depth = numpy.zeros(space_grid_shape)
-    
-    # put the variable data into the space grid
-    # FUTURE, I do not like this looping solution, figure out how to do this in native numpy ops
-    for index in range(data.size) :
-        if numpy.isfinite(data[index]) :
-            depth = temp_depth[lon_indexes[index], lat_indexes[index]]
-            space_grid[depth,  lon_indexes[index], lat_indexes[index]] = data[index]
-            temp_depth[        lon_indexes[index], lat_indexes[index]] += 1
-    
-    if space_grid.size > 0 :
-        print ("grid range: "), numpy.nanmin(space_grid), numpy.nanmax(space_grid)
+    density_map = density_counts.reshape(space_grid_shape).astype(numpy.float64)
+    nobs_map    = nobs_counts.reshape(space_grid_shape).astype(numpy.float64)
+    max_depth   = numpy.max(density_map)
+    
+    LOG.debug("  finite values: " + str(finite_cells.size) + " of " + str(sorted_cell_ids.size))
+    LOG.debug("  max depth:     " + str(max_depth))
+    
+    # since the data is sorted by cell, the depth of each value is its rank within its cell
+    cell_starts = numpy.cumsum(density_counts) - density_counts
+    depths      = numpy.arange(finite_cells.size, dtype=INDEX_DATA_TYPE) - cell_starts[finite_cells]
+    
+    # create the space grids for this variable and put the variable data into it
+    space_grid = numpy.empty((int(max_depth), num_cells), dtype=numpy.float32) #TODO, dtype
+    space_grid.fill(numpy.nan)
+    space_grid[depths, finite_cells] = sorted_data[finite_mask]
+    space_grid = space_grid.reshape((int(max_depth), grid_lon_size, grid_lat_size))
     
     return space_grid, density_map, nobs_map, max_depth
 
@@ -98,23 +254,142 @@ def pack_space_grid (data_array, density_array) :
     max_depth = numpy.max(numpy.sum(density_array, axis=0))
     
     # create the final data array at the right depth
-    final_data = numpy.ones((max_depth, data_array.shape[1], data_array.shape[2]), dtype=data_array.dtype) * numpy.nan
+    final_data = numpy.empty((int(max_depth), data_array.shape[1], data_array.shape[2]), dtype=data_array.dtype)
+    final_data.fill(numpy.nan)
     
     LOG.debug("  original data shape: " + str(data_array.shape))
     LOG.debug("  final data shape:    " + str(final_data.shape))
     
+    # the packed depth of each finite value is the number of finite values above it in its column
+    finite_mask = numpy.isfinite(data_array)
+    depth_rank  = numpy.cumsum(finite_mask, axis=0, dtype=numpy.int32)
+    _, rows, cols = numpy.nonzero(finite_mask)
+    
     # sort the sparse data into the final array
-    # FUTURE, find a way to do this without loops
-    for rows in range(data_array.shape[1]) :
-        for cols in range(data_array.shape[2]) :
-            
-            # pull the data for this element
-            temp_data = data_array[:, rows, cols]
-            temp      = temp_data[numpy.isfinite(temp_data)]
-            
-            # put the data for this element into the final array
-            final_data[0:temp.size, rows, cols] = temp
+    final_data[depth_rank[finite_mask] - 1, rows, cols] = data_array[finite_mask]
     
     return final_data
 
+def scatter_sorted_data (packed_data, cell_depths, sorted_data, sorted_cell_ids) :
+    """
+    given a packed array of space gridded data shaped (depth, number of cells), the number
+    of values already in each cell, and finite data stably sorted by it's flattened cell id,
+    put the data into the packed array below the values already in each cell
+    
+    the cell depths are updated in place; the packed array must be deep enough to hold the data
+    """
+    
+    if sorted_data.size <= 0 :
+        return
+    
+    counts      = numpy.bincount(sorted_cell_ids, minlength=cell_depths.size)
+    cell_starts = numpy.cumsum(counts) - counts
+    depths      = (cell_depths[sorted_cell_ids]
+                   + numpy.arange(sorted_data.size, dtype=INDEX_DATA_TYPE) - cell_starts[sorted_cell_ids])
+    
+    packed_data[depths, sorted_cell_ids] = sorted_data
+    cell_depths += counts
+
+def reservoir_scatter_sorted_data (packed_data, cell_counts, sorted_data, sorted_cell_ids, random_state) :
+    """
+    given a packed array of space gridded data shaped (depth, number of cells), the number
+    of values seen so far in each cell, and finite data stably sorted by it's flattened cell id,
+    put the data into the packed array, keeping a uniform random sample of the values seen in
+    each cell once it's full
+    
+    this is reservoir sampling (algorithm R) done for every cell at once: the n-th value seen
+    in a cell goes in the n-th layer while there's room, and after that replaces a random layer
+    with probability depth / n; the cell counts are updated in place and keep counting the
+    values seen, so they may be more than the depth of the packed array
+    """
+    
+    if sorted_data.size <= 0 :
+        return
+    
+    max_depth   = packed_data.shape[0]
+    counts      = numpy.bincount(sorted_cell_ids, minlength=cell_counts.size)
+    cell_starts = numpy.cumsum(counts) - counts
+    ranks       = (cell_counts[sorted_cell_ids]
+                   + numpy.arange(sorted_data.size, dtype=INDEX_DATA_TYPE) - cell_starts[sorted_cell_ids])
+    
+    # pick a random layer for each value that arrives after it's cell is full
+    depths      = ranks.copy()
+    is_full     = ranks >= max_depth
+    depths[is_full] = numpy.floor(random_state.random_sample(numpy.sum(is_full)) * (ranks[is_full] + 1)).astype(INDEX_DATA_TYPE)
+    is_kept     = depths < max_depth
+    
+    # when more than one value lands in the same place, the last one to arrive is the one kept
+    places      = depths[is_kept] * cell_counts.size + sorted_cell_ids[is_kept]
+    _, last_places = numpy.unique(places[::-1], return_index=True)
+    last_places = places.size - 1 - last_places
+    
+    packed_data[depths[is_kept][last_places], sorted_cell_ids[is_kept][last_places]] = sorted_data[is_kept][last_places]
+    cell_counts += counts
+
+def ragged_grid_data (grid_lon_size, grid_lat_size, data, lon_indexes, lat_indexes) :
+    """
+    given lon/lat indexes, data, and the grid size, sort the finite data by grid cell
+    without building a space grid
+    
+    returns the finite data sorted by cell, the flattened cell id of each of those values,
+    and a nobs map of all the observations (finite or not)
+    """
+    
+    cell_ids   = calculate_cell_ids(lon_indexes, lat_indexes, grid_lat_size)
+    cell_order = calculate_cell_order(cell_ids)
+    
+    nobs_map = numpy.bincount(cell_ids, minlength=grid_lon_size * grid_lat_size)
+    nobs_map = nobs_map.reshape((grid_lon_size, grid_lat_size)).astype(numpy.float64)
+    
+    sorted_values, sorted_cell_ids = ragged_grid_sorted_data(numpy.ravel(data)[cell_order], cell_ids[cell_order])
+    
+    return sorted_values, sorted_cell_ids, nobs_map
+
+def ragged_grid_sorted_data (sorted_data, sorted_cell_ids) :
+    """
+    given data and flattened cell ids that have already been stably sorted by cell,
+    keep only the finite data and the ids of the cells it falls in
+    """
+    
+    finite_mask = numpy.isfinite(sorted_data)
+    
+    return sorted_data[finite_mask], sorted_cell_ids[finite_mask]
+
+def pack_ragged_grid (grid_lon_size, grid_lat_size, values, cell_ids) :
+    """
+    given values and their flattened cell ids in the order they were observed, create
+    a ragged (compressed sparse row) version of the space grid
+    
+    returns a (grid_lon_size, grid_lat_size) array of the offset where each cell's data
+    ends in the values array, and the values sorted by cell; the data for a cell starts
+    where the data for the previous cell (in C order) ends, so the first cell starts at 0
+    
+    Note: values in each cell keep the order they were observed in, so unpacking the
+    ragged grid gives the same array pack_space_grid would
+    """
+    
+    cell_order = calculate_cell_order(cell_ids)
+    counts     = numpy.bincount(numpy.asarray(cell_ids, dtype=INDEX_DATA_TYPE),
+                                minlength=grid_lon_size * grid_lat_size)
+    offsets    = numpy.cumsum(counts).reshape((grid_lon_size, grid_lat_size))
+    
+    return offsets, numpy.asarray(values)[cell_order]
+
+def unpack_ragged_grid (offsets, values) :
+    """
+    given the offsets and values of a ragged grid, create the equivalent packed space grid
+    (empty space is NaN values)
+    """
+    
+    ends     = numpy.ravel(offsets).astype(INDEX_DATA_TYPE)
+    counts   = numpy.diff(numpy.concatenate(([0], ends)))
+    cell_ids = numpy.repeat(numpy.arange(ends.size, dtype=INDEX_DATA_TYPE), counts)
+    depths   = numpy.arange(cell_ids.size, dtype=INDEX_DATA_TYPE) - (ends - counts)[cell_ids]
+    
+    max_depth  = numpy.max(counts) if counts.size > 0 else 0
+    final_data = numpy.empty((int(max_depth), ends.size), dtype=values.dtype)
+    final_data.fill(numpy.nan)
+    final_data[depths, cell_ids] = values
+    
+    return final_data.reshape((int(max_depth),) + offsets.shape)
 
@@ -21,10 +21,16 @@ import pkg_resources
 import os
 import math
 import glob
+import multiprocessing
+import itertools
+import threading
+import Queue
+import sys
 
 import numpy
 
 from collections import defaultdict
+from datetime    import datetime
 
 import keoni.fbf.workspace as Workspace
 import keoni.fbf       as fbf
@@ -33,10 +39,111 @@ from stg.constants import *
 import stg.general_guidebook as general_guidebook
 import stg.io_manager        as io_manager
 import stg.space_gridding    as space_gridding
+import stg.time_gridding     as time_gridding
+import stg.grid_accumulators as grid_accumulators
+import stg.catalog           as input_catalog
 
 # TODO, in the long run handle the dtype more flexibly
 TEMP_DATA_TYPE = numpy.dtype(numpy.float32)
 
+# the products space_day can create
+PRODUCT_CUBE       = "cube"
+PRODUCT_MOMENTS    = "moments"
+PRODUCT_HISTOGRAM  = "histogram"
+PRODUCT_CATEGORIES = "categories"
+PRODUCT_JOINT      = "joint"
+PRODUCT_SKETCH     = "sketch"
+ALL_PRODUCTS       = [PRODUCT_CUBE, PRODUCT_MOMENTS, PRODUCT_HISTOGRAM, PRODUCT_CATEGORIES, PRODUCT_JOINT, PRODUCT_SKETCH]
+
+# joins the names of the two variables in a joint histogram to name the histogram
+JOINT_NAME_SEPARATOR = "_vs_"
+
+# the statistics stats_day can calculate
+STAT_MEAN  = "mean"
+STAT_STD   = "std"
+STAT_MIN   = "min"
+STAT_MAX   = "max"
+STAT_COUNT = "count"
+STAT_NOBS  = "nobs"
+STAT_WEIGHTED_MEAN = "weightedmean"
+ALL_STATS  = [STAT_MEAN, STAT_STD, STAT_MIN, STAT_MAX, STAT_COUNT, STAT_NOBS, STAT_WEIGHTED_MEAN]
+
+# the names of the percentiles stats_month and stats_climatology estimate from the quantile sketches (ie. p50)
+STAT_PERCENTILE_FORMAT = "p%g"
+
+# the pieces of information kept about a month of daily data folded together by stats_month;
+# everything but the grid stores, running nobs statistics, quantile sketch, and paths is saved in the month's index
+MONTH_DAYS_KEY       = "days"
+MONTH_IDENTITIES_KEY = "identities"
+MONTH_SHAPE_KEY      = "grid shape"
+MONTH_CHECKPOINT_KEY = "checkpoint"
+MONTH_SEQUENCE_KEY   = "sequence"
+MONTH_COMPLETE_KEY   = "complete"
+MONTH_STORES_KEY     = "stores"
+MONTH_NOBS_KEY       = "nobs stats"
+MONTH_INDEX_PATH_KEY = "index path"
+MONTH_SKETCH_DAYS_KEY = "sketch days"
+MONTH_SKETCH_KEY     = "sketch"
+MONTH_SKETCH_STEM_KEY = "sketch stem"
+MONTH_INDEX_KEYS     = [MONTH_DAYS_KEY, MONTH_IDENTITIES_KEY, MONTH_SHAPE_KEY,
+                        MONTH_CHECKPOINT_KEY, MONTH_SEQUENCE_KEY, MONTH_COMPLETE_KEY, MONTH_SKETCH_DAYS_KEY]
+
+# the names of the pieces of data grid_granule produces for the cube product
+SPACE_GRID_RESULT = "space grid"
+DENSITY_RESULT    = "density"
+NOBS_RESULT       = "nobs"
+VALUES_RESULT     = "values"
+CELLS_RESULT      = "cells"
+
+# the kind of temporary file each of the pieces for the cube product is kept in
+TEMP_FILE_KINDS   = {
+                     SPACE_GRID_RESULT: io_manager.TEMP_FILE,
+                     DENSITY_RESULT:    io_manager.DENSITY_TEMP_FILE,
+                     NOBS_RESULT:       io_manager.NOBS_TEMP_FILE,
+                     VALUES_RESULT:     io_manager.VALUES_TEMP_FILE,
+                     CELLS_RESULT:      io_manager.CELLS_TEMP_FILE,
+                    }
+
+# the pieces of information kept about each packed grid filled in by a prescanned or depth capped space_day
+PACKED_STORE_KEY  = "store"
+PACKED_DEPTHS_KEY = "depths"
+PACKED_NOBS_KEY   = "nobs"
+PACKED_RANDOM_KEY = "random state"
+
+# the format of the times given on the command line
+TIME_OPTION_FORMAT      = "%Y-%m-%dT%H:%M"
+
+# the pieces of information kept in a space_day manifest
+MANIFEST_SETTINGS_KEY   = "settings"
+MANIFEST_GRANULES_KEY   = "granules"
+MANIFEST_STORES_KEY     = "stores"
+MANIFEST_CHECKPOINT_KEY = "checkpoint"
+MANIFEST_SEQUENCE_KEY   = "sequence"
+
+# separates the parts of the keys of the grid stores and accumulators when they're saved in a manifest
+MANIFEST_KEY_SEPARATOR  = "|"
+
+# the products that are accumulated in memory, the functions used to merge them, the kind of file
+# they're saved in, and the functions used to coarsen them for the grid pyramid
+ACCUMULATOR_PRODUCTS = {
+                        PRODUCT_MOMENTS:   (grid_accumulators.merge_moment_accumulators,   io_manager.MOMENTS_FILE,
+                                            grid_accumulators.coarsen_moment_accumulator),
+                        PRODUCT_HISTOGRAM: (grid_accumulators.merge_histogram_accumulators, io_manager.HISTOGRAM_FILE,
+                                            grid_accumulators.coarsen_histogram_accumulator),
+                        PRODUCT_CATEGORIES: (grid_accumulators.merge_category_accumulators, io_manager.CATEGORIES_FILE,
+                                             grid_accumulators.coarsen_category_accumulator),
+                        PRODUCT_JOINT:     (grid_accumulators.merge_joint_histogram_accumulators, io_manager.JOINT_HISTOGRAM_FILE,
+                                            grid_accumulators.coarsen_joint_histogram_accumulator),
+                        PRODUCT_SKETCH:    (grid_accumulators.merge_sketch_accumulators,    io_manager.SKETCH_FILE,
+                                            grid_accumulators.coarsen_sketch_accumulator),
+                       }
+
+# the name of the sub-directory the accumulators for each coarser level of the grid pyramid are saved in
+PYRAMID_DIRECTORY_FORMAT = "%gdeg"
+
+# marks the end of the items passed between the pipeline threads
+_END_OF_QUEUE = object()
+
 LOG = logging.getLogger(__name__)
 
 def get_version_string() :
@@ -70,6 +177,1187 @@ def _safe_remove(fn):
     except StandardError:
         LOG.error("Could not remove %s" % fn)
 
+def read_granule (file_path, variable_names, grid_degrees, min_scan_angle, nav_cache_path=None, bbox=None) :
+    """read the navigation data and the given variables from one input file
+    
+    returns the navigation data (see load_nav_data) and a dictionary of the
+    variables' data keyed on variable name
+    """
+    
+    LOG.debug("Reading file: " + file_path)
+    
+    # load the day/night masks and the indexes for the space grid
+    # (we can do this now since the lon/lat is the same for each variable in the file)
+    file_object, nav_data = load_nav_data(file_path, grid_degrees, min_scan_angle,
+                                          nav_cache_path=nav_cache_path, bbox=bbox)
+    
+    # load each of the variables
+    variable_data = { }
+    for variable_name in variable_names :
+        file_object, variable_data[variable_name] = io_manager.load_variable_from_file (variable_name,
+                                                                                      file_path=file_path,
+                                                                                      file_object=file_object)
+    
+    # make sure each file is closed when we're done with it
+    if file_object is not None :
+        io_manager.close_file(file_path, file_object)
+    
+    return nav_data, variable_data
+
+def grid_granule_data (nav_data, variable_data, grid_degrees, products,
+                       ragged=False, histogram_bin_edges=None, category_values=None, joint_bin_edges=None, bbox=None) :
+    """grid the variables read from one input file by read_granule
+    
+    returns a dictionary keyed on (variable name, time of day); each entry
+    holds the gridded pieces of that variable needed for the cube product
+    (the space grid, density and nobs maps, or the values, cells and nobs
+    for ragged grids) and an accumulator for each accumulated product; the
+    joint histograms are keyed on the name of the pair of variables (see
+    get_joint_name)
+    
+    joint_bin_edges maps each (x variable name, y variable name) pair to
+    the bin edges to use for each variable; pairs that weren't both read
+    from this file are skipped
+    
+    if a bounding box is given, the navigation data must have been restricted
+    to the same box, and the data is gridded into the regional grid for it
+    """
+    
+    grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees, bbox=bbox)
+    histogram_bin_edges = { } if histogram_bin_edges is None else histogram_bin_edges
+    category_values     = { } if category_values     is None else category_values
+    joint_bin_edges     = { } if joint_bin_edges     is None else joint_bin_edges
+    granule_results     = { }
+    
+    # sort out the order the day/night data will be gridded in once, since it's the same for every variable
+    granule_layouts = {
+                       DAY_KEY:   space_gridding.calculate_granule_layout(grid_lon_size, grid_lat_size,
+                                                                          nav_data[DAY_MASK_KEY],
+                                                                          nav_data[DAY_LON_INDEX_KEY],
+                                                                          nav_data[DAY_LAT_INDEX_KEY]),
+                       NIGHT_KEY: space_gridding.calculate_granule_layout(grid_lon_size, grid_lat_size,
+                                                                          nav_data[NIGHT_MASK_KEY],
+                                                                          nav_data[NIGHT_LON_INDEX_KEY],
+                                                                          nav_data[NIGHT_LAT_INDEX_KEY]),
+                      }
+    
+    # process each of the variables
+    for variable_name in sorted(variable_data.keys()) :
+        
+        LOG.debug("Processing variable: " + variable_name)
+        
+        var_data = variable_data[variable_name]
+        
+        for time_of_day in [DAY_KEY, NIGHT_KEY] :
+            
+            results = granule_results[(variable_name, time_of_day)] = { }
+            
+            # pull out the data for this time of day, sorted by the cell it falls in
+            sorted_data_temp = space_gridding.gather_sorted_data(granule_layouts[time_of_day], var_data)
+            cell_ids_temp    = granule_layouts[time_of_day][space_gridding.CELL_IDS_KEY]
+            
+            # ragged grids and accumulators only need the finite data
+            if ragged or len(products & set(ACCUMULATOR_PRODUCTS.keys())) > 0 :
+                values_temp, cells_temp = space_gridding.ragged_grid_sorted_data(sorted_data_temp, cell_ids_temp)
+            
+            # make this file's accumulators for this variable
+            if PRODUCT_MOMENTS in products :
+                results[PRODUCT_MOMENTS]   = grid_accumulators.calculate_moment_accumulator(grid_lon_size, grid_lat_size,
+                                                                                            values_temp, cells_temp,
+                                                                                            granule_layouts[time_of_day][space_gridding.NOBS_CELLS_KEY],
+                                                                                            granule_layouts[time_of_day][space_gridding.NOBS_COUNTS_KEY])
+            if (PRODUCT_HISTOGRAM in products) and (histogram_bin_edges.get(variable_name) is not None) :
+                results[PRODUCT_HISTOGRAM] = grid_accumulators.calculate_histogram_accumulator(grid_lon_size, grid_lat_size,
+                                                                                               values_temp, cells_temp,
+                                                                                               histogram_bin_edges[variable_name])
+            if (PRODUCT_CATEGORIES in products) and (category_values.get(variable_name) is not None) :
+                results[PRODUCT_CATEGORIES] = grid_accumulators.calculate_category_accumulator(grid_lon_size, grid_lat_size,
+                                                                                               values_temp, cells_temp,
+                                                                                               category_values[variable_name])
+            if PRODUCT_SKETCH in products :
+                results[PRODUCT_SKETCH]    = grid_accumulators.calculate_sketch_accumulator(grid_lon_size, grid_lat_size,
+                                                                                            values_temp, cells_temp)
+            
+            if PRODUCT_CUBE not in products :
+                continue
+            
+            # keep the ragged data and the cells it falls in
+            if ragged :
+                results[VALUES_RESULT] = values_temp
+                results[CELLS_RESULT]  = cells_temp
+                results[NOBS_RESULT]   = space_gridding.expand_nobs_map(granule_layouts[time_of_day], grid_lon_size, grid_lat_size)
+                continue
+            
+            # space grid the data using the indexes we calculated earlier
+            results[SPACE_GRID_RESULT], results[DENSITY_RESULT], results[NOBS_RESULT], _ = space_gridding.space_grid_sorted_data (grid_lon_size, grid_lat_size,
+                                                                                                                                   sorted_data_temp,
+                                                                                                                                   cell_ids_temp)
+    
+    # bin each pair of variables together, using the observations where both are finite
+    for x_variable_name, y_variable_name in sorted(joint_bin_edges.keys()) if PRODUCT_JOINT in products else [ ] :
+        
+        if (x_variable_name not in variable_data) or (y_variable_name not in variable_data) :
+            continue
+        
+        LOG.debug("Processing joint histogram: " + get_joint_name(x_variable_name, y_variable_name))
+        
+        x_bin_edges, y_bin_edges = joint_bin_edges[(x_variable_name, y_variable_name)]
+        for time_of_day in [DAY_KEY, NIGHT_KEY] :
+            x_sorted_data = space_gridding.gather_sorted_data(granule_layouts[time_of_day], variable_data[x_variable_name])
+            y_sorted_data = space_gridding.gather_sorted_data(granule_layouts[time_of_day], variable_data[y_variable_name])
+            granule_results[(get_joint_name(x_variable_name, y_variable_name), time_of_day)] = {
+                PRODUCT_JOINT: grid_accumulators.calculate_joint_histogram_accumulator(grid_lon_size, grid_lat_size,
+                                                                                       x_sorted_data, y_sorted_data,
+                                                                                       granule_layouts[time_of_day][space_gridding.CELL_IDS_KEY],
+                                                                                       x_bin_edges, y_bin_edges),
+                }
+    
+    return granule_results
+
+def get_joint_name (x_variable_name, y_variable_name) :
+    """get the name the joint histogram of two variables is saved under
+    """
+    
+    return x_variable_name + JOINT_NAME_SEPARATOR + y_variable_name
+
+def grid_granule (file_path, variable_names, grid_degrees, min_scan_angle, products,
+                  ragged=False, histogram_bin_edges=None, category_values=None, joint_bin_edges=None,
+                  nav_cache_path=None, bbox=None) :
+    """read and grid the given variables from one input file
+    
+    see grid_granule_data for what is returned
+    
+    Note: this only reads from the input file, so several files can be
+    gridded at once in different processes
+    """
+    
+    nav_data, variable_data = read_granule(file_path, variable_names, grid_degrees, min_scan_angle,
+                                           nav_cache_path=nav_cache_path, bbox=bbox)
+    
+    return grid_granule_data(nav_data, variable_data, grid_degrees, products,
+                             ragged=ragged, histogram_bin_edges=histogram_bin_edges, category_values=category_values,
+                             joint_bin_edges=joint_bin_edges, bbox=bbox)
+
+def _grid_granule_from_args (args) :
+    """call grid_granule with a tuple of arguments, so it can be mapped over a list of files
+    """
+    
+    return grid_granule(*args)
+
+def _fill_queue (items, item_queue) :
+    """put each of the items in the queue, followed by the end of queue marker
+    
+    if getting the items fails, the exception info is put in the queue so it
+    can be raised by whoever is reading from it
+    """
+    
+    try :
+        for item in items :
+            item_queue.put((None, item))
+    except Exception :
+        item_queue.put((sys.exc_info(), None))
+        return
+    
+    item_queue.put((None, _END_OF_QUEUE))
+
+def _drain_queue (function, item_queue) :
+    """call the function on each item in the queue until the end of queue marker arrives
+    
+    returns the exception info if the function fails, or None; after a failure
+    the rest of the items are discarded so whoever is filling the queue won't block
+    """
+    
+    error_info = None
+    while True :
+        item = item_queue.get()
+        if item is _END_OF_QUEUE :
+            return error_info
+        if error_info is None :
+            try :
+                function(item)
+            except Exception :
+                error_info = sys.exc_info()
+
+def prefetch_items (items, queue_size) :
+    """iterate over the items, getting them in a background thread
+    
+    at most queue_size items will be gotten ahead of the caller, so
+    this can be used to overlap slow reads with other work without
+    holding too much data in memory at once
+    """
+    
+    item_queue = Queue.Queue(maxsize=queue_size)
+    fill_thread = threading.Thread(target=_fill_queue, args=(items, item_queue))
+    fill_thread.daemon = True
+    fill_thread.start()
+    
+    while True :
+        error_info, item = item_queue.get()
+        if error_info is not None :
+            raise error_info[0], error_info[1], error_info[2]
+        if item is _END_OF_QUEUE :
+            break
+        yield item
+    
+    fill_thread.join()
+
+def call_in_background (function, items, queue_size) :
+    """call the function on each of the items in a background thread
+    
+    at most queue_size items will wait for the function at once; returns
+    when the function has been called on all the items, raising any
+    exception the function raised
+    """
+    
+    item_queue   = Queue.Queue(maxsize=queue_size)
+    drain_result = [ ]
+    drain_thread = threading.Thread(target=lambda : drain_result.append(_drain_queue(function, item_queue)))
+    drain_thread.daemon = True
+    drain_thread.start()
+    
+    try :
+        for item in items :
+            item_queue.put(item)
+    finally :
+        item_queue.put(_END_OF_QUEUE)
+        drain_thread.join()
+    
+    if drain_result[0] is not None :
+        error_info = drain_result[0]
+        raise error_info[0], error_info[1], error_info[2]
+
+def fold_granule_results (granule_results, accumulators, grid_stores, date_time, output_path, space_grid_shape,
+                          memory_budget=None, packed_grids=None) :
+    """fold the results of grid_granule for one file into the day
+    
+    the gridded pieces for the cube product are appended to the temporary
+    grid stores (see open_temp_grid_store) and the file's accumulators are
+    merged into the accumulators dictionary, which is keyed on (product,
+    variable name, time of day); the file's accumulators may only cover the
+    cells it touched, but the day's accumulators always cover the whole grid
+    
+    if a memory budget (in bytes) is given, new grid stores are kept in
+    memory, and the biggest ones are moved to disk whenever all of them
+    together use more memory than the budget
+    
+    if packed grids are given (see open_packed_grids), the ragged pieces
+    are put straight into them instead of the temporary grid stores; depth
+    capped packed grids keep a random sample of each cell's values
+    """
+    
+    for (variable_name, time_of_day), results in sorted(granule_results.items()) :
+        
+        # merge this file's accumulators for this variable
+        for product in sorted(set(results.keys()) & set(ACCUMULATOR_PRODUCTS.keys())) :
+            merge_function, _, _ = ACCUMULATOR_PRODUCTS[product]
+            if (product, variable_name, time_of_day) in accumulators :
+                merge_function(accumulators[(product, variable_name, time_of_day)], results[product])
+            else :
+                accumulators[(product, variable_name, time_of_day)] = grid_accumulators.expand_accumulator(results[product],
+                                                                                                           *space_grid_shape)
+        
+        # put the data straight into it's final place in the packed grid
+        if (packed_grids is not None) and (VALUES_RESULT in results) :
+            packed_grid = packed_grids[(variable_name, time_of_day)]
+            packed_data = io_manager.read_grid_store(packed_grid[PACKED_STORE_KEY])
+            if packed_grid[PACKED_RANDOM_KEY] is not None :
+                space_gridding.reservoir_scatter_sorted_data(packed_data.reshape((packed_data.shape[0], -1)), packed_grid[PACKED_DEPTHS_KEY],
+                                                             results[VALUES_RESULT], results[CELLS_RESULT], packed_grid[PACKED_RANDOM_KEY])
+            else :
+                space_gridding.scatter_sorted_data(packed_data.reshape((packed_data.shape[0], -1)), packed_grid[PACKED_DEPTHS_KEY],
+                                                   results[VALUES_RESULT], results[CELLS_RESULT])
+            packed_grid[PACKED_NOBS_KEY] += results[NOBS_RESULT].reshape(space_grid_shape).astype(TEMP_DATA_TYPE)
+            continue
+        
+        # add the space grids, density info, nobs, or ragged data and the cells it falls in to the temporary files
+        for result_name in sorted(set(results.keys()) & set(TEMP_FILE_KINDS.keys())) :
+            file_kind = TEMP_FILE_KINDS[result_name]
+            if (file_kind, variable_name, time_of_day) not in grid_stores :
+                grid_stores[(file_kind, variable_name, time_of_day)] = open_temp_grid_store(file_kind, variable_name, time_of_day,
+                                                                                            date_time, output_path, space_grid_shape,
+                                                                                            in_memory=memory_budget is not None)
+            io_manager.append_to_grid_store(grid_stores[(file_kind, variable_name, time_of_day)], results[result_name])
+    
+    if memory_budget is not None :
+        spill_grid_stores(grid_stores, memory_budget)
+
+def spill_grid_stores (grid_stores, memory_budget) :
+    """move the biggest grid stores that are in memory to disk until
+    all of them together use no more memory than the budget (in bytes)
+    """
+    
+    store_sizes = sorted([(io_manager.get_grid_store_memory_size(grid_store), key) for key, grid_store in grid_stores.items()])
+    total_size  = sum([size for size, _ in store_sizes])
+    
+    while (total_size > memory_budget) and (len(store_sizes) > 0) :
+        size, key   = store_sizes.pop()
+        io_manager.spill_grid_store(grid_stores[key])
+        total_size -= size
+
+def open_temp_grid_store (file_kind, variable_name, time_of_day, date_time, output_path, space_grid_shape, in_memory=False) :
+    """open the grid store for one of the temporary files of a variable and time of day
+    
+    the ragged values and cells are flat; the other temporary files are stacks of space grids
+    """
+    
+    is_flat   = file_kind in [io_manager.VALUES_TEMP_FILE, io_manager.CELLS_TEMP_FILE]
+    data_type = io_manager.RAGGED_INDEX_DATA_TYPE if file_kind == io_manager.CELLS_TEMP_FILE else TEMP_DATA_TYPE
+    
+    return io_manager.open_grid_store(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                 satellite=None, algorithm=None,
+                                                                 suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][file_kind]),
+                                      None if is_flat else space_grid_shape, output_path, data_type,
+                                      in_memory=in_memory)
+
+def _parse_time_option (time_string) :
+    """parse a time given on the command line, returns None if no time was given
+    """
+    
+    if time_string is None :
+        return None
+    
+    return datetime.strptime(time_string, TIME_OPTION_FORMAT)
+
+def _parse_bbox_option (bbox_string) :
+    """parse a bounding box given on the command line as west,south,east,north
+    degrees, returns None if no box was given
+    """
+    
+    if bbox_string is None :
+        return None
+    
+    bbox = tuple([float(edge) for edge in bbox_string.split(",")])
+    if len(bbox) != 4 :
+        raise ValueError("A bounding box must have four edges (west,south,east,north), not: " + bbox_string)
+    
+    return bbox
+
+def _parse_percentiles_option (percentiles_string) :
+    """parse a comma separated list of percentiles from the command line
+    
+    returns a list of floats, or None if they can't be parsed or aren't from 0 to 100
+    """
+    
+    try :
+        percentiles = [float(percentile) for percentile in percentiles_string.split(",")]
+    except ValueError :
+        return None
+    if (min(percentiles) < 0.0) or (max(percentiles) > 100.0) :
+        return None
+    
+    return percentiles
+
+def _is_in_time_window (file_name, start_time, end_time) :
+    """determine if the time in a file's name is in the time window; if there's no window
+    or we can't tell when the file is from, the file is considered to be in the window
+    """
+    
+    if (start_time is None) and (end_time is None) :
+        return True
+    
+    try :
+        file_time = general_guidebook.parse_datetime_from_filename(file_name)
+    except RuntimeError :
+        return True
+    
+    if file_time is None :
+        return True
+    
+    return ((start_time is None) or (file_time >= start_time)) and ((end_time is None) or (file_time < end_time))
+
+def save_accumulators (accumulators, date_time, output_path, space_grid_shape) :
+    """save each of the accumulators, keyed on (product, variable name, time of day), to files in the output directory
+    """
+    
+    for (product, variable_name, time_of_day), accumulator in sorted(accumulators.items()) :
+        
+        LOG.debug("Saving " + time_of_day + " " + product + " for variable: " + variable_name)
+        
+        _, file_kind, _ = ACCUMULATOR_PRODUCTS[product]
+        io_manager.save_accumulator_to_files(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                        satellite=None, algorithm=None,
+                                                                        suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][file_kind]),
+                                             space_grid_shape, output_path, accumulator)
+
+def get_file_identity (file_path) :
+    """get the size and modification time of a file, so we can tell if it changes
+    """
+    
+    file_stats = os.stat(file_path)
+    
+    return [file_stats.st_size, file_stats.st_mtime]
+
+def create_manifest (run_settings) :
+    """create an empty space_day manifest for a run with the given settings
+    """
+    
+    return {
+            MANIFEST_SETTINGS_KEY:   run_settings,
+            MANIFEST_GRANULES_KEY:   { },
+            MANIFEST_STORES_KEY:     { },
+            MANIFEST_CHECKPOINT_KEY: None,
+            MANIFEST_SEQUENCE_KEY:   0,
+           }
+
+def commit_manifest (manifest, manifest_path, accumulators, grid_stores) :
+    """record everything folded into the day so far in the manifest
+    
+    the temporary grid stores are flushed and the number of layers in each is
+    recorded; the accumulators are saved to a new checkpoint file before the
+    manifest is replaced, so the manifest on disk always describes a complete state
+    """
+    
+    for grid_store in grid_stores.values() :
+        io_manager.flush_grid_store(grid_store)
+    manifest[MANIFEST_STORES_KEY] = dict([(MANIFEST_KEY_SEPARATOR.join(key), grid_store[io_manager.STORE_LAYERS_KEY])
+                                          for key, grid_store in grid_stores.items()])
+    
+    # save the accumulators to a new checkpoint
+    old_checkpoint = manifest[MANIFEST_CHECKPOINT_KEY]
+    manifest[MANIFEST_SEQUENCE_KEY]  += 1
+    manifest[MANIFEST_CHECKPOINT_KEY] = None
+    if len(accumulators) > 0 :
+        manifest[MANIFEST_CHECKPOINT_KEY] = (os.path.basename(os.path.splitext(manifest_path)[0])
+                                             + "_checkpoint" + str(manifest[MANIFEST_SEQUENCE_KEY]) + ".npz")
+        named_arrays = { }
+        for key, accumulator in accumulators.items() :
+            for field_name, field_data in accumulator.items() :
+                named_arrays[MANIFEST_KEY_SEPARATOR.join(key + (field_name,))] = field_data
+        io_manager.save_checkpoint_arrays(os.path.join(os.path.dirname(manifest_path), manifest[MANIFEST_CHECKPOINT_KEY]),
+                                          named_arrays)
+    
+    io_manager.save_manifest(manifest_path, manifest)
+    
+    if old_checkpoint is not None :
+        _safe_remove(os.path.join(os.path.dirname(manifest_path), old_checkpoint))
+
+def restore_manifest_state (manifest, manifest_path, date_time, output_path, space_grid_shape) :
+    """reopen the temporary grid stores and reload the accumulators recorded in a manifest
+    
+    anything added to the grid stores after the manifest was last committed is dropped, and
+    temporary files the manifest doesn't know about (ie. for a variable first seen after the
+    last commit) are removed; returns the accumulators and grid stores in the same form space_day keeps them
+    """
+    
+    # remove the temporary files that were started after the last commit
+    day_stamp = date_time.strftime(io_manager.DATE_STAMP_FORMAT)
+    for time_of_day in [DAY_KEY, NIGHT_KEY] :
+        for file_kind in sorted(set(TEMP_FILE_KINDS.values())) :
+            suffix = io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][file_kind]
+            for file_path in glob.glob(os.path.join(output_path, day_stamp + "_*" + suffix + ".*")) :
+                _, variable_name = io_manager.split_name_stem(os.path.basename(file_path).split(".")[0], suffix)
+                if MANIFEST_KEY_SEPARATOR.join((file_kind, variable_name, time_of_day)) not in manifest[MANIFEST_STORES_KEY] :
+                    LOG.debug("Temporary file " + file_path + " was started after the last checkpoint.")
+                    _safe_remove(file_path)
+    
+    grid_stores = { }
+    for store_key, num_layers in manifest[MANIFEST_STORES_KEY].items() :
+        file_kind, variable_name, time_of_day = store_key.split(MANIFEST_KEY_SEPARATOR)
+        grid_store = open_temp_grid_store(file_kind, variable_name, time_of_day, date_time, output_path, space_grid_shape)
+        io_manager.set_grid_store_layers(grid_store, num_layers)
+        grid_stores[(file_kind, variable_name, time_of_day)] = grid_store
+    
+    accumulators = { }
+    if manifest[MANIFEST_CHECKPOINT_KEY] is not None :
+        named_arrays = io_manager.load_checkpoint_arrays(os.path.join(os.path.dirname(manifest_path),
+                                                                      manifest[MANIFEST_CHECKPOINT_KEY]))
+        for name, field_data in named_arrays.items() :
+            product, variable_name, time_of_day, field_name = name.split(MANIFEST_KEY_SEPARATOR)
+            accumulators.setdefault((product, variable_name, time_of_day), { })[field_name] = field_data
+    
+    return accumulators, grid_stores
+
+def prescan_nav_data (file_paths, grid_degrees, min_scan_angle, nav_cache_path=None, bbox=None) :
+    """read only the navigation data from the given files and count how many
+    observations will fall in each cell of the space grid
+    
+    returns a dictionary of (grid_lon_size, grid_lat_size) count maps keyed on time of day
+    """
+    
+    grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees, bbox=bbox)
+    nobs_counts = {
+                   DAY_KEY:   numpy.zeros((grid_lon_size, grid_lat_size), dtype=numpy.int64),
+                   NIGHT_KEY: numpy.zeros((grid_lon_size, grid_lat_size), dtype=numpy.int64),
+                  }
+    
+    for file_path in file_paths :
+        
+        LOG.debug("Prescanning file: " + file_path)
+        
+        file_object, nav_data = load_nav_data(file_path, grid_degrees, min_scan_angle,
+                                              nav_cache_path=nav_cache_path, bbox=bbox)
+        if file_object is not None :
+            io_manager.close_file(file_path, file_object)
+        
+        # only the counts are needed, so there's no need to sort the observations by cell
+        for time_of_day, lon_key, lat_key in [(DAY_KEY,   DAY_LON_INDEX_KEY,   DAY_LAT_INDEX_KEY),
+                                              (NIGHT_KEY, NIGHT_LON_INDEX_KEY, NIGHT_LAT_INDEX_KEY)] :
+            cell_ids = space_gridding.calculate_cell_ids(nav_data[lon_key], nav_data[lat_key], grid_lat_size)
+            nobs_counts[time_of_day] += numpy.bincount(cell_ids, minlength=grid_lon_size * grid_lat_size).reshape((grid_lon_size, grid_lat_size))
+    
+    return nobs_counts
+
+def open_packed_grids (variable_names, max_depths, date_time, output_path, space_grid_shape, random_seed=None) :
+    """open the final packed grid for each variable and time of day, with space for the given maximum depth
+    of each time of day, so the data can be put straight into it
+    
+    returns a dictionary keyed on (variable name, time of day); each entry holds the
+    grid store of the final file, the number of values in each cell so far and the nobs
+    
+    if a random seed is given the maximum depths are treated as a cap, and cells that fill
+    up keep a uniform random sample of their values (see reservoir_scatter_sorted_data);
+    every grid starts from the same seed, so the results are reproducible
+    """
+    
+    packed_grids = { }
+    for variable_name in sorted(variable_names) :
+        for time_of_day in [DAY_KEY, NIGHT_KEY] :
+            
+            grid_store = io_manager.open_grid_store(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                               satellite=None, algorithm=None,
+                                                                               suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.FINAL_FILE]),
+                                                    space_grid_shape, output_path, TEMP_DATA_TYPE)
+            io_manager.set_grid_store_layers(grid_store, int(max_depths[time_of_day]), fill_value=numpy.nan)
+            
+            packed_grids[(variable_name, time_of_day)] = {
+                                                          PACKED_STORE_KEY:  grid_store,
+                                                          PACKED_DEPTHS_KEY: numpy.zeros(space_grid_shape[0] * space_grid_shape[1],
+                                                                                         dtype=space_gridding.INDEX_DATA_TYPE),
+                                                          PACKED_NOBS_KEY:   numpy.zeros(space_grid_shape, dtype=TEMP_DATA_TYPE),
+                                                          PACKED_RANDOM_KEY: numpy.random.RandomState(random_seed)
+                                                                             if random_seed is not None else None,
+                                                         }
+    
+    return packed_grids
+
+def close_packed_grids (packed_grids, date_time, output_path, space_grid_shape) :
+    """trim each packed grid to the depth of the data that was put in it and save the matching nobs;
+    if a variable had no data for a time of day, it's files are not kept
+    
+    depth capped grids also save the number of finite values that fell in each cell,
+    since the grid itself only holds a sample of them
+    """
+    
+    for (variable_name, time_of_day), packed_grid in sorted(packed_grids.items()) :
+        
+        grid_store = packed_grid[PACKED_STORE_KEY]
+        max_depth  = min(int(numpy.max(packed_grid[PACKED_DEPTHS_KEY])), grid_store[io_manager.STORE_LAYERS_KEY])
+        
+        io_manager.set_grid_store_layers(grid_store, max_depth)
+        io_manager.close_grid_store(grid_store)
+        
+        if max_depth <= 0 :
+            LOG.warn("No " + time_of_day + " data was found for variable " + variable_name + ". "
+                     + time_of_day.capitalize() + " files will not be written.")
+            _safe_remove(grid_store[io_manager.STORE_PATH_KEY])
+            continue
+        
+        io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                satellite=None, algorithm=None,
+                                                                suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.NOBS_FINAL_FILE]),
+                                     space_grid_shape, output_path,
+                                     packed_grid[PACKED_NOBS_KEY], TEMP_DATA_TYPE, file_permissions="w")
+        
+        if packed_grid[PACKED_RANDOM_KEY] is not None :
+            io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                    satellite=None, algorithm=None,
+                                                                    suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.DENSITY_FINAL_FILE]),
+                                         space_grid_shape, output_path,
+                                         packed_grid[PACKED_DEPTHS_KEY].reshape(space_grid_shape), TEMP_DATA_TYPE, file_permissions="w")
+
+def load_nav_data (file_path, grid_degrees, min_scan_angle, nav_cache_path=None, bbox=None) :
+    """load the day/night masks for a file and calculate where the data
+    in each will fall in the space grid
+    
+    if a navigation cache path is given, the cached masks and indexes will
+    be used when they exist, and will be cached when they don't; the file
+    is only opened if the navigation data was not cached, so the returned
+    file object may be None
+    
+    if a bounding box is given, the data outside it is masked out and the
+    indexes are for the regional grid of the box; the cache always holds
+    the global navigation data, so it can be shared by different regions
+    """
+    
+    file_object = None
+    nav_data    = None
+    
+    if nav_cache_path is not None :
+        nav_data = io_manager.load_nav_cache(nav_cache_path, file_path, grid_degrees, min_scan_angle)
+    
+    if nav_data is None :
+        
+        # load the aux data
+        file_object, temp_aux_data = io_manager.load_aux_data(file_path, min_scan_angle)
+        
+        # calculate the indecies for the space grid based on the aux data
+        day_lon_index, day_lat_index, night_lon_index, night_lat_index = space_gridding.calculate_index_from_nav_data(temp_aux_data,
+                                                                                                                      grid_degrees)
+        nav_data = {
+                    DAY_MASK_KEY:        temp_aux_data[DAY_MASK_KEY],
+                    NIGHT_MASK_KEY:      temp_aux_data[NIGHT_MASK_KEY],
+                    DAY_LON_INDEX_KEY:   day_lon_index,
+                    DAY_LAT_INDEX_KEY:   day_lat_index,
+                    NIGHT_LON_INDEX_KEY: night_lon_index,
+                    NIGHT_LAT_INDEX_KEY: night_lat_index,
+                   }
+        
+        if nav_cache_path is not None :
+            io_manager.save_nav_cache(nav_cache_path, file_path, grid_degrees, min_scan_angle, nav_data)
+    
+    else :
+        LOG.debug("Using cached navigation data for file: " + file_path)
+    
+    if bbox is not None :
+        nav_data = space_gridding.restrict_nav_data_to_region(nav_data, grid_degrees, bbox)
+    
+    return file_object, nav_data
+
+def pack_space_grids (variable_name, time_of_day, date_time, output_path, space_grid_shape, grid_stores) :
+    """collapse the temporary space grids for one variable and time of day
+    to remove excess NaNs, and collapse the matching nobs; the final arrays
+    are saved in the output directory
+    """
+    
+    LOG.debug("Packing " + time_of_day + " space data for variable: " + variable_name)
+    
+    # get the variable's density maps
+    var_density     = io_manager.read_grid_store(grid_stores[(io_manager.DENSITY_TEMP_FILE, variable_name, time_of_day)])
+    
+    # only do the packing if we have some data
+    if numpy.sum(var_density) <= 0 :
+        LOG.warn("No " + time_of_day + " data was found for variable " + variable_name + ". "
+                 + time_of_day.capitalize() + " files will not be written.")
+        return
+    
+    # get the sparse space grid
+    var_data        = io_manager.read_grid_store(grid_stores[(io_manager.TEMP_FILE, variable_name, time_of_day)])
+    
+    # collapse the space grid
+    final_data      = space_gridding.pack_space_grid(var_data, var_density)
+    
+    # save the final array to an appropriately named file
+    io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                            satellite=None, algorithm=None,
+                                                            suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.FINAL_FILE]),
+                                 space_grid_shape, output_path, final_data,
+                                 TEMP_DATA_TYPE, file_permissions="w")
+    
+    _collapse_nobs(variable_name, time_of_day, date_time, output_path, space_grid_shape, grid_stores)
+
+def pack_ragged_grids (variable_name, time_of_day, date_time, output_path, space_grid_shape, grid_stores) :
+    """sort the temporary ragged data for one variable and time of day into
+    it's final cells, and collapse the matching nobs; the final arrays are
+    saved in the output directory
+    """
+    
+    LOG.debug("Packing " + time_of_day + " ragged space data for variable: " + variable_name)
+    
+    # get the finite data and the cells it falls in
+    values_temp   = io_manager.read_grid_store(grid_stores[(io_manager.VALUES_TEMP_FILE, variable_name, time_of_day)])
+    cells_temp    = io_manager.read_grid_store(grid_stores[(io_manager.CELLS_TEMP_FILE,  variable_name, time_of_day)])
+    
+    # only do the packing if we have some data
+    if values_temp.size <= 0 :
+        LOG.warn("No " + time_of_day + " data was found for variable " + variable_name + ". "
+                 + time_of_day.capitalize() + " files will not be written.")
+        return
+    
+    # sort the data by cell and save it with it's offsets
+    offsets_final, values_final = space_gridding.pack_ragged_grid(space_grid_shape[0], space_grid_shape[1],
+                                                                  values_temp, cells_temp)
+    io_manager.save_ragged_grid_to_files(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                    satellite=None, algorithm=None,
+                                                                    suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.VALUES_FINAL_FILE]),
+                                         space_grid_shape, output_path,
+                                         offsets_final, values_final, TEMP_DATA_TYPE)
+    
+    _collapse_nobs(variable_name, time_of_day, date_time, output_path, space_grid_shape, grid_stores)
+
+def _collapse_nobs (variable_name, time_of_day, date_time, output_path, space_grid_shape, grid_stores) :
+    """collapse the temporary nobs layers for one variable and time of day
+    and save the final nobs array in the output directory
+    """
+    
+    # get the nobs layers
+    nobs_counts   = io_manager.read_grid_store(grid_stores[(io_manager.NOBS_TEMP_FILE, variable_name, time_of_day)])
+    
+    # collapse the nobs
+    nobs_final    = numpy.sum(nobs_counts, axis=0)
+    
+    # save the final nobs array to an appropriately named file
+    io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                            satellite=None, algorithm=None,
+                                                            suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.NOBS_FINAL_FILE]),
+                                 space_grid_shape, output_path,
+                                 nobs_final, TEMP_DATA_TYPE, file_permissions="w")
+
+def calculate_day_accumulator (stem_name, variable_name, date_time, time_of_day, input_path, space_grid_shape,
+                               block_layers=16) :
+    """calculate a moment accumulator for one packed or ragged daily file made by space_day, reading
+    it through a memory map a few layers (or blocks of values) at a time, along with the nobs from
+    it's nobs file
+    
+    returns the accumulator and whether the nobs file was found; if the daily file isn't on
+    the given grid, None is returned in place of the accumulator
+    """
+    
+    is_ragged = io_manager.is_ragged_values_stem(stem_name)
+    try :
+        if is_ragged :
+            offsets, values = io_manager.open_ragged_grid(stem_name, space_grid_shape, input_path, TEMP_DATA_TYPE)
+        else :
+            data_cube = io_manager.open_grid_file(stem_name, space_grid_shape, input_path, TEMP_DATA_TYPE)
+    except OSError :
+        LOG.warn ("File " + stem_name + " is not on a " + str(space_grid_shape[0]) + " by " + str(space_grid_shape[1])
+                  + " grid and will not be used.")
+        return None, False
+    
+    nobs_map = None
+    try :
+        nobs_map = io_manager.open_grid_file(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                        satellite=None, algorithm=None,
+                                                                        suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.NOBS_FINAL_FILE]),
+                                             space_grid_shape, input_path, TEMP_DATA_TYPE)[0]
+    except OSError :
+        LOG.debug("No nobs file was found for " + stem_name)
+    
+    if is_ragged :
+        accumulator = grid_accumulators.calculate_moment_accumulator_from_ragged(offsets, values, nobs_map=nobs_map,
+                                                                                 block_size=block_layers * offsets.size)
+    else :
+        accumulator = grid_accumulators.calculate_moment_accumulator_from_cube(data_cube, nobs_map=nobs_map, block_layers=block_layers)
+    
+    return accumulator, nobs_map is not None
+
+def find_daily_stems (input_path, time_of_day, desired_variables=[ ]) :
+    """find the packed or ragged daily files made by space_day for a time of day in the input directory
+    
+    returns a sorted list of (date time, variable name, file stem); if desired variables are given,
+    only the files for those variables are returned. For ragged days the stem is the stem of the
+    values file (see io_manager.is_ragged_values_stem)
+    """
+    
+    suffixes      = io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day]
+    packed_stems  = _find_dated_stems(input_path, suffixes[io_manager.FINAL_FILE],        desired_variables)
+    ragged_stems  = _find_dated_stems(input_path, suffixes[io_manager.VALUES_FINAL_FILE], desired_variables)
+    
+    # if a day was gridded both ways, only use the packed version of it
+    packed_days   = set([(date_time, variable_name) for date_time, variable_name, _ in packed_stems])
+    
+    return sorted(packed_stems + [(date_time, variable_name, stem_name) for date_time, variable_name, stem_name in ragged_stems
+                                  if (date_time, variable_name) not in packed_days])
+
+def resolve_variable_names (user_requested_names) :
+    """given the variable names the caller asked for, which may be either the names in the files or
+    the names the guidebooks know them by (ie. "pressure"), find the names they could have in the
+    files we made from them
+    
+    returns a dictionary of the possible file variable names for each requested name
+    """
+    
+    return dict([(user_name, set([user_name]) | general_guidebook.get_variable_names_in_any_file([user_name]))
+                 for user_name in user_requested_names])
+
+def find_accumulator_stems (input_path, time_of_day, file_kind, field_name, desired_variables=[ ]) :
+    """find the accumulators of the given kind of file saved for a time of day in the input directory
+    (ie. the monthly moments saved by stats_month), looking for the file of the given field of each
+    
+    returns a sorted list of (date time, variable name, accumulator stem), like find_daily_stems
+    """
+    
+    suffix = io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][file_kind]
+    
+    # each field of the accumulator has it's own file, so look for one of them
+    return [(date_time, variable_name, stem_name[:-len("_" + field_name)])
+            for date_time, variable_name, stem_name in
+            _find_dated_stems(input_path, suffix + "_" + field_name, desired_variables)]
+
+def _find_dated_stems (input_path, suffix, desired_variables=[ ]) :
+    """find the files in the input directory with stems made by build_name_stem from a date time,
+    variable name, and the given suffix
+    
+    returns a sorted list of (date time, variable name, file stem)
+    """
+    
+    dated_stems = [ ]
+    for stem_name in set([file_name.split(".")[0] for file_name in os.listdir(input_path)]) :
+        date_time, variable_name = io_manager.split_name_stem(stem_name, suffix)
+        if (variable_name is None) or ((len(desired_variables) > 0) and (variable_name not in desired_variables)) :
+            continue
+        dated_stems.append((date_time, variable_name, stem_name))
+    
+    return sorted(dated_stems)
+
+def get_day_identity (stem_name, variable_name, date_time, time_of_day, input_path, space_grid_shape) :
+    """get the identity of a packed or ragged daily file made by space_day and it's nobs file, so we
+    can tell if the day has been reprocessed since it was added to a month
+    
+    returns None if the daily file isn't on the given grid
+    """
+    
+    # a ragged day is on the grid of it's offsets file, and is rewritten along with it
+    data_stem = io_manager.get_ragged_offsets_stem(stem_name) if io_manager.is_ragged_values_stem(stem_name) else stem_name
+    data_type = io_manager.RAGGED_INDEX_DATA_TYPE             if io_manager.is_ragged_values_stem(stem_name) else TEMP_DATA_TYPE
+    data_path = io_manager.get_grid_file_path(data_stem, space_grid_shape, input_path, data_type)
+    if not os.path.exists(data_path) :
+        return None
+    nobs_path = io_manager.get_grid_file_path(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                         satellite=None, algorithm=None,
+                                                                         suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.NOBS_FINAL_FILE]),
+                                              space_grid_shape, input_path, TEMP_DATA_TYPE)
+    
+    return [get_file_identity(data_path), get_file_identity(nobs_path) if os.path.exists(nobs_path) else None]
+
+def open_month_state (variable_name, time_of_day, month_date_time, output_path, space_grid_shape) :
+    """open the state of a month of daily data for one variable and time of day, so more days can be folded into it
+    
+    the daily moments are kept as layers of grid stores in the output directory, one layer per
+    day, so only a day or two of them need to be in memory at once; the running mean and
+    standard deviation of the daily nobs are kept in memory. The days in the month and the
+    identities of the files they came from are kept in an index next to the grid stores.
+    The daily quantile sketches are merged into one sketch for the month as they're added
+    (see update_month_sketch), which is kept with the month's other products.
+    
+    if a state for the month was saved by close_month_state it's picked back up; a state that's
+    for another grid or wasn't finished being saved is thrown away and the month is started over
+    """
+    
+    stem       = io_manager.build_name_stem(variable_name, date_time=month_date_time, satellite=None, algorithm=None,
+                                            suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.MONTH_STATE_FILE])
+    index_path = os.path.join(output_path, stem + io_manager.MONTH_STATE_INDEX_SUFFIX)
+    index      = io_manager.load_manifest(index_path)
+    if index is not None :
+        checkpoint_path = os.path.join(output_path, index[MONTH_CHECKPOINT_KEY]) if index[MONTH_CHECKPOINT_KEY] is not None else None
+        if ((not index[MONTH_COMPLETE_KEY]) or (index[MONTH_SHAPE_KEY] != list(space_grid_shape))
+                or ((checkpoint_path is not None) and (not os.path.exists(checkpoint_path)))) :
+            LOG.warn ("The saved state for " + stem + " is incomplete or for another grid. The month will be started over.")
+            if (checkpoint_path is not None) and os.path.exists(checkpoint_path) :
+                _safe_remove(checkpoint_path)
+            index = None
+    
+    month_state = {
+                   MONTH_DAYS_KEY:       [ ],
+                   MONTH_IDENTITIES_KEY: [ ],
+                   MONTH_SHAPE_KEY:      list(space_grid_shape),
+                   MONTH_CHECKPOINT_KEY: None,
+                   MONTH_SEQUENCE_KEY:   0,
+                   MONTH_COMPLETE_KEY:   True,
+                   MONTH_STORES_KEY:     { },
+                   MONTH_NOBS_KEY:       time_gridding.create_running_nobs_stats(space_grid_shape),
+                   MONTH_INDEX_PATH_KEY: index_path,
+                   MONTH_SKETCH_DAYS_KEY: { },
+                   MONTH_SKETCH_KEY:     None,
+                   MONTH_SKETCH_STEM_KEY: io_manager.build_name_stem(variable_name, date_time=month_date_time, satellite=None, algorithm=None,
+                                                                     suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.MONTH_SKETCH_FILE]),
+                  }
+    if index is not None :
+        month_state.update(index)
+    
+    # open the grid stores, dropping any days that were added after the index was saved
+    template = grid_accumulators.create_moment_accumulator(*space_grid_shape)
+    for field_name in grid_accumulators.MOMENT_FIELDS :
+        month_state[MONTH_STORES_KEY][field_name] = io_manager.open_grid_store(stem + "_" + field_name, space_grid_shape,
+                                                                               output_path, template[field_name].dtype)
+    num_days = len(month_state[MONTH_DAYS_KEY])
+    if min([grid_store[io_manager.STORE_LAYERS_KEY] for grid_store in month_state[MONTH_STORES_KEY].values()]) < num_days :
+        LOG.warn ("The saved state for " + stem + " is missing days. The month will be started over.")
+        for grid_store in month_state[MONTH_STORES_KEY].values() :
+            io_manager.close_grid_store(grid_store)
+        if month_state[MONTH_CHECKPOINT_KEY] is not None :
+            _safe_remove(os.path.join(output_path, month_state[MONTH_CHECKPOINT_KEY]))
+        _safe_remove(index_path)
+        return open_month_state(variable_name, time_of_day, month_date_time, output_path, space_grid_shape)
+    for grid_store in month_state[MONTH_STORES_KEY].values() :
+        io_manager.set_grid_store_layers(grid_store, num_days)
+    
+    if month_state[MONTH_CHECKPOINT_KEY] is not None :
+        named_arrays = io_manager.load_checkpoint_arrays(os.path.join(output_path, month_state[MONTH_CHECKPOINT_KEY]))
+        month_state[MONTH_NOBS_KEY][time_gridding.NOBS_DAYS_KEY] = len(month_state[MONTH_DAYS_KEY])
+        month_state[MONTH_NOBS_KEY][time_gridding.NOBS_MEAN_KEY] = named_arrays[time_gridding.NOBS_MEAN_KEY]
+        month_state[MONTH_NOBS_KEY][time_gridding.NOBS_M2_KEY]   = named_arrays[time_gridding.NOBS_M2_KEY]
+    
+    # without the month's sketch, the sketches have to be merged again from the days
+    if len(month_state[MONTH_SKETCH_DAYS_KEY]) > 0 :
+        if not os.path.exists(io_manager.get_grid_file_path(month_state[MONTH_SKETCH_STEM_KEY] + "_" + grid_accumulators.SKETCH_WEIGHTS_FIELD,
+                                                            space_grid_shape, output_path, grid_accumulators.SKETCH_WEIGHT_DATA_TYPE)) :
+            LOG.warn ("The quantile sketch for " + stem + " is missing. The month's sketches will be merged again.")
+            month_state[MONTH_SKETCH_DAYS_KEY] = { }
+        else :
+            month_state[MONTH_SKETCH_KEY] = _load_accumulator_from_args((month_state[MONTH_SKETCH_STEM_KEY], output_path,
+                                                                         grid_accumulators.SKETCH_FIELDS))
+    
+    return month_state
+
+def commit_month_state (month_state, complete=True) :
+    """save the month's index and running nobs statistics, after making sure the grid stores are written
+    
+    like commit_manifest, the nobs statistics go in a new checkpoint file before the index
+    is replaced; an index saved with complete=False marks the state as being changed, so if we
+    stop before it's committed again the month is started over the next time it's opened
+    """
+    
+    for grid_store in month_state[MONTH_STORES_KEY].values() :
+        io_manager.flush_grid_store(grid_store)
+    
+    output_path    = os.path.dirname(month_state[MONTH_INDEX_PATH_KEY])
+    old_checkpoint = month_state[MONTH_CHECKPOINT_KEY]
+    month_state[MONTH_SEQUENCE_KEY]  += 1
+    month_state[MONTH_CHECKPOINT_KEY] = (os.path.basename(month_state[MONTH_INDEX_PATH_KEY])[:-len(io_manager.MONTH_STATE_INDEX_SUFFIX)]
+                                         + io_manager.MONTH_STATE_NOBS_SUFFIX + str(month_state[MONTH_SEQUENCE_KEY]) + ".npz")
+    month_state[MONTH_COMPLETE_KEY]   = complete
+    io_manager.save_checkpoint_arrays(os.path.join(output_path, month_state[MONTH_CHECKPOINT_KEY]),
+                                      {
+                                       time_gridding.NOBS_MEAN_KEY: month_state[MONTH_NOBS_KEY][time_gridding.NOBS_MEAN_KEY],
+                                       time_gridding.NOBS_M2_KEY:   month_state[MONTH_NOBS_KEY][time_gridding.NOBS_M2_KEY],
+                                      })
+    io_manager.save_manifest(month_state[MONTH_INDEX_PATH_KEY], dict([(key, month_state[key]) for key in MONTH_INDEX_KEYS]))
+    
+    if old_checkpoint is not None :
+        _safe_remove(os.path.join(output_path, old_checkpoint))
+
+def get_month_day_identity (month_state, date_time) :
+    """get the identity of the files a day in the month came from, or None if the day isn't in the month
+    """
+    
+    date_stamp = date_time.strftime(io_manager.DATE_STAMP_FORMAT)
+    if date_stamp not in month_state[MONTH_DAYS_KEY] :
+        return None
+    
+    return month_state[MONTH_IDENTITIES_KEY][month_state[MONTH_DAYS_KEY].index(date_stamp)]
+
+def fold_day_into_month (month_state, date_time, day_accumulator, day_identity=None) :
+    """add one day's moment accumulator to the month, replacing what was there for that day before
+    
+    a replaced day's nobs are taken back out of the running nobs statistics, so this
+    is the same amount of work no matter how many days are already in the month
+    """
+    
+    # the first change marks the saved state as being changed
+    if month_state[MONTH_COMPLETE_KEY] :
+        commit_month_state(month_state, complete=False)
+    
+    date_stamp = date_time.strftime(io_manager.DATE_STAMP_FORMAT)
+    nobs_stats = month_state[MONTH_NOBS_KEY]
+    if date_stamp in month_state[MONTH_DAYS_KEY] :
+        day_index = month_state[MONTH_DAYS_KEY].index(date_stamp)
+        old_nobs  = numpy.array(io_manager.read_grid_store(month_state[MONTH_STORES_KEY][grid_accumulators.NOBS_FIELD])[day_index])
+        time_gridding.remove_from_running_nobs_stats(nobs_stats, old_nobs)
+        for field_name, grid_store in month_state[MONTH_STORES_KEY].items() :
+            io_manager.write_grid_store_layer(grid_store, day_index, day_accumulator[field_name])
+        month_state[MONTH_IDENTITIES_KEY][day_index] = day_identity
+    else :
+        for field_name, grid_store in month_state[MONTH_STORES_KEY].items() :
+            io_manager.append_to_grid_store(grid_store, day_accumulator[field_name])
+        month_state[MONTH_DAYS_KEY].append(date_stamp)
+        month_state[MONTH_IDENTITIES_KEY].append(day_identity)
+    time_gridding.update_running_nobs_stats(nobs_stats, day_accumulator[grid_accumulators.NOBS_FIELD][0])
+
+def update_month_sketch (month_state, sketch_stems, input_path, space_grid_shape) :
+    """merge the daily quantile sketches made by space_day into the month's sketch, given a list
+    of (date time, sketch stem) for the days in the month
+    
+    only the days that aren't in the month's sketch yet are read; a day can't be taken back out of
+    a sketch, so if a day that's already in has been reprocessed since, the month's sketch is made
+    over from all the given days. Days already in the sketch that aren't given are kept.
+    """
+    
+    sketch_identities = { }
+    for date_time, stem_name in sketch_stems :
+        weights_path = io_manager.get_grid_file_path(stem_name + "_" + grid_accumulators.SKETCH_WEIGHTS_FIELD, space_grid_shape,
+                                                     input_path, grid_accumulators.SKETCH_WEIGHT_DATA_TYPE)
+        if not os.path.exists(weights_path) :
+            LOG.warn ("Quantile sketch " + stem_name + " is not on a " + str(space_grid_shape[0]) + " by "
+                      + str(space_grid_shape[1]) + " grid and will not be used.")
+            continue
+        sketch_identities[date_time.strftime(io_manager.DATE_STAMP_FORMAT)] = (stem_name, get_file_identity(weights_path))
+    
+    sketch_days = month_state[MONTH_SKETCH_DAYS_KEY]
+    changed     = [date_stamp for date_stamp, identity in sketch_days.items()
+                   if (date_stamp in sketch_identities) and (sketch_identities[date_stamp][1] != identity)]
+    if len(changed) > 0 :
+        LOG.debug("Quantile sketches for " + ", ".join(sorted(changed)) + " have changed. The month's sketch will be merged again.")
+        month_state[MONTH_SKETCH_KEY] = None
+        sketch_days.clear()
+    
+    for date_stamp, (stem_name, identity) in sorted(sketch_identities.items()) :
+        if date_stamp in sketch_days :
+            LOG.debug("Quantile sketch " + stem_name + " is already in the month.")
+            continue
+        
+        # the first change marks the saved state as being changed
+        if month_state[MONTH_COMPLETE_KEY] :
+            commit_month_state(month_state, complete=False)
+        
+        day_sketch = _load_accumulator_from_args((stem_name, input_path, grid_accumulators.SKETCH_FIELDS))
+        if month_state[MONTH_SKETCH_KEY] is None :
+            month_state[MONTH_SKETCH_KEY] = day_sketch
+        else :
+            grid_accumulators.merge_sketch_accumulators(month_state[MONTH_SKETCH_KEY], day_sketch)
+        sketch_days[date_stamp] = identity
+
+def _read_month_day (month_state, day_index, field_names) :
+    """read the given fields of one day's moment accumulator back out of the month
+    """
+    
+    return dict([(field_name, numpy.array(io_manager.read_grid_store(month_state[MONTH_STORES_KEY][field_name])[day_index:day_index + 1]))
+                 for field_name in field_names])
+
+def _get_month_day (month_state, day_index, bad_data_mask) :
+    """get one day's moment accumulator back out of the month, with the cells in the
+    bad data mask emptied out
+    """
+    
+    day_accumulator = _read_month_day(month_state, day_index, month_state[MONTH_STORES_KEY].keys())
+    for field_name in [grid_accumulators.NOBS_FIELD, grid_accumulators.COUNT_FIELD, grid_accumulators.SUM_FIELD, grid_accumulators.M2_FIELD] :
+        day_accumulator[field_name][0][bad_data_mask] = 0
+    for field_name in [grid_accumulators.MIN_FIELD, grid_accumulators.MAX_FIELD] :
+        day_accumulator[field_name][0][bad_data_mask] = numpy.nan
+    
+    return day_accumulator
+
+def calculate_month_stats (month_state, fixed_cutoff=None, dynamic_std_cutoff=None) :
+    """calculate the monthly stats from the days folded into the month
+    
+    days are left out of the cells where they don't pass the sample size cutoffs (see
+    time_gridding.create_sample_size_cutoff_mask); the weighted time average needs the
+    month's totals before any day's part of it can be found, so this goes through the
+    daily counts once to find where each day is cut and add up those totals, and then
+    through the daily moments once to merge them and add up the weighted time average,
+    which is the sum of the daily partial weighted time averages divided by the number
+    of days that contributed to each cell
+    
+    returns a dictionary of 2D arrays keyed on the stat names, and the moment accumulator
+    of the month with the cutoffs applied
+    """
+    
+    num_days    = len(month_state[MONTH_DAYS_KEY])
+    grid_shape  = month_state[MONTH_NOBS_KEY][time_gridding.NOBS_MEAN_KEY].shape
+    nobs_mean, nobs_std = time_gridding.calculate_running_nobs_stats(month_state[MONTH_NOBS_KEY])
+    
+    # find the cells each day is cut from and the month's totals without them
+    bad_data_masks = [ ]
+    month_count    = numpy.zeros(grid_shape, dtype=numpy.int64)
+    month_nobs     = numpy.zeros(grid_shape, dtype=numpy.float64)
+    for day_index in range(num_days) :
+        day_counts    = _read_month_day(month_state, day_index, [grid_accumulators.NOBS_FIELD, grid_accumulators.COUNT_FIELD])
+        bad_data_mask = time_gridding.create_sample_size_cutoff_mask(None, day_counts[grid_accumulators.NOBS_FIELD][0], None,
+                                                                     fixed_cutoff=fixed_cutoff, dynamic_std_cutoff=dynamic_std_cutoff,
+                                                                     overall_nobs_mean=nobs_mean, overall_nobs_std=nobs_std)
+        month_count  += numpy.where(bad_data_mask, 0, day_counts[grid_accumulators.COUNT_FIELD][0])
+        month_nobs   += numpy.where(bad_data_mask, 0, day_counts[grid_accumulators.NOBS_FIELD][0])
+        bad_data_masks.append(bad_data_mask)
+    
+    # merge the days and add up the weighted time average, reading each day once
+    accumulator   = grid_accumulators.create_moment_accumulator(*grid_shape)
+    weighted_sum  = numpy.zeros(grid_shape, dtype=numpy.float64)
+    weighted_days = numpy.zeros(grid_shape, dtype=numpy.int64)
+    for day_index, bad_data_mask in enumerate(bad_data_masks) :
+        day_accumulator = _get_month_day(month_state, day_index, bad_data_mask)
+        grid_accumulators.merge_moment_accumulators(accumulator, day_accumulator)
+        day_count       = day_accumulator[grid_accumulators.COUNT_FIELD][0]
+        good_cells      = day_count > 0
+        weighted_sum[good_cells] += time_gridding.calculate_partial_weighted_time_average(
+                                                    day_accumulator[grid_accumulators.SUM_FIELD][0][good_cells] / day_count[good_cells],
+                                                    day_accumulator[grid_accumulators.NOBS_FIELD][0][good_cells],
+                                                    month_count[good_cells], month_nobs[good_cells],
+                                                    good_measurments_this_day=day_count[good_cells])
+        weighted_days[good_cells] += 1
+    weighted_mean = numpy.empty(grid_shape, dtype=numpy.float64)
+    weighted_mean.fill(numpy.nan)
+    weighted_mean[weighted_days > 0] = weighted_sum[weighted_days > 0] / weighted_days[weighted_days > 0]
+    
+    month_stats = calculate_accumulator_stats(accumulator)
+    month_stats[STAT_WEIGHTED_MEAN] = weighted_mean
+    
+    return month_stats, accumulator
+
+def calculate_accumulator_stats (accumulator) :
+    """calculate the stats we can get from a single layer moment accumulator alone (all but the
+    weighted time average)
+    
+    returns a dictionary of 2D arrays keyed on the stat names
+    """
+    
+    mean, std, minimum, maximum = grid_accumulators.calculate_moment_stats(accumulator)
+    
+    return {
+            STAT_MEAN:  mean[0],
+            STAT_STD:   std[0],
+            STAT_MIN:   minimum[0],
+            STAT_MAX:   maximum[0],
+            STAT_COUNT: accumulator[grid_accumulators.COUNT_FIELD][0],
+            STAT_NOBS:  accumulator[grid_accumulators.NOBS_FIELD][0],
+           }
+
+def close_month_state (month_state) :
+    """save the month's state if it changed and close it's grid stores
+    
+    the grid stores, index, nobs checkpoint, and quantile sketch are left in the output directory
+    so more days can be folded into the month later without going back to the earlier days
+    """
+    
+    if not month_state[MONTH_COMPLETE_KEY] :
+        if month_state[MONTH_SKETCH_KEY] is not None :
+            io_manager.save_accumulator_to_files(month_state[MONTH_SKETCH_STEM_KEY], tuple(month_state[MONTH_SHAPE_KEY]),
+                                                 os.path.dirname(month_state[MONTH_INDEX_PATH_KEY]), month_state[MONTH_SKETCH_KEY])
+        commit_month_state(month_state, complete=True)
+    for grid_store in month_state[MONTH_STORES_KEY].values() :
+        io_manager.close_grid_store(grid_store)
+
+def _load_accumulator_from_args (args) :
+    """load an accumulator saved with io_manager.save_accumulator_to_files, given a tuple of it's
+    stem, directory, and field names, so it can be mapped over a list of stems
+    """
+    
+    stem_name, input_path, field_names = args
+    accumulator = io_manager.load_accumulator_from_files(stem_name, input_path, field_names)
+    
+    # copy the fields out of their files, so they can be sent between processes
+    return dict([(field_name, numpy.array(field_data)) for field_name, field_data in accumulator.items()])
+
+def _merge_moment_accumulators_from_args (args) :
+    """merge a tuple of two moment accumulators, so it can be mapped over a list of pairs
+    """
+    
+    return grid_accumulators.merge_moment_accumulators(*args)
+
+def _merge_sketch_accumulators_from_args (args) :
+    """merge a tuple of two quantile sketch accumulators, so it can be mapped over a list of pairs
+    """
+    
+    return grid_accumulators.merge_sketch_accumulators(*args)
+
+def calculate_percentile_stats (sketch_accumulator, percentiles) :
+    """estimate the given percentiles (from 0 to 100) from a quantile sketch accumulator
+    
+    returns a dictionary of 2D arrays keyed on the percentile names (see STAT_PERCENTILE_FORMAT)
+    """
+    
+    percentile_data = grid_accumulators.calculate_sketch_percentiles(sketch_accumulator, percentiles)
+    
+    return dict([(STAT_PERCENTILE_FORMAT % percentile, percentile_data[index]) for index, percentile in enumerate(percentiles)])
+
+def tree_reduce (items, pair_function, map_function=map) :
+    """combine a list of items into one by combining neighboring pairs of them with the pair function
+    
+    the pairs are combined a round at a time, each round halving the number of items; the map
+    function is used to combine all the pairs in a round, so passing the map of a worker pool
+    combines them in parallel. Returns None if there are no items.
+    """
+    
+    items = list(items)
+    if len(items) <= 0 :
+        return None
+    
+    while len(items) > 1 :
+        combined = list(map_function(pair_function, [(items[index], items[index + 1]) for index in range(0, len(items) - 1, 2)]))
+        if (len(items) % 2) == 1 :
+            combined.append(items[-1])
+        items = combined
+    
+    return items[0]
+
 def main():
     import optparse
     usage = """
@@ -105,6 +1393,51 @@ python -m space_time_gridding
                       help="set the size of the output grid's cells in degrees")
     parser.add_option('-a', '--min_scan_angle', dest="minScanAngle", type='float', default=60.0,
                       help="the minimum scan angle that will be considered useful")
+    parser.add_option('-r', '--ragged', dest="ragged",
+                      action="store_true", default=False,
+                      help="save the final space grids in a ragged (compressed sparse row) format instead of packed cubes")
+    parser.add_option('-c', '--nav_cache', dest="navCachePath", type='string', default=None,
+                      help="set path for a cache of the navigation data for each input file, to avoid reloading it on later runs")
+    parser.add_option('--workers', dest="workers", type='int', default=1,
+                      help="the number of processes to use when gridding input files or merging monthly moments")
+    parser.add_option('--prefetch', dest="prefetch", type='int', default=2,
+                      help="the number of input files to read, and gridded files to write, in the background while gridding; 0 turns this off")
+    parser.add_option('--memory_budget', dest="memoryBudget", type='float', default=None,
+                      help="keep space_day's temporary data in memory instead of files, using at most this many MB")
+    parser.add_option('--prescan', dest="prescan", action="store_true", default=False,
+                      help="read the navigation data of all the files first, so the final dense grids can be filled in without temporary files (best used with --nav_cache)")
+    parser.add_option('--max_depth', dest="maxDepth", type='int', default=None,
+                      help="keep at most this many values in each cell of the dense grids, sampled at random once a cell is full; the nobs and density still count every value")
+    parser.add_option('--seed', dest="seed", type='int', default=0,
+                      help="the random seed used to sample the cells that reach the maximum depth")
+    parser.add_option('--resume', dest="resume", action="store_true", default=False,
+                      help="keep a manifest of the files space_day has finished, and pick up after them if the day was run before")
+    parser.add_option('--checkpoint_interval', dest="checkpointInterval", type='int', default=10,
+                      help="how many files space_day finishes between updates of it's manifest when resuming")
+    parser.add_option('--catalog', dest="catalogPath",
+                      help="set path for a catalog of the input files, used to pick out the files to grid without opening them")
+    parser.add_option('--start_time', dest="startTime",
+                      help="only grid files that start at or after this time (YYYY-MM-DDTHH:MM)")
+    parser.add_option('--end_time', dest="endTime",
+                      help="only grid files that start before this time (YYYY-MM-DDTHH:MM)")
+    parser.add_option('--bbox', dest="bbox",
+                      help="only grid the data in this west,south,east,north box (in degrees) into a regional grid")
+    parser.add_option('--pyramid', dest="pyramid",
+                      help="a comma separated list of factors; the accumulated products are also saved at each of these factors times coarser than the grid, in sub-directories of the output directory")
+    parser.add_option('--joint', dest="joint", action="append", default=[ ],
+                      help="two comma separated variable names to make joint histograms of in each cell (ie. \"pressure,amount\"); may be given more than once")
+    parser.add_option('--stats', dest="stats", type='string', default=",".join(ALL_STATS),
+                      help="a comma separated list of the statistics the stats commands calculate, from: " + ", ".join(ALL_STATS))
+    parser.add_option('--block_layers', dest="blockLayers", type='int', default=16,
+                      help="the number of layers of a daily file stats_day reads into memory at once")
+    parser.add_option('--fixed_cutoff', dest="fixedCutoff", type='float', default=None,
+                      help="stats_month leaves out the days with this many or fewer observations in a cell")
+    parser.add_option('--std_cutoff', dest="stdCutoff", type='float', default=None,
+                      help="stats_month leaves out the days with more than this many standard deviations fewer observations in a cell than the month's mean")
+    parser.add_option('--percentiles', dest="percentiles", type='string', default="5,25,50,75,95",
+                      help="a comma separated list of the percentiles (from 0 to 100) stats_month and stats_climatology estimate from the quantile sketches")
+    parser.add_option('-p', '--products', dest="products", type='string', default=PRODUCT_CUBE,
+                      help="a comma separated list of the products to create, from: " + ", ".join(ALL_PRODUCTS))
     
     # parse the uers options from the command line
     options, args = parser.parse_args()
@@ -144,19 +1477,77 @@ python -m space_time_gridding
         output_path       = options.outputPath
         min_scan_angle    = options.minScanAngle
         grid_degrees      = float(options.gridDegrees)
+        products          = set(options.products.split(","))
+        bbox              = _parse_bbox_option(options.bbox)
+        joint_pairs       = [tuple(pair.split(",")) for pair in options.joint]
+        
+        # asking for a joint histogram asks for the joint product
+        if len(joint_pairs) > 0 :
+            products.add(PRODUCT_JOINT)
+        if (PRODUCT_JOINT in products) and (len(joint_pairs) <= 0) :
+            LOG.warn ("The variables to make joint histograms of must be given with --joint.")
+            return
+        for pair in joint_pairs :
+            if len(pair) != 2 :
+                LOG.warn ("Unable to parse joint histogram variables: " + ",".join(pair))
+                return
+        
+        # the sample kept in depth capped cells can't be picked up again later
+        if options.maxDepth is not None :
+            if options.maxDepth <= 0 :
+                LOG.warn ("The maximum depth must be at least 1.")
+                return
+            if options.resume :
+                LOG.warn ("A maximum depth can't be used when resuming.")
+                return
+        
+        # make sure we know how to make all the products the caller asked for
+        unknown_products  = products - set(ALL_PRODUCTS)
+        if len(unknown_products) > 0 :
+            LOG.warn ("Unable to create unknown products: " + ", ".join(sorted(unknown_products)))
+            return
         
         # determine the grid size in number of elements
-        grid_lon_size    = int(math.ceil(360.0 / grid_degrees))
-        grid_lat_size    = int(math.ceil(180.0 / grid_degrees))
+        grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees, bbox=bbox)
         space_grid_shape = (grid_lon_size, grid_lat_size) # TODO, is this the correct order?
         
+        # make sure the coarser levels of the pyramid can be built from whole blocks of the global grid
+        pyramid_factors  = [int(factor) for factor in options.pyramid.split(",")] if options.pyramid is not None else [ ]
+        if len(pyramid_factors) > 0 :
+            if bbox is not None :
+                LOG.warn ("A grid pyramid can only be made for global grids.")
+                return
+            if len(products & set(ACCUMULATOR_PRODUCTS.keys())) <= 0 :
+                LOG.warn ("A grid pyramid can only be made for the accumulated products: " + ", ".join(sorted(ACCUMULATOR_PRODUCTS.keys())))
+                return
+            for factor in pyramid_factors :
+                if (factor <= 1) or (grid_lon_size % factor != 0) or (grid_lat_size % factor != 0) :
+                    LOG.warn ("A " + str(grid_lon_size) + " by " + str(grid_lat_size) + " grid can't be coarsened by a factor of " + str(factor) + ".")
+                    return
+        
+        # if we have a catalog, use it to pick out the files in our time window without opening them
+        start_time        = _parse_time_option(options.startTime)
+        end_time          = _parse_time_option(options.endTime)
+        if options.catalogPath is not None :
+            catalog_connection = input_catalog.open_catalog(options.catalogPath)
+            input_catalog.update_catalog(catalog_connection, input_path, min_scan_angle=min_scan_angle)
+            possible_files     = input_catalog.find_granules(catalog_connection, input_path,
+                                                             start_time=start_time, end_time=end_time, bbox=bbox)
+            catalog_connection.close()
+        # otherwise use the times in the file names
+        else :
+            possible_files     = [file_name for file_name in os.listdir(input_path)
+                                  if _is_in_time_window(file_name, start_time, end_time)]
+        
         # look through our files and figure out what variables we expect from them
-        possible_files    = os.listdir(input_path)
         expected_vars     = { }
         all_vars          = set()
         date_time_temp    = None
         for file_name in sorted(possible_files) :
             expected_vars[file_name] = general_guidebook.get_variable_names (file_name, user_requested_names=desired_variables)
+            # the variables in the joint histograms need to be read too
+            for pair in joint_pairs :
+                expected_vars[file_name].update(general_guidebook.get_variable_names(file_name, user_requested_names=list(pair)))
             # if this file has no variables, remove it from our files for consideration
             if len(expected_vars[file_name]) <= 0 :
                 del expected_vars[file_name]
@@ -166,195 +1557,307 @@ python -m space_time_gridding
                 all_vars.update(expected_vars[file_name])
                 date_time_temp = general_guidebook.parse_datetime_from_filename(file_name) if date_time_temp is None else date_time_temp
         
+        # if the caller wants to resume, see what an earlier run of this day already finished
+        manifest_path = io_manager.get_manifest_path(output_path, date_time_temp)
+        manifest      = None
+        run_settings  = {
+                         "grid degrees":   grid_degrees,
+                         "min scan angle": min_scan_angle,
+                         "products":       sorted(products),
+                         "ragged":         options.ragged,
+                         "bbox":           list(bbox) if bbox is not None else None,
+                         "joint":          sorted(options.joint),
+                        }
+        if options.resume :
+            manifest = io_manager.load_manifest(manifest_path)
+            if (manifest is not None) and (manifest[MANIFEST_SETTINGS_KEY] != run_settings) :
+                LOG.warn ("Cannot resume because the earlier run of this day used different settings: "
+                          + str(manifest[MANIFEST_SETTINGS_KEY]))
+                return
+        
         # check to make sure our intermediate file names don't exist already
-        for var_name in all_vars :
+        for var_name in all_vars if manifest is None else [ ] :
             
             for suffix in io_manager.ALL_EXPECTED_SUFFIXES :
                 # TODO, pull satellite and algorithm too
                 temp_stem = io_manager.build_name_stem(var_name, date_time=date_time_temp, satellite=None, algorithm=None, suffix=suffix)
-                temp_name = fbf.filename(temp_stem, TEMP_DATA_TYPE, shape=(space_grid_shape))
-                if os.path.exists(os.path.join(output_path, temp_name)) :
+                if len(glob.glob(os.path.join(output_path, temp_stem + "*"))) > 0 :
                     LOG.warn ("Cannot process files because matching temporary or output files exist in the output directory.")
                     return
         
-        # loop to deal with data from each of the files
-        for each_file in sorted(possible_files) :
-            
-            full_file_path = os.path.join(input_path, each_file)
-            
-            LOG.debug("Processing file: " + full_file_path)
-            
-            # load the aux data
-            file_object, temp_aux_data = io_manager.load_aux_data(full_file_path,
-                                                                  min_scan_angle)
-            
-            # calculate the indecies for the space grid based on the aux data
-            # (we can do this now since the lon/lat is the same for each variable in the file)
-            day_lon_index, day_lat_index, night_lon_index, night_lat_index = space_gridding.calculate_index_from_nav_data(temp_aux_data,
-                                                                                                                          grid_degrees)
-            
-            # loop to load each variable in the file and process it
-            for variable_name in expected_vars[each_file] :
-                
-                LOG.debug("Processing variable: " + variable_name)
-                
-                # load the variable
-                file_object, var_data = io_manager.load_variable_from_file (variable_name,
-                                                                            file_path=full_file_path,
-                                                                            file_object=file_object)
-                
-                # split the variable by day/night
-                day_var_data   = var_data[temp_aux_data[DAY_MASK_KEY]]
-                night_var_data = var_data[temp_aux_data[NIGHT_MASK_KEY]]
-                
-                # space grid the data using the indexes we calculated earlier
-                day_space_grid,   day_density_map,   day_nobs,   day_max_depth   = space_gridding.space_grid_data (grid_lon_size, grid_lat_size,
-                                                                                                                   day_var_data,
-                                                                                                                   day_lon_index, day_lat_index)
-                night_space_grid, night_density_map, night_nobs, night_max_depth = space_gridding.space_grid_data (grid_lon_size, grid_lat_size,
-                                                                                                                   night_var_data,
-                                                                                                                   night_lon_index, night_lat_index)
-                
-                # save the space grids and density info for this variable and it's density map to files
-                
-                # day related files
-                io_manager.save_data_to_file(io_manager.build_name_stem (variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.DAY_TEMP_SUFFIX),
-                                             space_grid_shape, output_path, day_space_grid, TEMP_DATA_TYPE)
-                io_manager.save_data_to_file(io_manager.build_name_stem (variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.DAY_DENSITY_TEMP_SUFFIX),
-                                             space_grid_shape, output_path, day_density_map, TEMP_DATA_TYPE)
-                io_manager.save_data_to_file(io_manager.build_name_stem (variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.DAY_NOBS_TEMP_SUFFIX),
-                                             space_grid_shape, output_path, day_nobs, TEMP_DATA_TYPE)
-                
-                # night related files
-                
-                io_manager.save_data_to_file(io_manager.build_name_stem (variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.NIGHT_TEMP_SUFFIX),
-                                             space_grid_shape, output_path, night_space_grid, TEMP_DATA_TYPE)
-                io_manager.save_data_to_file(io_manager.build_name_stem (variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.NIGHT_DENSITY_TEMP_SUFFIX),
-                                             space_grid_shape, output_path, night_density_map, TEMP_DATA_TYPE)
-                io_manager.save_data_to_file(io_manager.build_name_stem (variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.NIGHT_NOBS_TEMP_SUFFIX),
-                                             space_grid_shape, output_path, night_nobs, TEMP_DATA_TYPE)
-            
-            # make sure each file is closed when we're done with it
-            io_manager.close_file(full_file_path, file_object)
+        # figure out what bins to use for each variable's histograms
+        histogram_bin_edges = { }
+        if PRODUCT_HISTOGRAM in products :
+            for file_name in sorted(possible_files) :
+                for variable_name in expected_vars[file_name] - set(histogram_bin_edges.keys()) :
+                    histogram_bin_edges[variable_name] = general_guidebook.get_histogram_bin_edges(file_name, variable_name)
+                    if histogram_bin_edges[variable_name] is None :
+                        LOG.warn("No histogram bins are configured for variable " + variable_name + ". Histograms will not be made for it.")
         
-        # collapse the per variable space grids to remove excess NaNs
-        for variable_name in all_vars :
-            
-            LOG.debug("Packing space data for variable: " + variable_name)
+        # figure out which category values to count for each flag variable
+        category_values = { }
+        if PRODUCT_CATEGORIES in products :
+            for file_name in sorted(possible_files) :
+                for variable_name in expected_vars[file_name] - set(category_values.keys()) :
+                    category_values[variable_name] = general_guidebook.get_category_values(file_name, variable_name)
+                    if category_values[variable_name] is None :
+                        LOG.warn("Variable " + variable_name + " is not a flag variable. Category counts will not be made for it.")
+        
+        # figure out the variable names and bins to use for each joint histogram
+        joint_bin_edges = { }
+        for x_user_name, y_user_name in joint_pairs :
+            for file_name in sorted(possible_files) :
+                x_variable_names = general_guidebook.get_variable_names(file_name, user_requested_names=[x_user_name])
+                y_variable_names = general_guidebook.get_variable_names(file_name, user_requested_names=[y_user_name])
+                if (len(x_variable_names) != 1) or (len(y_variable_names) != 1) :
+                    continue
+                x_variable_name, y_variable_name = x_variable_names.pop(), y_variable_names.pop()
+                if (x_variable_name, y_variable_name) in joint_bin_edges :
+                    continue
+                bin_edges = (general_guidebook.get_joint_histogram_bin_edges(file_name, x_variable_name),
+                             general_guidebook.get_joint_histogram_bin_edges(file_name, y_variable_name))
+                joint_bin_edges[(x_variable_name, y_variable_name)] = bin_edges
+                if (bin_edges[0] is None) or (bin_edges[1] is None) :
+                    LOG.warn("No histogram bins are configured for both " + x_variable_name + " and " + y_variable_name
+                             + ". A joint histogram will not be made for them.")
+                    joint_bin_edges[(x_variable_name, y_variable_name)] = None
+        joint_bin_edges = dict([(pair, bin_edges) for pair, bin_edges in joint_bin_edges.items() if bin_edges is not None])
+        
+        # skip the files an earlier run already finished, and start a manifest if we don't have one yet
+        if manifest is not None :
+            for file_name in sorted(possible_files) :
+                if file_name in manifest[MANIFEST_GRANULES_KEY] :
+                    if manifest[MANIFEST_GRANULES_KEY][file_name] != get_file_identity(os.path.join(input_path, file_name)) :
+                        LOG.warn ("File " + file_name + " has changed since it was gridded and will not be gridded again. "
+                                  + "Remove " + manifest_path + " and the day's files to grid the whole day again.")
+                    possible_files.remove(file_name)
+            LOG.info("Resuming after " + str(len(manifest[MANIFEST_GRANULES_KEY])) + " finished files; "
+                     + str(len(possible_files)) + " files are left to grid.")
+        elif options.resume :
+            # save the empty manifest right away, so a run that stops before it's first checkpoint can still be resumed
+            manifest = create_manifest(run_settings)
+            commit_manifest(manifest, manifest_path, { }, { })
+        
+        # the earlier run's temporary files must be added to on disk
+        if (manifest is not None) and ((options.memoryBudget is not None) or options.prescan) :
+            LOG.warn("The memory budget and prescan options can't be used when resuming and will be ignored.")
+            options.memoryBudget = None
+            options.prescan      = False
+        
+        # if the caller asked for a prescan or a depth cap, we know how deep the final files
+        # can get before we start, so they can be filled in directly
+        packed_grids = None
+        if (options.prescan or (options.maxDepth is not None)) and (PRODUCT_CUBE in products) :
+            if options.ragged :
+                LOG.warn("Prescanning and maximum depths are only used for dense grids, so they will be skipped for ragged grids.")
+            else :
+                max_depths  = {DAY_KEY: options.maxDepth, NIGHT_KEY: options.maxDepth}
+                if options.prescan :
+                    nobs_counts = prescan_nav_data([os.path.join(input_path, each_file) for each_file in sorted(possible_files)],
+                                                   grid_degrees, min_scan_angle, nav_cache_path=options.navCachePath, bbox=bbox)
+                    max_depths  = dict([(time_of_day, numpy.max(nobs_counts[time_of_day]) if options.maxDepth is None
+                                                      else min(numpy.max(nobs_counts[time_of_day]), options.maxDepth))
+                                        for time_of_day in nobs_counts.keys()])
+                size_mb     = (sum(max_depths.values()) * len(all_vars) * grid_lon_size * grid_lat_size
+                               * TEMP_DATA_TYPE.itemsize) / (1024.0 * 1024.0)
+                LOG.info("The final files will hold at most " + str(max_depths[DAY_KEY]) + " day and " + str(max_depths[NIGHT_KEY])
+                         + " night observations per cell and take at most " + ("%.1f" % size_mb) + " MB.")
+                packed_grids = open_packed_grids(all_vars, max_depths, date_time_temp, output_path, space_grid_shape,
+                                                 random_seed=options.seed if options.maxDepth is not None else None)
+        
+        # grid each of the files, in parallel if the caller asked for more than one worker;
+        # ragged pieces are also what we put into the packed grids
+        ragged_pieces = options.ragged or (packed_grids is not None)
+        granule_args  = [(os.path.join(input_path, each_file), sorted(expected_vars[each_file]),
+                          grid_degrees, min_scan_angle, products,
+                          ragged_pieces, histogram_bin_edges, category_values, joint_bin_edges, options.navCachePath, bbox)
+                         for each_file in sorted(possible_files)]
+        worker_pool  = None
+        if options.workers > 1 :
+            LOG.debug("Gridding files with " + str(options.workers) + " worker processes.")
+            worker_pool         = multiprocessing.Pool(processes=options.workers)
+            all_granule_results = worker_pool.imap(_grid_granule_from_args, granule_args)
+        # if we're gridding here, read the upcoming files in the background while we grid
+        elif options.prefetch > 0 :
+            all_granule_data    = prefetch_items((read_granule(each_args[0], each_args[1], grid_degrees, min_scan_angle,
+                                                               nav_cache_path=options.navCachePath, bbox=bbox)
+                                                  for each_args in granule_args), options.prefetch)
+            all_granule_results = (grid_granule_data(nav_data, variable_data, grid_degrees, products,
+                                                     ragged=ragged_pieces, histogram_bin_edges=histogram_bin_edges,
+                                                     category_values=category_values, joint_bin_edges=joint_bin_edges, bbox=bbox)
+                                   for nav_data, variable_data in all_granule_data)
+        else :
+            all_granule_results = (_grid_granule_from_args(each_granule_args) for each_granule_args in granule_args)
+        
+        # the accumulators for each product, variable and time of day are kept in memory
+        accumulators = { }
+        
+        # the temporary files for the cube product are kept open until they're packed;
+        # if the caller gave us a memory budget they're kept in memory until it runs out
+        grid_stores   = { }
+        memory_budget = int(options.memoryBudget * 1024 * 1024) if options.memoryBudget is not None else None
+        
+        # pick up where the earlier run left off
+        if manifest is not None :
+            accumulators, grid_stores = restore_manifest_state(manifest, manifest_path, date_time_temp, output_path, space_grid_shape)
+        
+        # fold the results into the day in file order, so the output doesn't depend on the number of workers;
+        # when prefetching, the results are written in the background while the next files are gridded
+        def fold_function (named_granule_results) :
+            file_name, granule_results = named_granule_results
+            fold_granule_results(granule_results, accumulators, grid_stores,
+                                 date_time_temp, output_path, space_grid_shape,
+                                 memory_budget=memory_budget, packed_grids=packed_grids)
             
-            # load the variable's density maps
-            var_workspace     = Workspace.Workspace(dir=output_path)
-            day_var_density   = var_workspace[io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.DAY_DENSITY_TEMP_SUFFIX)][:] 
-            night_var_density = var_workspace[io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                         satellite=None, algorithm=None,
-                                                                         suffix=io_manager.NIGHT_DENSITY_TEMP_SUFFIX)][:] 
+            # record that we've finished this file, and every so often commit that to the manifest
+            if manifest is not None :
+                manifest[MANIFEST_GRANULES_KEY][file_name] = get_file_identity(os.path.join(input_path, file_name))
+                if len(manifest[MANIFEST_GRANULES_KEY]) % options.checkpointInterval == 0 :
+                    commit_manifest(manifest, manifest_path, accumulators, grid_stores)
+        
+        all_named_results = itertools.izip(sorted(possible_files), all_granule_results)
+        if options.prefetch > 0 :
+            call_in_background(fold_function, all_named_results, options.prefetch)
+        else :
+            for named_granule_results in all_named_results :
+                fold_function(named_granule_results)
+        
+        if manifest is not None :
+            commit_manifest(manifest, manifest_path, accumulators, grid_stores)
+        
+        if worker_pool is not None :
+            worker_pool.close()
+            worker_pool.join()
+        
+        # collapse the per variable space grids, or trim them if we filled them in directly
+        if packed_grids is not None :
+            close_packed_grids(packed_grids, date_time_temp, output_path, space_grid_shape)
+        elif PRODUCT_CUBE in products :
+            for variable_name in all_vars :
+                for time_of_day in [DAY_KEY, NIGHT_KEY] :
+                    if options.ragged :
+                        pack_ragged_grids(variable_name, time_of_day, date_time_temp, output_path, space_grid_shape, grid_stores)
+                    else :
+                        pack_space_grids (variable_name, time_of_day, date_time_temp, output_path, space_grid_shape, grid_stores)
+        
+        for grid_store in grid_stores.values() :
+            io_manager.close_grid_store(grid_store)
+        
+        # save the accumulated products
+        save_accumulators(accumulators, date_time_temp, output_path, space_grid_shape)
+        
+        # build the coarser levels of the pyramid from the accumulators
+        for factor in pyramid_factors :
             
-            # only do the day data if we have some
-            if numpy.sum(day_var_density) > 0 :
-                
-                # load the sparse space grid
-                day_var_data      = var_workspace[io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                             satellite=None, algorithm=None,
-                                                                             suffix=io_manager.DAY_TEMP_SUFFIX)][:]
-                
-                # collapse the space grid
-                final_day_data    = space_gridding.pack_space_grid(day_var_data,   day_var_density)
-                
-                # save the final array to an appropriately named file
-                io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                        satellite=None, algorithm=None,
-                                                                        suffix=io_manager.DAY_SUFFIX),
-                                             space_grid_shape, output_path, final_day_data,
-                                             TEMP_DATA_TYPE, file_permissions="w")
-                
-                # load the nobs file
-                nobs_counts       = var_workspace[io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                             satellite=None, algorithm=None,
-                                                                             suffix=io_manager.DAY_NOBS_TEMP_SUFFIX)][:]
-                
-                # collapse the nobs
-                nobs_final        = numpy.sum(nobs_counts, axis=0)
-                
-                # save the final nobs array to an appropriately named file
-                io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                        satellite=None, algorithm=None,
-                                                                        suffix=io_manager.DAY_NOBS_SUFFIX),
-                                             space_grid_shape, output_path,
-                                             nobs_final, TEMP_DATA_TYPE, file_permissions="w")
-                
-            else :
-                LOG.warn("No day data was found for variable " + variable_name + ". Day files will not be written.")
+            level_path = os.path.join(output_path, PYRAMID_DIRECTORY_FORMAT % (grid_degrees * factor))
+            LOG.debug("Saving pyramid level " + str(factor) + " times coarser in: " + level_path)
             
-            # only do night data if we have some
-            if numpy.sum(night_var_density) > 0 :
-                
-                # load the sparse space grid
-                night_var_data      = var_workspace[io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                             satellite=None, algorithm=None,
-                                                                             suffix=io_manager.NIGHT_TEMP_SUFFIX)][:]
-                
-                # collapse the space grid
-                final_night_data    = space_gridding.pack_space_grid(night_var_data,   night_var_density)
-                
-                # save the final array to an appropriately named file
-                io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                        satellite=None, algorithm=None,
-                                                                        suffix=io_manager.NIGHT_SUFFIX),
-                                             space_grid_shape, output_path, final_night_data,
-                                             TEMP_DATA_TYPE, file_permissions="w")
-                
-                # load the nobs file
-                nobs_counts       = var_workspace[io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                             satellite=None, algorithm=None,
-                                                                             suffix=io_manager.NIGHT_NOBS_TEMP_SUFFIX)][:]
-                
-                # collapse the nobs
-                nobs_final        = numpy.sum(nobs_counts, axis=0)
-                
-                # save the final nobs array to an appropriately named file
-                io_manager.save_data_to_file(io_manager.build_name_stem(variable_name, date_time=date_time_temp,
-                                                                        satellite=None, algorithm=None,
-                                                                        suffix=io_manager.NIGHT_NOBS_SUFFIX),
-                                             space_grid_shape, output_path,
-                                             nobs_final, TEMP_DATA_TYPE, file_permissions="w")
-                
-            else :
-                LOG.warn("No night data was found for variable " + variable_name + ". Night files will not be written.")
+            if not os.path.isdir(level_path) :
+                os.makedirs(level_path)
+            level_accumulators = dict([(key, ACCUMULATOR_PRODUCTS[key[0]][2](accumulator, factor))
+                                       for key, accumulator in accumulators.items()])
+            save_accumulators(level_accumulators, date_time_temp, level_path,
+                              (space_grid_shape[0] // factor, space_grid_shape[1] // factor))
         
-        # remove the extra temporary files in the output directory
-        remove_suffixes = ["*" + p + "*" for p in io_manager.EXPECTED_TEMP_SUFFIXES]
+        # remove the extra temporary files in the output directory, unless we need them to add more files later
+        if manifest is not None :
+            return
+        remove_suffixes = ["*" + p + "*" for p in io_manager.EXPECTED_TEMP_SUFFIXES + io_manager.EXPECTED_RAGGED_TEMP_SUFFIXES]
         remove_file_patterns(output_path, remove_suffixes)
     
+    def catalog(*args) :
+        """add the input files to a catalog
+        given an input directory and the path to a catalog, record the satellite,
+        start time, variables and longitude/latitude box of each input file in the
+        catalog, so later runs can pick out the files they need without opening them.
+        
+        Note: files already in the catalog are only read again if they've changed.
+        """
+        
+        if options.catalogPath is None :
+            LOG.warn ("A catalog path must be given to catalog files.")
+            return
+        
+        catalog_connection = input_catalog.open_catalog(options.catalogPath)
+        num_cataloged      = input_catalog.update_catalog(catalog_connection, options.inputPath,
+                                                          min_scan_angle=options.minScanAngle)
+        catalog_connection.close()
+        
+        LOG.info("Cataloged " + str(num_cataloged) + " new or changed files from " + options.inputPath)
+    
     def stats_day(*args) :
         """given files of daily space gridded data, calculate daily stats
         given an input directory that contains appropriate files,
         calculate daily stats and put the resulting gridded files
         for that day in the output directory.
         
+        The packed or ragged files made by space_day are read a few layers
+        (or blocks of values) at a time, so a whole day is never in memory at
+        once; the variables to use may be given by the names they have in the
+        files or the names the guidebooks know them by.
+        
         Note: the output directory will also be used for intermediary working
         files.
         """
         
         # set up some of our input from the caller for easy access
-        desired_variables = list(args) if len(args) > 0 else [ ]
+        requested_names   = resolve_variable_names(args)
+        desired_variables = sorted(set( ).union(*requested_names.values()))
         input_path        = options.inputPath
         output_path       = options.outputPath
-        min_scan_angle    = options.minScanAngle
         grid_degrees      = float(options.gridDegrees)
+        bbox              = _parse_bbox_option(options.bbox)
+        stats             = options.stats.split(",")
+        
+        # make sure we know how to calculate all the stats the caller asked for
+        unknown_stats     = set(stats) - set(ALL_STATS)
+        if len(unknown_stats) > 0 :
+            LOG.warn ("Unable to calculate unknown stats: " + ", ".join(sorted(unknown_stats)))
+            return
+        if STAT_WEIGHTED_MEAN in stats :
+            LOG.debug("The weighted time average of a single day is just it's mean and will not be saved again.")
+            stats.remove(STAT_WEIGHTED_MEAN)
+        
+        # determine the grid size in number of elements
+        grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees, bbox=bbox)
+        space_grid_shape = (grid_lon_size, grid_lat_size)
+        
+        found_variables = set( )
+        for time_of_day in [DAY_KEY, NIGHT_KEY] :
+            for date_time, variable_name, stem_name in find_daily_stems(input_path, time_of_day, desired_variables) :
+                
+                found_variables.add(variable_name)
+                LOG.debug("Calculating " + time_of_day + " stats for variable: " + variable_name)
+                
+                # go through the data once, calculating everything we need for all the stats
+                accumulator, found_nobs = calculate_day_accumulator(stem_name, variable_name, date_time, time_of_day,
+                                                                    input_path, space_grid_shape, block_layers=options.blockLayers)
+                if accumulator is None :
+                    continue
+                if (not found_nobs) and (STAT_NOBS in stats) :
+                    LOG.warn ("No nobs file was found for " + stem_name + ". The nobs will not be saved for it.")
+                
+                mean, std, minimum, maximum = grid_accumulators.calculate_moment_stats(accumulator)
+                all_stats   = {
+                               STAT_MEAN:          mean,
+                               STAT_STD:           std,
+                               STAT_MIN:           minimum,
+                               STAT_MAX:           maximum,
+                               STAT_COUNT:         accumulator[grid_accumulators.COUNT_FIELD],
+                               STAT_NOBS:          accumulator[grid_accumulators.NOBS_FIELD] if found_nobs else None,
+                              }
+                
+                io_manager.save_accumulator_to_files(io_manager.build_name_stem(variable_name, date_time=date_time,
+                                                                                satellite=None, algorithm=None,
+                                                                                suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.STATS_FILE]),
+                                                     space_grid_shape, output_path,
+                                                     dict([(stat, all_stats[stat].astype(TEMP_DATA_TYPE)) for stat in stats
+                                                           if all_stats[stat] is not None]))
+        
+        # let the caller know if some of the variables they asked for weren't there
+        for user_name in sorted(requested_names.keys()) :
+            if len(requested_names[user_name] & found_variables) <= 0 :
+                LOG.warn ("No daily files were found in " + input_path + " for variable: " + user_name)
     
     def stats_month(*args) :
         """given a month of daily space gridded data, calculate montly stats
@@ -362,18 +1865,200 @@ python -m space_time_gridding
         calculate monthly stats and put the resulting gridded files
         for that month in the output directory.
         
-        Note: the output directory will also be used for intermediary working
+        Each packed or ragged daily file made by space_day is read once, a few
+        layers at a time, and folded into the month; every month found in the input
+        directory is done separately. The sample size cutoffs and weighted
+        time average are applied once all the days are in.
+        
+        The state of each month is kept in the output directory, so running
+        this again only reads the days that are new or have been reprocessed
+        since; days already in the month that are no longer in the input
+        directory are kept. Remove the month state files to start a month over.
+        The moments of each month are also saved, for stats_climatology.
+        
+        If space_day made quantile sketches (the sketch product), they're
+        merged into a sketch for the month and the percentiles given with
+        --percentiles are estimated from it; the sample size cutoffs aren't
+        applied to the sketches.
+        
+        Note: the output directory will also be used for the month state
         files.
         """
         
         # set up some of our input from the caller for easy access
-        desired_variables = list(args) if len(args) > 0 else [ ]
+        desired_variables = sorted(set( ).union(*resolve_variable_names(args).values()))
         input_path        = options.inputPath
         output_path       = options.outputPath
-        min_scan_angle    = options.minScanAngle
         grid_degrees      = float(options.gridDegrees)
+        bbox              = _parse_bbox_option(options.bbox)
+        stats             = options.stats.split(",")
+        percentiles       = _parse_percentiles_option(options.percentiles)
+        
+        # make sure we know how to calculate all the stats the caller asked for
+        unknown_stats     = set(stats) - set(ALL_STATS)
+        if len(unknown_stats) > 0 :
+            LOG.warn ("Unable to calculate unknown stats: " + ", ".join(sorted(unknown_stats)))
+            return
+        if percentiles is None :
+            LOG.warn ("Unable to parse percentiles: " + options.percentiles)
+            return
+        
+        # determine the grid size in number of elements
+        grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees, bbox=bbox)
+        space_grid_shape = (grid_lon_size, grid_lat_size)
+        
+        # sort the daily files and quantile sketches into months
+        month_stems  = { }
+        sketch_stems = { }
+        for time_of_day in [DAY_KEY, NIGHT_KEY] :
+            for date_time, variable_name, stem_name in find_daily_stems(input_path, time_of_day, desired_variables) :
+                month_date_time = datetime(date_time.year, date_time.month, 1)
+                month_stems.setdefault((month_date_time, variable_name, time_of_day), [ ]).append((date_time, stem_name))
+            for date_time, variable_name, stem_name in find_accumulator_stems(input_path, time_of_day, io_manager.SKETCH_FILE,
+                                                                               grid_accumulators.SKETCH_WEIGHTS_FIELD, desired_variables) :
+                month_date_time = datetime(date_time.year, date_time.month, 1)
+                sketch_stems.setdefault((month_date_time, variable_name, time_of_day), [ ]).append((date_time, stem_name))
         
+        for month_key in sorted(set(month_stems.keys()) | set(sketch_stems.keys())) :
+            
+            month_date_time, variable_name, time_of_day = month_key
+            LOG.debug("Calculating " + time_of_day + " stats for " + month_date_time.strftime("%Y-%m") + " for variable: " + variable_name)
+            
+            # fold in each day that's new or has changed since it was last folded into the month
+            month_state = open_month_state(variable_name, time_of_day, month_date_time, output_path, space_grid_shape)
+            for date_time, stem_name in sorted(month_stems.get(month_key, [ ])) :
+                day_identity = get_day_identity(stem_name, variable_name, date_time, time_of_day, input_path, space_grid_shape)
+                if (day_identity is not None) and (get_month_day_identity(month_state, date_time) == day_identity) :
+                    LOG.debug("File " + stem_name + " is already in the month.")
+                    continue
+                day_accumulator, found_nobs = calculate_day_accumulator(stem_name, variable_name, date_time, time_of_day,
+                                                                        input_path, space_grid_shape, block_layers=options.blockLayers)
+                if day_accumulator is None :
+                    continue
+                if not found_nobs :
+                    LOG.warn ("No nobs file was found for " + stem_name + ". The day will be treated as having no observations.")
+                fold_day_into_month(month_state, date_time, day_accumulator, day_identity=day_identity)
+            update_month_sketch(month_state, sketch_stems.get(month_key, [ ]), input_path, space_grid_shape)
+            
+            # save the stats, and the month's moments so stats_climatology can merge them with other years
+            month_stats = { }
+            if len(month_state[MONTH_DAYS_KEY]) > 0 :
+                month_stats, month_accumulator = calculate_month_stats(month_state, fixed_cutoff=options.fixedCutoff,
+                                                                       dynamic_std_cutoff=options.stdCutoff)
+                month_stats = dict([(stat, month_stats[stat]) for stat in stats])
+                io_manager.save_accumulator_to_files(io_manager.build_name_stem(variable_name, date_time=month_date_time,
+                                                                                satellite=None, algorithm=None,
+                                                                                suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.MONTH_MOMENTS_FILE]),
+                                                     space_grid_shape, output_path, month_accumulator)
+            if month_state[MONTH_SKETCH_KEY] is not None :
+                month_stats.update(calculate_percentile_stats(month_state[MONTH_SKETCH_KEY], percentiles))
+            io_manager.save_accumulator_to_files(io_manager.build_name_stem(variable_name, date_time=month_date_time,
+                                                                            satellite=None, algorithm=None,
+                                                                            suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.MONTH_STATS_FILE]),
+                                                 space_grid_shape, output_path,
+                                                 dict([(stat, stat_data.astype(TEMP_DATA_TYPE)) for stat, stat_data in month_stats.items()]))
+            close_month_state(month_state)
     
+    def stats_climatology(*args) :
+        """given the monthly moments saved by stats_month, calculate climatologies
+        given an input directory with the monthly moments stats_month saved
+        over a number of years, calculate the stats for each month of the year
+        over all of those years and put the resulting gridded files in the
+        output directory.
+        
+        The monthly moments are merged pairwise in rounds, in parallel if more
+        than one worker is asked for; no daily files are read. Only the months
+        that start in the window given by --start_time and --end_time are used.
+        The climatology files are stamped with the month of the year they're
+        for (ie. month01 for January).
+        
+        The monthly quantile sketches are merged the same way, and the
+        percentiles given with --percentiles are estimated from them.
+        """
+        
+        # set up some of our input from the caller for easy access
+        desired_variables = sorted(set( ).union(*resolve_variable_names(args).values()))
+        input_path        = options.inputPath
+        output_path       = options.outputPath
+        grid_degrees      = float(options.gridDegrees)
+        bbox              = _parse_bbox_option(options.bbox)
+        start_time        = _parse_time_option(options.startTime)
+        end_time          = _parse_time_option(options.endTime)
+        stats             = options.stats.split(",")
+        percentiles       = _parse_percentiles_option(options.percentiles)
+        
+        # make sure we know how to calculate all the stats the caller asked for
+        unknown_stats     = set(stats) - set(ALL_STATS)
+        if len(unknown_stats) > 0 :
+            LOG.warn ("Unable to calculate unknown stats: " + ", ".join(sorted(unknown_stats)))
+            return
+        if percentiles is None :
+            LOG.warn ("Unable to parse percentiles: " + options.percentiles)
+            return
+        if STAT_WEIGHTED_MEAN in stats :
+            LOG.debug("The weighted time average needs daily data and will not be calculated for the climatology.")
+            stats.remove(STAT_WEIGHTED_MEAN)
+        
+        # determine the grid size in number of elements
+        grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees, bbox=bbox)
+        space_grid_shape = (grid_lon_size, grid_lat_size)
+        
+        # sort the monthly moments and quantile sketches by month of the year
+        climatology_stems = { }
+        sketch_stems      = { }
+        for time_of_day in [DAY_KEY, NIGHT_KEY] :
+            for file_kind, field_name, data_type, file_description, stems_by_month in [
+                    (io_manager.MONTH_MOMENTS_FILE, grid_accumulators.COUNT_FIELD,          numpy.int64,
+                     "Monthly moments",         climatology_stems),
+                    (io_manager.MONTH_SKETCH_FILE,  grid_accumulators.SKETCH_WEIGHTS_FIELD, grid_accumulators.SKETCH_WEIGHT_DATA_TYPE,
+                     "Monthly quantile sketch", sketch_stems),
+                    ] :
+                for date_time, variable_name, stem_name in find_accumulator_stems(input_path, time_of_day, file_kind, field_name, desired_variables) :
+                    if ((start_time is not None) and (date_time < start_time)) or ((end_time is not None) and (date_time >= end_time)) :
+                        continue
+                    if not os.path.exists(io_manager.get_grid_file_path(stem_name + "_" + field_name, space_grid_shape,
+                                                                        input_path, data_type)) :
+                        LOG.warn (file_description + " " + stem_name + " is not on a " + str(space_grid_shape[0]) + " by "
+                                  + str(space_grid_shape[1]) + " grid and will not be used.")
+                        continue
+                    stems_by_month.setdefault((date_time.month, variable_name, time_of_day), [ ]).append(stem_name)
+        
+        worker_pool  = None
+        map_function = map
+        if options.workers > 1 :
+            LOG.debug("Merging monthly moments with " + str(options.workers) + " worker processes.")
+            worker_pool  = multiprocessing.Pool(processes=options.workers)
+            map_function = worker_pool.map
+        
+        for climatology_key in sorted(set(climatology_stems.keys()) | set(sketch_stems.keys())) :
+            
+            month, variable_name, time_of_day = climatology_key
+            stem_names = climatology_stems.get(climatology_key, [ ])
+            LOG.debug("Calculating " + time_of_day + " climatology for month " + str(month) + " from "
+                      + str(len(stem_names)) + " years for variable: " + variable_name)
+            
+            climatology_stats = { }
+            if len(stem_names) > 0 :
+                accumulators = map_function(_load_accumulator_from_args, [(stem_name, input_path, grid_accumulators.MOMENT_FIELDS)
+                                                                          for stem_name in sorted(stem_names)])
+                climatology_accumulator = tree_reduce(accumulators, _merge_moment_accumulators_from_args, map_function=map_function)
+                climatology_stats       = calculate_accumulator_stats(climatology_accumulator)
+                climatology_stats       = dict([(stat, climatology_stats[stat]) for stat in stats])
+            if len(sketch_stems.get(climatology_key, [ ])) > 0 :
+                sketches = map_function(_load_accumulator_from_args, [(stem_name, input_path, grid_accumulators.SKETCH_FIELDS)
+                                                                      for stem_name in sorted(sketch_stems[climatology_key])])
+                climatology_sketch = tree_reduce(sketches, _merge_sketch_accumulators_from_args, map_function=map_function)
+                climatology_stats.update(calculate_percentile_stats(climatology_sketch, percentiles))
+            io_manager.save_accumulator_to_files(io_manager.build_name_stem(variable_name, date_time=datetime(2000, month, 1),
+                                                                            satellite=None, algorithm=None,
+                                                                            suffix=io_manager.SUFFIXES_BY_TIME_OF_DAY[time_of_day][io_manager.CLIMATOLOGY_FILE],
+                                                                            date_format=io_manager.CLIMATOLOGY_STAMP_FORMAT),
+                                                 space_grid_shape, output_path,
+                                                 dict([(stat, stat_data.astype(TEMP_DATA_TYPE)) for stat, stat_data in climatology_stats.items()]))
+        
+        if worker_pool is not None :
+            worker_pool.close()
+            worker_pool.join()
     
     # all the local public functions are considered part of the application, collect them up
     commands.update(dict(x for x in locals().items() if x[0] not in prior))    
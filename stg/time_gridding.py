@@ -19,7 +19,8 @@ import numpy
 
 def create_sample_size_cutoff_mask (data_array, nobs_array,
                                     overall_nobs_array,
-                                    fixed_cutoff=None, dynamic_std_cutoff=None) :
+                                    fixed_cutoff=None, dynamic_std_cutoff=None,
+                                    overall_nobs_mean=None, overall_nobs_std=None) :
     """
     given a data array, a matching number of observations array, and an overall number of observations
     for the full time period, create a mask of which data cells should be discarded from this data set.
@@ -28,6 +29,9 @@ def create_sample_size_cutoff_mask (data_array, nobs_array,
     observations to be excluded) or a dynamic standard deviation range (ie. dynamic_std_cutoff=1.0
     would cause any observations more than one standard deviation less than the overall mean for that
     cell to be excluded).
+    
+    If the mean and standard deviation of the overall number of observations are already known (ie.
+    from update_running_nobs_stats), they can be passed in and the overall nobs array may be None.
     """
     
     # start out by assuming all our data is good
@@ -40,8 +44,8 @@ def create_sample_size_cutoff_mask (data_array, nobs_array,
     # if we have a dynamic cutoff, apply that
     if dynamic_std_cutoff is not None :
         
-        mean_overall_nobs = numpy.mean(overall_nobs_array, axis=0)
-        std_overall_nobs  = numpy.std (overall_nobs_array, axis=0)
+        mean_overall_nobs = numpy.mean(overall_nobs_array, axis=0) if overall_nobs_mean is None else overall_nobs_mean
+        std_overall_nobs  = numpy.std (overall_nobs_array, axis=0) if overall_nobs_std  is None else overall_nobs_std
         cutoff_values     = mean_overall_nobs - (std_overall_nobs * dynamic_std_cutoff)
         
         bad_data_mask[nobs_array < cutoff_values] = True
@@ -49,7 +53,8 @@ def create_sample_size_cutoff_mask (data_array, nobs_array,
     return bad_data_mask
 
 def calculate_partial_weighted_time_average (daily_data_array, daily_nobs_array,
-                                             overall_sum_num_measurments_array, overall_sum_nobs_array) :
+                                             overall_sum_num_measurments_array, overall_sum_nobs_array,
+                                             good_measurments_this_day=None) :
     """
     given a set of daily data and their matching number of observations array as well as the
     sum of the overall number of measurments and number of observations per cell (ie. the collapsed
@@ -57,17 +62,79 @@ def calculate_partial_weighted_time_average (daily_data_array, daily_nobs_array,
     day to the weighted time average
     
     Note: to calculate the weighted time average over the full period, add up all of the daily
-    partial weighted time averages in that period
+    partial weighted time averages in that period and divide each cell's sum by the number of
+    days that contributed to that cell
+    
+    if the number of good measurments this day is already known, it can be passed in; this
+    lets the daily data be a 2D array of daily means instead of the daily space gridded data
     """
     
-    good_measurments_this_day = numpy.sum(numpy.isfinite(daily_data_array), axis=0)
+    if good_measurments_this_day is None :
+        good_measurments_this_day = numpy.sum(numpy.isfinite(daily_data_array), axis=0)
     this_day_weighted_average = ( (daily_data_array * (good_measurments_this_day / daily_nobs_array))
                                 / (overall_sum_num_measurments_array / overall_sum_nobs_array) )
     
     return this_day_weighted_average
 
+# the pieces of the running statistics kept about the daily number of observations
+NOBS_DAYS_KEY = "days"
+NOBS_MEAN_KEY = "mean"
+NOBS_M2_KEY   = "m2"
 
+def create_running_nobs_stats (grid_shape) :
+    """
+    create empty running statistics of the daily number of observations for a grid of the given shape
+    """
+    
+    return {
+            NOBS_DAYS_KEY: 0,
+            NOBS_MEAN_KEY: numpy.zeros(grid_shape, dtype=numpy.float64),
+            NOBS_M2_KEY:   numpy.zeros(grid_shape, dtype=numpy.float64),
+           }
 
+def update_running_nobs_stats (running_stats, nobs_array) :
+    """
+    add one day's number of observations to the running statistics, using Welford's update
+    
+    the running statistics are modified in place and returned
+    """
+    
+    running_stats[NOBS_DAYS_KEY] += 1
+    delta = nobs_array - running_stats[NOBS_MEAN_KEY]
+    running_stats[NOBS_MEAN_KEY] += delta / running_stats[NOBS_DAYS_KEY]
+    running_stats[NOBS_M2_KEY]   += delta * (nobs_array - running_stats[NOBS_MEAN_KEY])
+    
+    return running_stats
 
+def remove_from_running_nobs_stats (running_stats, nobs_array) :
+    """
+    take one day's number of observations back out of the running statistics, undoing
+    update_running_nobs_stats for that day
+    
+    the running statistics are modified in place and returned
+    """
+    
+    running_stats[NOBS_DAYS_KEY] -= 1
+    if running_stats[NOBS_DAYS_KEY] <= 0 :
+        running_stats[NOBS_DAYS_KEY] = 0
+        running_stats[NOBS_MEAN_KEY][:] = 0.0
+        running_stats[NOBS_M2_KEY][:]   = 0.0
+        return running_stats
+    
+    old_mean = running_stats[NOBS_MEAN_KEY].copy()
+    running_stats[NOBS_MEAN_KEY] -= (nobs_array - old_mean) / running_stats[NOBS_DAYS_KEY]
+    running_stats[NOBS_M2_KEY]   -= (nobs_array - running_stats[NOBS_MEAN_KEY]) * (nobs_array - old_mean)
+    
+    return running_stats
 
-
+def calculate_running_nobs_stats (running_stats) :
+    """
+    get the mean and standard deviation of the daily number of observations from the running statistics
+    
+    these match numpy.mean and numpy.std of the stack of daily nobs arrays
+    """
+    
+    if running_stats[NOBS_DAYS_KEY] <= 0 :
+        return running_stats[NOBS_MEAN_KEY].copy(), numpy.zeros(running_stats[NOBS_M2_KEY].shape, dtype=numpy.float64)
+    
+    return running_stats[NOBS_MEAN_KEY].copy(), numpy.sqrt(numpy.maximum(running_stats[NOBS_M2_KEY], 0.0) / running_stats[NOBS_DAYS_KEY])
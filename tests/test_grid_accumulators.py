@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Check the grid accumulators against plain numpy calculations on small random grids.
+"""
+__docformat__ = "restructuredtext en"
+
+import warnings
+
+import numpy
+
+from stg.constants import *
+import stg.grid_accumulators as grid_accumulators
+import stg.space_gridding    as space_gridding
+
+GRID_LON_SIZE = 6
+GRID_LAT_SIZE = 4
+NUM_CELLS     = GRID_LON_SIZE * GRID_LAT_SIZE
+
+def _random_observations (random_state, num_values, num_cells=NUM_CELLS) :
+    """make random values and cell ids, leaving the last cell empty
+    """
+    
+    values   = random_state.normal(10.0, 3.0, size=num_values).astype(numpy.float32)
+    cell_ids = random_state.randint(0, num_cells - 1, size=num_values).astype(numpy.int64)
+    
+    return values, cell_ids
+
+def _reference_cube (values, cell_ids, num_cells=NUM_CELLS) :
+    """stack the values in each cell into a (depth, number of cells) array, with NaNs where there is no data
+    """
+    
+    counts = numpy.bincount(cell_ids, minlength=num_cells)
+    cube   = numpy.empty((numpy.max(counts), num_cells), dtype=numpy.float64)
+    cube.fill(numpy.nan)
+    for cell_id in range(num_cells) :
+        cell_values = values[cell_ids == cell_id]
+        cube[:cell_values.size, cell_id] = cell_values
+    
+    return cube
+
+def _moment_accumulator (values, cell_ids, grid_lon_size=GRID_LON_SIZE, grid_lat_size=GRID_LAT_SIZE) :
+    """make a moment accumulator covering the whole grid for values in the order they were observed
+    """
+    
+    order = space_gridding.calculate_cell_order(cell_ids)
+    
+    return grid_accumulators.expand_accumulator(grid_accumulators.calculate_moment_accumulator(grid_lon_size, grid_lat_size,
+                                                                                               values[order], cell_ids[order]),
+                                                grid_lon_size, grid_lat_size)
+
+def test_merged_moments_match_numpy () :
+    """merging the moments of pieces of the data gives numpy's mean, variance, min and max of all of it
+    """
+    
+    random_state     = numpy.random.RandomState(17)
+    values, cell_ids = _random_observations(random_state, 3000)
+    cube             = _reference_cube(values, cell_ids)
+    
+    # each piece also has one observation without finite data in the otherwise empty last cell
+    accumulator = grid_accumulators.create_moment_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE)
+    for piece in numpy.array_split(numpy.arange(values.size), 7) :
+        order = space_gridding.calculate_cell_order(cell_ids[piece])
+        nobs_cells, nobs_counts = numpy.unique(numpy.append(cell_ids[piece], NUM_CELLS - 1), return_counts=True)
+        granule = grid_accumulators.calculate_moment_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                 values[piece][order], cell_ids[piece][order],
+                                                                 nobs_cells, nobs_counts)
+        assert numpy.array_equal(granule[grid_accumulators.SPARSE_CELLS_FIELD], nobs_cells)
+        assert granule[grid_accumulators.COUNT_FIELD].shape == (1, nobs_cells.size)
+        grid_accumulators.merge_moment_accumulators(accumulator, granule)
+    mean, std, minimum, maximum = grid_accumulators.calculate_moment_stats(accumulator)
+    
+    # numpy warns about the empty cell
+    with warnings.catch_warnings() :
+        warnings.simplefilter("ignore", RuntimeWarning)
+        assert numpy.allclose(mean.ravel(),     numpy.nanmean(cube, axis=0), equal_nan=True)
+        assert numpy.allclose(std.ravel() ** 2, numpy.nanvar(cube, axis=0),  equal_nan=True)
+        assert numpy.allclose(minimum.ravel(),  numpy.nanmin(cube, axis=0),  equal_nan=True)
+        assert numpy.allclose(maximum.ravel(),  numpy.nanmax(cube, axis=0),  equal_nan=True)
+    assert numpy.array_equal(accumulator[grid_accumulators.COUNT_FIELD].ravel(), numpy.sum(numpy.isfinite(cube), axis=0))
+    expected_nobs     = numpy.bincount(cell_ids, minlength=NUM_CELLS)
+    expected_nobs[-1] = 7
+    assert numpy.array_equal(accumulator[grid_accumulators.NOBS_FIELD].ravel(), expected_nobs)
+
+def test_cube_and_ragged_moments_match_one_pass () :
+    """reading packed and ragged grids a block at a time gives the same moments as one pass over the data
+    """
+    
+    random_state     = numpy.random.RandomState(23)
+    values, cell_ids = _random_observations(random_state, 500)
+    expected         = _moment_accumulator(values, cell_ids)
+    
+    cube          = _reference_cube(values, cell_ids).reshape((-1, GRID_LON_SIZE, GRID_LAT_SIZE))
+    from_cube     = grid_accumulators.calculate_moment_accumulator_from_cube(cube.astype(numpy.float32), block_layers=3)
+    offsets, ragged_values = space_gridding.pack_ragged_grid(GRID_LON_SIZE, GRID_LAT_SIZE, values, cell_ids)
+    from_ragged   = grid_accumulators.calculate_moment_accumulator_from_ragged(offsets, ragged_values, block_size=37)
+    
+    for field_name in grid_accumulators.MOMENT_FIELDS :
+        assert numpy.allclose(from_cube[field_name],   expected[field_name], equal_nan=True)
+        assert numpy.allclose(from_ragged[field_name], expected[field_name], equal_nan=True)
+
+def test_coarsening_matches_gridding_at_the_coarser_resolution () :
+    """with an odd factor, each coarsened cell holds exactly the observations gridded into that cell at the coarser resolution
+    """
+    
+    random_state = numpy.random.RandomState(5)
+    num_values   = 20000
+    aux_data     = {
+                    LON_KEY:        random_state.uniform(-180.0, 180.0, size=num_values),
+                    LAT_KEY:        random_state.uniform( -90.0,  90.0, size=num_values),
+                    DAY_MASK_KEY:   numpy.ones(num_values, dtype=bool),
+                    NIGHT_MASK_KEY: numpy.zeros(num_values, dtype=bool),
+                   }
+    values       = random_state.normal(size=num_values).astype(numpy.float32)
+    
+    accumulators = [ ]
+    for grid_degrees in [10.0, 30.0] :
+        grid_lon_size, grid_lat_size = space_gridding.calculate_grid_shape(grid_degrees)
+        lon_indexes, lat_indexes, _, _ = space_gridding.calculate_index_from_nav_data(aux_data, grid_degrees)
+        cell_ids = space_gridding.calculate_cell_ids(lon_indexes, lat_indexes, grid_lat_size)
+        accumulators.append(_moment_accumulator(values, cell_ids, grid_lon_size, grid_lat_size))
+    fine, coarse = accumulators
+    
+    coarsened = grid_accumulators.coarsen_moment_accumulator(fine, 3)
+    
+    assert numpy.array_equal(coarsened[grid_accumulators.COUNT_FIELD], coarse[grid_accumulators.COUNT_FIELD])
+    for field_name in [grid_accumulators.SUM_FIELD, grid_accumulators.M2_FIELD,
+                       grid_accumulators.MIN_FIELD, grid_accumulators.MAX_FIELD] :
+        assert numpy.allclose(coarsened[field_name], coarse[field_name], equal_nan=True)
+
+def test_sparse_histograms_merge_into_numpy_histograms () :
+    """sparse per granule histograms merge into the same counts numpy.histogram makes for each cell
+    """
+    
+    random_state     = numpy.random.RandomState(31)
+    values, cell_ids = _random_observations(random_state, 2000)
+    bin_edges        = numpy.linspace(0.0, 20.0, 9)
+    
+    accumulator = grid_accumulators.create_histogram_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE, bin_edges)
+    for piece in numpy.array_split(numpy.arange(values.size), 5) :
+        granule = grid_accumulators.calculate_histogram_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                   values[piece], cell_ids[piece], bin_edges)
+        assert grid_accumulators.is_sparse_accumulator(granule)
+        in_range = (values[piece] >= bin_edges[0]) & (values[piece] <= bin_edges[-1])
+        assert numpy.array_equal(granule[grid_accumulators.SPARSE_CELLS_FIELD], numpy.unique(cell_ids[piece][in_range]))
+        grid_accumulators.merge_histogram_accumulators(accumulator, granule)
+    
+    counts = accumulator[grid_accumulators.COUNTS_FIELD].reshape((bin_edges.size - 1, NUM_CELLS))
+    for cell_id in range(NUM_CELLS) :
+        expected, _ = numpy.histogram(values[cell_ids == cell_id], bins=bin_edges)
+        assert numpy.array_equal(counts[:, cell_id], expected)
+
+def test_histogram_percentiles_skip_empty_end_bins () :
+    """the 0th and 100th percentiles are the outer edges of the non-empty bins, and the median is in the bin numpy's is in
+    """
+    
+    random_state     = numpy.random.RandomState(37)
+    values, cell_ids = _random_observations(random_state, 2000)
+    values           = numpy.clip(values, 5.5, 14.5)
+    bin_edges        = numpy.linspace(0.0, 20.0, 9)
+    
+    accumulator = grid_accumulators.create_histogram_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE, bin_edges)
+    grid_accumulators.merge_histogram_accumulators(accumulator,
+                                                   grid_accumulators.calculate_histogram_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                                                     values, cell_ids, bin_edges))
+    percentiles = grid_accumulators.calculate_histogram_percentiles(accumulator, [0.0, 50.0, 100.0]).reshape((3, NUM_CELLS))
+    
+    # the first two bins and the last two are empty in every cell
+    assert numpy.allclose(percentiles[0, :-1], 5.0)
+    assert numpy.allclose(percentiles[2, :-1], 15.0)
+    for cell_id in range(NUM_CELLS - 1) :
+        median_bin = numpy.searchsorted(bin_edges, numpy.median(values[cell_ids == cell_id]), side='right') - 1
+        assert bin_edges[median_bin] <= percentiles[1, cell_id] <= bin_edges[median_bin + 1]
+    assert numpy.all(numpy.isnan(percentiles[:, -1]))
+
+def test_merged_categories_match_numpy () :
+    """sparse per granule category counts merge into the number of times each category value was seen in each cell
+    """
+    
+    random_state = numpy.random.RandomState(43)
+    categories   = [0, 1, 2, 4]
+    values       = random_state.randint(0, 6, size=1500).astype(numpy.float32)
+    cell_ids     = random_state.randint(0, NUM_CELLS - 1, size=1500).astype(numpy.int64)
+    
+    accumulator = grid_accumulators.create_category_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE, categories)
+    for piece in numpy.array_split(numpy.arange(values.size), 4) :
+        granule = grid_accumulators.calculate_category_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                  values[piece], cell_ids[piece], categories)
+        assert numpy.array_equal(granule[grid_accumulators.SPARSE_CELLS_FIELD],
+                                 numpy.unique(cell_ids[piece][numpy.in1d(values[piece], categories)]))
+        grid_accumulators.merge_category_accumulators(accumulator, granule)
+    
+    counts = accumulator[grid_accumulators.CATEGORY_COUNTS_FIELD].reshape((len(categories), NUM_CELLS))
+    for index, category in enumerate(categories) :
+        assert numpy.array_equal(counts[index], numpy.bincount(cell_ids[values == category], minlength=NUM_CELLS))
+
+def test_merged_joint_histograms_match_numpy () :
+    """sparse per granule joint histograms merge into the same counts numpy.histogram2d makes for each cell
+    """
+    
+    random_state     = numpy.random.RandomState(47)
+    x_values, cell_ids = _random_observations(random_state, 2000)
+    y_values         = random_state.uniform(0.0, 1.0, size=x_values.size).astype(numpy.float32)
+    x_bin_edges      = numpy.linspace(4.0, 16.0, 5)
+    y_bin_edges      = numpy.linspace(0.0, 1.0, 4)
+    
+    accumulator = grid_accumulators.create_joint_histogram_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE, x_bin_edges, y_bin_edges)
+    for piece in numpy.array_split(numpy.arange(x_values.size), 4) :
+        granule = grid_accumulators.calculate_joint_histogram_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                         x_values[piece], y_values[piece], cell_ids[piece],
+                                                                         x_bin_edges, y_bin_edges)
+        in_range = (x_values[piece] >= x_bin_edges[0]) & (x_values[piece] <= x_bin_edges[-1])
+        assert numpy.array_equal(granule[grid_accumulators.SPARSE_CELLS_FIELD], numpy.unique(cell_ids[piece][in_range]))
+        grid_accumulators.merge_joint_histogram_accumulators(accumulator, granule)
+    
+    counts = accumulator[grid_accumulators.JOINT_COUNTS_FIELD].reshape((-1, NUM_CELLS))
+    for cell_id in range(NUM_CELLS) :
+        in_cell     = cell_ids == cell_id
+        expected, _, _ = numpy.histogram2d(x_values[in_cell], y_values[in_cell], bins=[x_bin_edges, y_bin_edges])
+        assert numpy.array_equal(counts[:, cell_id], expected.ravel())
+
+def test_expanded_sketch_covers_the_whole_grid () :
+    """expanding a sparse accumulator puts it's columns in the touched cells and leaves the others empty
+    """
+    
+    random_state     = numpy.random.RandomState(37)
+    values, cell_ids = _random_observations(random_state, 200)
+    sparse   = grid_accumulators.calculate_sketch_accumulator(GRID_LON_SIZE, GRID_LAT_SIZE, values, cell_ids)
+    expanded = grid_accumulators.expand_accumulator(sparse, GRID_LON_SIZE, GRID_LAT_SIZE)
+    
+    touched  = numpy.unique(cell_ids)
+    weights  = expanded[grid_accumulators.SKETCH_WEIGHTS_FIELD].reshape((grid_accumulators.SKETCH_SIZE, NUM_CELLS))
+    minimum  = expanded[grid_accumulators.MIN_FIELD].reshape((1, NUM_CELLS))
+    assert grid_accumulators.SPARSE_CELLS_FIELD not in expanded
+    assert numpy.array_equal(numpy.sum(weights, axis=0), numpy.bincount(cell_ids, minlength=NUM_CELLS))
+    assert numpy.array_equal(minimum[:, touched], sparse[grid_accumulators.MIN_FIELD])
+    assert numpy.all(numpy.isnan(numpy.delete(minimum, touched, axis=1)))
+
+def test_merged_sketch_percentiles_are_close_to_numpy () :
+    """compressing many merged sketches keeps every observation and estimates percentiles close to numpy's
+    """
+    
+    random_state = numpy.random.RandomState(41)
+    percentiles  = [0.0, 5.0, 25.0, 50.0, 75.0, 95.0, 100.0]
+    num_cells    = 3
+    values       = numpy.concatenate([random_state.normal(size=4000),
+                                      random_state.lognormal(size=4000),
+                                      random_state.uniform(size=4000)]).astype(numpy.float32)
+    cell_ids     = numpy.repeat(numpy.arange(num_cells), 4000)
+    shuffled     = random_state.permutation(values.size)
+    values, cell_ids = values[shuffled], cell_ids[shuffled]
+    
+    accumulator = grid_accumulators.create_sketch_accumulator(num_cells, 1)
+    for piece in numpy.array_split(numpy.arange(values.size), 200) :
+        grid_accumulators.merge_sketch_accumulators(accumulator,
+                                                    grid_accumulators.calculate_sketch_accumulator(num_cells, 1, values[piece], cell_ids[piece]))
+    estimates = grid_accumulators.calculate_sketch_percentiles(accumulator, percentiles).reshape((len(percentiles), num_cells))
+    
+    weights   = accumulator[grid_accumulators.SKETCH_WEIGHTS_FIELD].reshape((grid_accumulators.SKETCH_SIZE, num_cells))
+    means     = accumulator[grid_accumulators.SKETCH_MEANS_FIELD].reshape((grid_accumulators.SKETCH_SIZE, num_cells))
+    for cell_id in range(num_cells) :
+        cell_values = numpy.sort(values[cell_ids == cell_id])
+        has_weight  = weights[:, cell_id] > 0
+        
+        # no observations are lost and the centroids stay in order
+        assert numpy.sum(weights[:, cell_id]) == cell_values.size
+        assert numpy.all(numpy.diff(means[has_weight, cell_id]) >= 0)
+        
+        # the ends are exact and the estimates rank within a percent or so of where they should
+        expected = numpy.nanpercentile(cell_values, percentiles)
+        assert estimates[0,  cell_id] == expected[0]
+        assert estimates[-1, cell_id] == expected[-1]
+        ranks    = numpy.searchsorted(cell_values, estimates[:, cell_id]) * 100.0 / cell_values.size
+        assert numpy.all(numpy.abs(ranks - percentiles) <= 1.5)
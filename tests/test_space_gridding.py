@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Check the space gridding against plain numpy calculations on small random grids.
+"""
+__docformat__ = "restructuredtext en"
+
+import numpy
+
+import stg.space_gridding as space_gridding
+
+GRID_LON_SIZE = 5
+GRID_LAT_SIZE = 3
+NUM_CELLS     = GRID_LON_SIZE * GRID_LAT_SIZE
+
+def _random_granule (random_state) :
+    """make the data and lon/lat indexes of a small random granule, with some missing data
+    """
+    
+    num_values  = random_state.randint(20, 60)
+    data        = random_state.normal(size=num_values).astype(numpy.float32)
+    data[random_state.uniform(size=num_values) < 0.2] = numpy.nan
+    lon_indexes = random_state.randint(0, GRID_LON_SIZE, size=num_values)
+    lat_indexes = random_state.randint(0, GRID_LAT_SIZE, size=num_values)
+    
+    return data, lon_indexes, lat_indexes
+
+def test_space_grid_data_matches_a_loop () :
+    """each cell's finite values go down it's column in the order they were observed
+    """
+    
+    random_state = numpy.random.RandomState(1)
+    data, lon_indexes, lat_indexes = _random_granule(random_state)
+    
+    space_grid, density_map, nobs_map, max_depth = space_gridding.space_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                                  data, lon_indexes, lat_indexes)
+    
+    expected_nobs    = numpy.zeros((GRID_LON_SIZE, GRID_LAT_SIZE))
+    expected_columns = dict([((lon_index, lat_index), [ ]) for lon_index in range(GRID_LON_SIZE)
+                                                           for lat_index in range(GRID_LAT_SIZE)])
+    for value, lon_index, lat_index in zip(data, lon_indexes, lat_indexes) :
+        expected_nobs[lon_index, lat_index] += 1
+        if numpy.isfinite(value) :
+            expected_columns[(lon_index, lat_index)].append(value)
+    
+    assert max_depth == max(len(column) for column in expected_columns.values())
+    assert space_grid.shape == (max_depth, GRID_LON_SIZE, GRID_LAT_SIZE)
+    assert numpy.array_equal(nobs_map, expected_nobs)
+    for (lon_index, lat_index), column in expected_columns.items() :
+        assert density_map[lon_index, lat_index] == len(column)
+        assert list(space_grid[:len(column), lon_index, lat_index]) == column
+        assert numpy.all(numpy.isnan(space_grid[len(column):, lon_index, lat_index]))
+
+def test_granule_layout_matches_space_grid_data () :
+    """the layout gathers the masked data in the same order space_grid_data sorts it, and counts the same nobs
+    """
+    
+    random_state = numpy.random.RandomState(5)
+    data, lon_indexes, lat_indexes = _random_granule(random_state)
+    mask = random_state.uniform(size=data.size) < 0.7
+    
+    layout = space_gridding.calculate_granule_layout(GRID_LON_SIZE, GRID_LAT_SIZE, mask, lon_indexes[mask], lat_indexes[mask])
+    expected_grid, _, expected_nobs, _ = space_gridding.space_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                        data[mask], lon_indexes[mask], lat_indexes[mask])
+    space_grid, _, _, _ = space_gridding.space_grid_sorted_data(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                                space_gridding.gather_sorted_data(layout, data),
+                                                                layout[space_gridding.CELL_IDS_KEY])
+    
+    assert numpy.all(layout[space_gridding.NOBS_COUNTS_KEY] > 0)
+    assert numpy.array_equal(space_gridding.expand_nobs_map(layout, GRID_LON_SIZE, GRID_LAT_SIZE), expected_nobs)
+    assert numpy.allclose(space_grid, expected_grid, rtol=0.0, atol=0.0, equal_nan=True)
+
+def test_pack_space_grid_matches_a_loop () :
+    """packing a stack of granule grids moves each column's finite values to the top, in order
+    """
+    
+    random_state = numpy.random.RandomState(2)
+    
+    layers, densities = [ ], [ ]
+    for _ in range(4) :
+        space_grid, density_map, _, _ = space_gridding.space_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE, *_random_granule(random_state))
+        layers.append(space_grid)
+        densities.append(density_map)
+    stacked = numpy.concatenate(layers)
+    
+    packed  = space_gridding.pack_space_grid(stacked, numpy.array(densities))
+    
+    assert packed.shape[0] == numpy.max(numpy.sum(densities, axis=0))
+    for lon_index in range(GRID_LON_SIZE) :
+        for lat_index in range(GRID_LAT_SIZE) :
+            column = stacked[:, lon_index, lat_index]
+            column = column[numpy.isfinite(column)]
+            assert numpy.array_equal(packed[:column.size, lon_index, lat_index], column)
+            assert numpy.all(numpy.isnan(packed[column.size:, lon_index, lat_index]))
+
+def test_ragged_round_trip_matches_pack_space_grid () :
+    """unpacking a ragged grid made from several granules gives the same cube pack_space_grid makes
+    """
+    
+    random_state = numpy.random.RandomState(3)
+    
+    layers, densities, values, cell_ids = [ ], [ ], [ ], [ ]
+    for _ in range(4) :
+        data, lon_indexes, lat_indexes = _random_granule(random_state)
+        
+        space_grid, density_map, _, _ = space_gridding.space_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE, data, lon_indexes, lat_indexes)
+        layers.append(space_grid)
+        densities.append(density_map)
+        
+        sorted_values, sorted_cell_ids, _ = space_gridding.ragged_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE, data, lon_indexes, lat_indexes)
+        values.append(sorted_values)
+        cell_ids.append(sorted_cell_ids)
+    
+    packed  = space_gridding.pack_space_grid(numpy.concatenate(layers), numpy.array(densities))
+    offsets, ragged_values = space_gridding.pack_ragged_grid(GRID_LON_SIZE, GRID_LAT_SIZE,
+                                                             numpy.concatenate(values), numpy.concatenate(cell_ids))
+    unpacked = space_gridding.unpack_ragged_grid(offsets, ragged_values)
+    
+    assert offsets.shape == (GRID_LON_SIZE, GRID_LAT_SIZE)
+    assert unpacked.shape == packed.shape
+    assert numpy.array_equal(numpy.isnan(unpacked), numpy.isnan(packed))
+    assert numpy.array_equal(unpacked[numpy.isfinite(unpacked)], packed[numpy.isfinite(packed)])
+
+def test_scattered_granules_match_pack_space_grid () :
+    """scattering granules straight into a packed array gives the same cube pack_space_grid makes
+    """
+    
+    random_state = numpy.random.RandomState(4)
+    
+    layers, densities, granules = [ ], [ ], [ ]
+    for _ in range(4) :
+        data, lon_indexes, lat_indexes = _random_granule(random_state)
+        space_grid, density_map, _, _ = space_gridding.space_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE, data, lon_indexes, lat_indexes)
+        layers.append(space_grid)
+        densities.append(density_map)
+        granules.append(space_gridding.ragged_grid_data(GRID_LON_SIZE, GRID_LAT_SIZE, data, lon_indexes, lat_indexes))
+    packed = space_gridding.pack_space_grid(numpy.concatenate(layers), numpy.array(densities))
+    
+    scattered   = numpy.empty((packed.shape[0], NUM_CELLS), dtype=numpy.float32)
+    scattered.fill(numpy.nan)
+    cell_depths = numpy.zeros(NUM_CELLS, dtype=numpy.int64)
+    for sorted_values, sorted_cell_ids, _ in granules :
+        space_gridding.scatter_sorted_data(scattered, cell_depths, sorted_values, sorted_cell_ids)
+    
+    assert numpy.array_equal(cell_depths, numpy.sum(densities, axis=0).ravel())
+    assert numpy.allclose(scattered.reshape(packed.shape), packed, rtol=0.0, atol=0.0, equal_nan=True)
+
+def test_reservoir_keeps_everything_until_full () :
+    """values go in the cells in the order they arrive while there's room
+    """
+    
+    random_state = numpy.random.RandomState(7)
+    packed_data  = numpy.empty((4, NUM_CELLS), dtype=numpy.float32)
+    packed_data.fill(numpy.nan)
+    cell_counts  = numpy.zeros(NUM_CELLS, dtype=numpy.int64)
+    
+    sorted_values   = numpy.arange(3, dtype=numpy.float32)
+    sorted_cell_ids = numpy.array([2, 2, 6])
+    space_gridding.reservoir_scatter_sorted_data(packed_data, cell_counts, sorted_values, sorted_cell_ids, random_state)
+    
+    assert list(packed_data[:2, 2]) == [0.0, 1.0]
+    assert packed_data[0, 6] == 2.0
+    assert numpy.sum(numpy.isfinite(packed_data)) == 3
+    assert list(cell_counts[[2, 6]]) == [2, 1]
+
+def test_reservoir_sample_is_uniform () :
+    """once a cell is full, every value seen in it is equally likely to be kept
+    """
+    
+    random_state = numpy.random.RandomState(11)
+    depth        = 10
+    stream_size  = 100
+    num_trials   = 4000
+    
+    # each cell is one trial that sees the same stream of values, a few at a time
+    packed_data  = numpy.empty((depth, num_trials), dtype=numpy.float32)
+    packed_data.fill(numpy.nan)
+    cell_counts  = numpy.zeros(num_trials, dtype=numpy.int64)
+    for chunk in numpy.array_split(numpy.arange(stream_size), 13) :
+        sorted_values   = numpy.tile(chunk, num_trials).astype(numpy.float32)
+        sorted_cell_ids = numpy.repeat(numpy.arange(num_trials), chunk.size)
+        space_gridding.reservoir_scatter_sorted_data(packed_data, cell_counts, sorted_values, sorted_cell_ids, random_state)
+    
+    assert numpy.all(cell_counts == stream_size)
+    assert numpy.all(numpy.isfinite(packed_data))
+    assert all(numpy.unique(packed_data[:, trial]).size == depth for trial in range(num_trials))
+    
+    # each value should be kept in depth / stream_size of the trials
+    kept_fraction = numpy.bincount(packed_data.astype(numpy.int64).ravel(), minlength=stream_size) / float(num_trials)
+    assert numpy.all(numpy.abs(kept_fraction - float(depth) / stream_size) < 0.025)
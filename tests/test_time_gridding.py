@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Check the time gridding against plain numpy calculations on small random grids.
+"""
+__docformat__ = "restructuredtext en"
+
+import numpy
+
+import stg.time_gridding as time_gridding
+
+def test_running_nobs_stats_match_numpy () :
+    """adding days one at a time to the running nobs stats gives numpy's mean and std of all the days
+    """
+    
+    random_state = numpy.random.RandomState(12)
+    daily_nobs   = random_state.poisson(50.0, size=(9, 4, 3)).astype(numpy.float64)
+    
+    running_stats = time_gridding.create_running_nobs_stats((4, 3))
+    for nobs_array in daily_nobs :
+        time_gridding.update_running_nobs_stats(running_stats, nobs_array)
+    mean, std = time_gridding.calculate_running_nobs_stats(running_stats)
+    
+    assert running_stats[time_gridding.NOBS_DAYS_KEY] == daily_nobs.shape[0]
+    assert numpy.allclose(mean, numpy.mean(daily_nobs, axis=0))
+    assert numpy.allclose(std,  numpy.std(daily_nobs, axis=0))
+
+def test_removing_days_matches_numpy () :
+    """taking days back out of the running nobs stats gives numpy's mean and std of the days left
+    """
+    
+    random_state = numpy.random.RandomState(13)
+    daily_nobs   = random_state.poisson(50.0, size=(12, 4, 3)).astype(numpy.float64)
+    
+    running_stats = time_gridding.create_running_nobs_stats((4, 3))
+    for nobs_array in daily_nobs :
+        time_gridding.update_running_nobs_stats(running_stats, nobs_array)
+    
+    removed = [7, 0, 11, 3]
+    for day_index in removed :
+        time_gridding.remove_from_running_nobs_stats(running_stats, daily_nobs[day_index])
+    kept_nobs = numpy.delete(daily_nobs, removed, axis=0)
+    mean, std = time_gridding.calculate_running_nobs_stats(running_stats)
+    
+    assert running_stats[time_gridding.NOBS_DAYS_KEY] == kept_nobs.shape[0]
+    assert numpy.allclose(mean, numpy.mean(kept_nobs, axis=0))
+    assert numpy.allclose(std,  numpy.std(kept_nobs, axis=0))
+
+def test_removing_every_day_starts_over () :
+    """taking every day back out leaves empty running nobs stats
+    """
+    
+    running_stats = time_gridding.create_running_nobs_stats((2, 2))
+    nobs_array    = numpy.full((2, 2), 5.0)
+    time_gridding.update_running_nobs_stats(running_stats, nobs_array)
+    time_gridding.remove_from_running_nobs_stats(running_stats, nobs_array)
+    mean, std = time_gridding.calculate_running_nobs_stats(running_stats)
+    
+    assert running_stats[time_gridding.NOBS_DAYS_KEY] == 0
+    assert numpy.all(mean == 0.0)
+    assert numpy.all(std  == 0.0)